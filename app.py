@@ -1,80 +1,181 @@
-from flask import Flask, request, abort
+from utils import startup  # 最先匯入：啟動耗時從這裡開始計時
+from flask import Flask, request, abort, Response
 from linebot.v3.webhooks import MessageEvent, TextMessageContent
-from linebot.v3 import WebhookHandler
+from linebot.v3 import WebhookParser
 from linebot.v3.exceptions import InvalidSignatureError
-from linebot.v3.messaging import Configuration, ApiClient, MessagingApi
-from config import config
-from database.db import init_db
+from config import config, require_valid_config
+from line_service import line_client
+from database.db import ensure_all_schemas, replay_reply_journal, preload_attendance, claim_webhook_event
 from services.message_service import MessageService
+from services.webhook_queue import WebhookQueue
+from services.event_dedup import EventDeduplicator
 from scheduler import start_scheduler
+from services import outbox
+from utils import metrics, profiler
+from utils.log import get_logger, log_context, sampler
+from utils.tenants import tenants, use, TenantLocal
+import atexit
 import logging
+import time
 import os
 
-# ✅ 設定 logger
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
+startup.mark("import")
 
-if not logger.handlers:
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter('[%(asctime)s] [%(levelname)s] %(message)s', '%Y-%m-%d %H:%M:%S')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+# ✅ 設定 logger
+logger = get_logger(__name__)
 
 # ✅ 初始化 Flask 應用
 app = Flask(__name__)
 
-# ✅ 初始化 LINE 設定
-channel_secret = config.LINE_CHANNEL_SECRET
-channel_access_token = config.LINE_CHANNEL_ACCESS_TOKEN
-
-if not channel_secret or not channel_access_token:
-    logger.error("請設定 LINE_CHANNEL_SECRET 和 LINE_CHANNEL_ACCESS_TOKEN")
-    exit(1)
+# ✅ 初始化 LINE 設定（缺少必要設定時在這裡失敗，而不是匯入 config 時）
+require_valid_config()
 
-handler = WebhookHandler(channel_secret)
-configuration = Configuration(access_token=channel_access_token)
-line_bot_api = MessagingApi(ApiClient(configuration))
+# 每個群組以自己的 channel secret 驗證簽章
+parsers = TenantLocal(lambda tenant: WebhookParser(tenant.LINE_CHANNEL_SECRET))
+# reply 與排程推播共用同一個 LINE 客戶端（連線池、限速、重試）；HTTP 連線池在第一次呼叫時才建立
+line_bot_api = line_client
 
 # 初始化訊息服務
 message_service = MessageService(line_bot_api)
 
+# ✅ 重送去重：同一個 webhookEventId 只處理一次
+event_dedup = EventDeduplicator(
+    ttl=config.WEBHOOK_DEDUP_TTL,
+    max_size=config.WEBHOOK_DEDUP_MAX,
+    shared_claim=claim_webhook_event if config.WEBHOOK_DEDUP_BACKEND == "mysql" else None,
+)
+
+def dispatch_event(event, tenant):
+    """依事件類型分派；DB、名單與 LINE API 都屬於事件所屬的群組"""
+    if isinstance(event, MessageEvent) and isinstance(event.message, TextMessageContent):
+        # 處理期間的每一行 log 都帶上 event_id / user_id
+        with use(tenant), \
+                log_context(event_id=getattr(event, "webhook_event_id", None),
+                            user_id=getattr(event.source, "user_id", None)), \
+                profiler.trace("webhook", getattr(event, "webhook_event_id", None)):
+            start = time.perf_counter()
+            message_service.handle_message(event)
+            if logger.isEnabledFor(logging.DEBUG) and sampler.allow("event_done"):
+                logger.debug("事件處理完成", extra={"latency_ms": round((time.perf_counter() - start) * 1000, 1)})
+
+def accept_event(event) -> bool:
+    """重送的事件在任何 DB / LINE API 工作之前就丟棄"""
+    if event_dedup.accept(event):
+        metrics.WEBHOOK_EVENTS.labels("accepted").inc()
+        return True
+    metrics.WEBHOOK_EVENTS.labels("duplicate").inc()
+    logger.info("略過重送的 webhook 事件: %s", getattr(event, "webhook_event_id", None))
+    return False
+
+# ✅ 背景處理模式：驗證簽章後立即回 200，事件交給 worker 執行
+webhook_queue = None
+if config.WEBHOOK_ASYNC:
+    # 佇列中放 (event, tenant)
+    webhook_queue = WebhookQueue(
+        lambda item: dispatch_event(*item),
+        workers=config.WEBHOOK_WORKERS,
+        maxsize=config.WEBHOOK_QUEUE_SIZE,
+    )
+    atexit.register(webhook_queue.shutdown, config.WEBHOOK_DRAIN_TIMEOUT)
+    metrics.QUEUE_DEPTH.set_function(webhook_queue.qsize)
+
+if config.NOTIFY_OUTBOX:
+    atexit.register(outbox.delivery.shutdown, config.WEBHOOK_DRAIN_TIMEOUT)
+
 # ✅ Webhook 路由
 @app.route("/callback", methods=['POST'])
 def callback():
+    start = time.perf_counter()
+    status = "200"
     signature = request.headers.get('X-Line-Signature')
     body = request.get_data(as_text=True)
 
+    tenant = tenants.for_webhook(body)
+    if tenant is None:
+        logger.warning("收到未設定群組的 webhook（destination 不在 TENANTS_CONFIG_PATH 中）")
+        metrics.WEBHOOK_SECONDS.labels("404").observe(time.perf_counter() - start)
+        abort(404)
+
     try:
-        handler.handle(body, signature)
+        with use(tenant):
+            for event in parsers.instance().parse(body, signature):
+                if not accept_event(event):
+                    continue
+                if webhook_queue is None:
+                    dispatch_event(event, tenant)
+                elif not webhook_queue.submit((event, tenant)):
+                    # 佇列已滿：退回同步處理，寧可慢也不丟事件
+                    logger.warning("Webhook 佇列已滿，改為同步處理")
+                    metrics.WEBHOOK_EVENTS.labels("queue_full").inc()
+                    dispatch_event(event, tenant)
     except InvalidSignatureError:
+        status = "400"
         logger.warning("Invalid signature. Check your channel access token/channel secret.")
         abort(400)
+    except Exception:
+        status = "500"
+        raise
+    finally:
+        metrics.WEBHOOK_SECONDS.labels(status).observe(time.perf_counter() - start)
 
     return 'OK'
 
-# ✅ 處理訊息事件
-@handler.add(MessageEvent, message=TextMessageContent)
-def handle_message(event):
-    """處理 LINE 訊息事件"""
-    message_service.handle_message(event)
+# ✅ Prometheus 指標
+if config.METRICS_ENABLED:
+    @app.route("/metrics", methods=['GET'])
+    def metrics_endpoint():
+        if not metrics.check_token(request.headers.get('Authorization', ''), config.METRICS_TOKEN):
+            abort(401)
+        return Response(metrics.render(), mimetype=None, content_type=metrics.CONTENT_TYPE)
+
+# ✅ 執行中切換 cProfile capture（未設定 PROFILE_ADMIN_TOKEN 時不開放；只影響收到請求的 worker）
+if config.PROFILE_ADMIN_TOKEN:
+    @app.route("/admin/profile", methods=['POST'])
+    def admin_profile():
+        if not profiler.check_admin_token(request.headers.get('X-Admin-Token', '')):
+            abort(403)
+        profiler.set_capture(request.args.get('enable', '1') not in ('0', 'false'))
+        return 'on' if profiler.capture_enabled() else 'off'
 
 # ✅ 初始化（給 Gunicorn 或本地開發使用）
-init_db()
+# 結構版本標記已是最新時只查一列，不在每次啟動時執行 DDL
+# 多群組時以下都對每個群組各做一次
+if config.DB_AUTO_MIGRATE:
+    ensure_all_schemas()
+    startup.mark("schema")
+# write-behind：上次停止前尚未寫入 DB 的回覆先補寫，統計才會包含它們
+replay_reply_journal()
+preload_attendance()  # 預先載入出席快照（preload_app 時在 master 載入一次，worker 直接沿用）
+startup.mark("attendance")
+
+def start_worker_services():
+    """
+    每個 worker 行程各自需要的背景工作（排程器執行緒）。
+    Gunicorn preload_app 時執行緒不會跟著 fork 到 worker，改由 gunicorn.conf.py 的 post_fork 呼叫。
+    """
+    if os.environ.get("RUN_SCHEDULER") == "true":
+        print("✅ Starting scheduler under Gunicorn")
+        start_scheduler()
+    else:
+        print("ℹ️ 排程器未啟動（僅在本地執行或 RUN_SCHEDULER=true 時啟動）")
+    # outbox 送出端：每個 worker 都參與 claim，不限於跑排程的 worker
+    outbox.start_delivery()
 
 def main():
     print("✅ Running local Flask server")
     # 本地執行時啟動排程器
     start_scheduler()
+    outbox.start_delivery()
     flask_config = config.get_flask_config()
     app.run(**flask_config)
 
 # ✅ 若是本地執行，跑 main()（含 scheduler 與 app.run）
-# ✅ 若是 Gunicorn，則由環境變數控制是否啟動 scheduler
+# ✅ 若是 Gunicorn，則由環境變數控制是否啟動 scheduler（preload_app 時延到 fork 之後）
 if __name__ == "__main__":
+    startup.done("app")
     main()
-elif os.environ.get("RUN_SCHEDULER") == "true":
-    print("✅ Starting scheduler under Gunicorn")
-    # Gunicorn 環境下啟動排程器
-    start_scheduler()
+elif os.environ.get("APP_PRELOADED") != "true":
+    start_worker_services()
+    startup.done("app")
 else:
-    print("ℹ️ 排程器未啟動（僅在本地執行或 RUN_SCHEDULER=true 時啟動）")
+    startup.done("app (preload)")
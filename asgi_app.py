@@ -0,0 +1,232 @@
+# asgi_app.py
+"""
+ASGI 進入點（與 app.py 並存的另一種執行方式）。
+
+與 Flask 版相同的指令邏輯（AsyncMessageService 繼承 MessageService），
+但 DB（aiomysql 連線池）、LINE API（AsyncMessagingApi）與排程任務都在 asyncio 上執行：
+等待 RDS / LINE 回應時不佔用執行緒，單一行程即可同時處理大量事件。
+
+    pip install -r requirements-asgi.txt
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5003
+
+RUN_SCHEDULER=true 時在同一個事件迴圈啟動排程器（AsyncIOScheduler）。
+"""
+from utils import startup  # 最先匯入：啟動耗時從這裡開始計時
+import os
+import time
+import asyncio
+import logging
+from linebot.v3 import WebhookParser
+from linebot.v3.exceptions import InvalidSignatureError
+from linebot.v3.webhooks import MessageEvent, TextMessageContent
+from config import config, require_valid_config
+from line_service import AsyncLineClient
+from database import async_db
+from services.async_message_service import AsyncMessageService
+from services.async_notification_service import send_ask_notification_batch, send_summary_notification_batch
+from services.event_dedup import EventDeduplicator
+from services import job_claims, outbox
+from utils import metrics, profiler
+from utils.log import get_logger, log_context, sampler
+from utils.tenants import tenants, use, TenantLocal
+import scheduler
+
+logger = get_logger(__name__)
+
+startup.mark("import")
+require_valid_config()
+
+# 每個群組以自己的 channel secret 驗證簽章
+parsers = TenantLocal(lambda tenant: WebhookParser(tenant.LINE_CHANNEL_SECRET))
+line_bot_api = AsyncLineClient()
+message_service = AsyncMessageService(line_bot_api)
+
+event_dedup = EventDeduplicator(
+    ttl=config.WEBHOOK_DEDUP_TTL,
+    max_size=config.WEBHOOK_DEDUP_MAX,
+    shared_claim=async_db.claim_webhook_event if config.WEBHOOK_DEDUP_BACKEND == "mysql" else None,
+)
+
+# WEBHOOK_ASYNC=true 時先回 200、事件在背景 task 處理；關閉時等待它們完成
+_background = set()
+metrics.QUEUE_DEPTH.set_function(lambda: len(_background))
+
+
+async def dispatch_event(event):
+    if isinstance(event, MessageEvent) and isinstance(event.message, TextMessageContent):
+        # 群組已由 callback 設定（create_task 會複製目前的 context）
+        with log_context(event_id=getattr(event, "webhook_event_id", None),
+                         user_id=getattr(event.source, "user_id", None)), \
+                profiler.trace("webhook", getattr(event, "webhook_event_id", None)):
+            start = time.perf_counter()
+            await message_service.handle_message(event)
+            if logger.isEnabledFor(logging.DEBUG) and sampler.allow("event_done"):
+                logger.debug("事件處理完成", extra={"latency_ms": round((time.perf_counter() - start) * 1000, 1)})
+
+
+async def accept_event(event) -> bool:
+    if await event_dedup.accept_async(event):
+        metrics.WEBHOOK_EVENTS.labels("accepted").inc()
+        return True
+    metrics.WEBHOOK_EVENTS.labels("duplicate").inc()
+    logger.info("略過重送的 webhook 事件: %s", getattr(event, "webhook_event_id", None))
+    return False
+
+
+async def handle_event(event):
+    if await accept_event(event):
+        await dispatch_event(event)
+
+
+async def run_slot(day, hour, minute, typ, tenant_id=None):
+    """slot 任務（coroutine 版）：收件人展開與分片 claim 與 scheduler.run_slot 相同，推播在事件迴圈上 await"""
+    tenant = scheduler.job_tenant(tenant_id)
+    job_id = scheduler._slot_job_id((day, hour, minute, typ), tenant)
+    with use(tenant), profiler.trace("job", job_id):
+        users = scheduler.slot_recipients(day, hour, minute, typ)
+        if not users:
+            return
+        send = send_summary_notification_batch if typ == "summary" else send_ask_notification_batch
+        when = scheduler.scheduled_fire_time(job_id)
+        loop = asyncio.get_running_loop()
+
+        def send_shard(shard):
+            # claim 在執行緒中輪詢；推播仍在事件迴圈上 await
+            asyncio.run_coroutine_threadsafe(send(line_bot_api, shard, fire=when), loop).result()
+
+        await asyncio.to_thread(job_claims.run_shards, job_id, users, when, send_shard)
+
+
+# ---------- HTTP ----------
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _respond(send, status, body=b"OK", content_type="text/plain; charset=utf-8"):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def callback(scope, receive, send):
+    start = time.perf_counter()
+    status = 200
+    try:
+        headers = dict(scope.get("headers") or [])
+        signature = headers.get(b"x-line-signature", b"").decode()
+        body = (await _read_body(receive)).decode("utf-8")
+        tenant = tenants.for_webhook(body)
+        if tenant is None:
+            status = 404
+            logger.warning("收到未設定群組的 webhook（destination 不在 TENANTS_CONFIG_PATH 中）")
+            await _respond(send, 404, b"Not Found")
+            return
+        try:
+            events = parsers.instance(tenant).parse(body, signature)
+        except InvalidSignatureError:
+            status = 400
+            logger.warning("Invalid signature. Check your channel access token/channel secret.")
+            await _respond(send, 400, b"Bad Request")
+            return
+
+        # 之後的 DB、名單與 LINE API 都屬於這個群組；create_task / gather 建立 task 時複製這個 context
+        with use(tenant):
+            if config.WEBHOOK_ASYNC:
+                for event in events:
+                    if len(_background) >= config.WEBHOOK_QUEUE_SIZE:
+                        # 背景工作已滿：改為直接處理，寧可慢也不丟事件
+                        metrics.WEBHOOK_EVENTS.labels("queue_full").inc()
+                        await handle_event(event)
+                        continue
+                    task = asyncio.create_task(handle_event(event))
+                    _background.add(task)
+                    task.add_done_callback(_background.discard)
+            else:
+                await asyncio.gather(*(handle_event(event) for event in events))
+        await _respond(send, 200)
+    except Exception:
+        status = 500
+        logger.exception("處理 webhook 時發生錯誤")
+        await _respond(send, 500, b"Internal Server Error")
+    finally:
+        metrics.WEBHOOK_SECONDS.labels(str(status)).observe(time.perf_counter() - start)
+
+
+async def on_startup():
+    # 多群組時以下都對每個群組各做一次
+    if config.DB_AUTO_MIGRATE:
+        await async_db.ensure_all_schemas()
+        startup.mark("schema")
+    await async_db.replay_reply_journal()
+    await async_db.preload_attendance()  # 預先載入出席快照
+    startup.mark("attendance")
+    if os.environ.get("RUN_SCHEDULER") == "true":
+        scheduler.use_asyncio(run_slot)
+        scheduler.start_scheduler()
+    # outbox 送出端沿用同步的 LINE 客戶端，在自己的執行緒池中送出
+    outbox.start_delivery()
+    startup.done(f"ASGI app（DB_BACKEND={config.DB_BACKEND}）")
+
+
+async def on_shutdown():
+    if _background:
+        await asyncio.wait(set(_background), timeout=config.WEBHOOK_DRAIN_TIMEOUT)
+    if scheduler.scheduler.running:
+        scheduler.scheduler.shutdown(wait=False)
+    await asyncio.to_thread(outbox.delivery.shutdown, config.WEBHOOK_DRAIN_TIMEOUT)
+    await line_bot_api.close()
+    await async_db.close()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await on_startup()
+            except Exception as e:
+                logger.exception("啟動失敗")
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await on_shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    path, method = scope["path"], scope["method"]
+    if path == "/callback" and method == "POST":
+        await callback(scope, receive, send)
+    elif path == "/metrics" and method == "GET" and config.METRICS_ENABLED:
+        headers = dict(scope.get("headers") or [])
+        if not metrics.check_token(headers.get(b"authorization", b"").decode(), config.METRICS_TOKEN):
+            await _respond(send, 401, b"Unauthorized")
+            return
+        await _respond(send, 200, metrics.render().encode(), metrics.CONTENT_TYPE)
+    elif path == "/admin/profile" and method == "POST" and config.PROFILE_ADMIN_TOKEN:
+        headers = dict(scope.get("headers") or [])
+        if not profiler.check_admin_token(headers.get(b"x-admin-token", b"").decode()):
+            await _respond(send, 403, b"Forbidden")
+            return
+        query = dict(p.partition("=")[::2] for p in scope.get("query_string", b"").decode().split("&") if p)
+        profiler.set_capture(query.get("enable", "1") not in ("0", "false"))
+        await _respond(send, 200, b"on" if profiler.capture_enabled() else b"off")
+    else:
+        await _respond(send, 404, b"Not Found")
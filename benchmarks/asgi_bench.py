@@ -0,0 +1,160 @@
+# asgi_bench.py
+"""
+Gunicorn/Flask 與 Uvicorn/ASGI 兩種執行方式的比較。
+
+以子行程分別啟動兩種伺服器（同一份程式、同一個本地 LINE API stub 與資料庫），
+在不同併發數下送出正確簽章的 /callback（回覆 + 統計），輸出 req/s、p50/p95/p99 延遲
+與伺服器行程的常駐記憶體（RSS，含 worker）。
+
+    pip install -r requirements-asgi.txt gunicorn
+    docker compose -f benchmarks/docker-compose.yml up -d     # 或加上 DB_BACKEND=sqlite
+    python benchmarks/asgi_bench.py --concurrency 10,100,300 --requests 2000 --stub-latency-ms 50
+
+--stub-latency-ms 模擬 LINE API 的往返時間；延遲越高，執行緒模型被佔住的情形越明顯。
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+from common import ROOT, setup_env, write_roster, make_event, signed_payload, summarize, print_table
+import line_api_stub
+
+TEXTS = ["要", "不要", "統計"]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"伺服器未在 {timeout} 秒內啟動（port {port}）")
+
+
+def rss_mb(pid):
+    """pid 與其子行程的 RSS 合計（MB，僅 Linux）"""
+    total = 0
+    pids = [pid]
+    try:
+        out = subprocess.run(["pgrep", "-P", str(pid)], capture_output=True, text=True).stdout
+        pids += [int(p) for p in out.split()]
+    except OSError:
+        pass
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+        except OSError:
+            continue
+    return total / 1024
+
+
+async def load(port, user_ids, total, concurrency):
+    import aiohttp
+    latencies = []
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(TEXTS[i % len(TEXTS)])
+
+    async def worker(session):
+        while True:
+            try:
+                text = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            body, signature = signed_payload([make_event(random.choice(user_ids), text)])
+            start = time.perf_counter()
+            async with session.post(
+                f"http://127.0.0.1:{port}/callback", data=body.encode("utf-8"),
+                headers={"X-Line-Signature": signature, "Content-Type": "application/json"},
+            ) as resp:
+                await resp.read()
+                if resp.status != 200:
+                    raise RuntimeError(f"/callback 回傳 {resp.status}")
+            latencies.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return latencies, elapsed
+
+
+def run_server(name, cmd, port, user_ids, args):
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=os.environ.copy(),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    rows = []
+    try:
+        wait_for_port(port)
+        asyncio.run(load(port, user_ids, min(50, args.requests), 10))  # 暖機
+        for concurrency in args.concurrency:
+            latencies, elapsed = asyncio.run(load(port, user_ids, args.requests, concurrency))
+            row = summarize(f"{name} c={concurrency}", latencies, elapsed)
+            row["rss_mb"] = rss_mb(proc.pid)
+            rows.append(row)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gunicorn/Flask vs Uvicorn/ASGI benchmark")
+    parser.add_argument("--requests", type=int, default=1000, help="每個併發數送出的請求數")
+    parser.add_argument("--concurrency", default="10,100,300")
+    parser.add_argument("--gunicorn-workers", type=int, default=2)
+    parser.add_argument("--gunicorn-threads", type=int, default=8)
+    parser.add_argument("--port", type=int, default=5013)
+    parser.add_argument("--stub-port", type=int, default=8089)
+    parser.add_argument("--stub-latency-ms", type=int, default=50, help="模擬 LINE API 延遲")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    args.concurrency = [int(x) for x in args.concurrency.split(",") if x.strip()]
+
+    tmpdir = tempfile.mkdtemp(prefix="badminton-asgi-bench-")
+    roster_path = os.path.join(tmpdir, "users_config.json")
+    user_ids = write_roster(roster_path, 50)
+
+    line_api_stub.serve(port=args.stub_port, latency_ms=args.stub_latency_ms)
+    # memory 後端在兩種模式下都是各 worker 各自一份，請改用 mysql 或 sqlite 比較
+    setup_env(f"http://127.0.0.1:{args.stub_port}", roster_path, RUN_SCHEDULER="false")
+
+    bind = f"127.0.0.1:{args.port}"
+    servers = [
+        ("gunicorn/flask", [sys.executable, "-m", "gunicorn", "-w", str(args.gunicorn_workers),
+                            "--threads", str(args.gunicorn_threads), "-b", bind, "app:app"]),
+        ("uvicorn/asgi", [sys.executable, "-m", "uvicorn", "asgi_app:app",
+                          "--host", "127.0.0.1", "--port", str(args.port), "--log-level", "warning"]),
+    ]
+
+    rows = []
+    for name, cmd in servers:
+        rows += run_server(name, cmd, args.port, user_ids, args)
+
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+        return
+    print_table(rows)
+    print()
+    print(f"{'case':<22}{'RSS MB':>10}")
+    for r in rows:
+        print(f"{r['name']:<22}{r['rss_mb']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
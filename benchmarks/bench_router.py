@@ -0,0 +1,60 @@
+# bench_router.py
+"""
+指令分派的微基準：比較原本的 if-chain（每則訊息串接 list + 線性 in）與 CommandRouter。
+
+    python benchmarks/bench_router.py [--n 200000]
+"""
+import os
+import sys
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 只量測分派成本，不需要真的連線；config 匯入時會檢查這些變數
+for key in ("LINE_CHANNEL_SECRET", "LINE_CHANNEL_ACCESS_TOKEN", "RDS_HOST", "RDS_USER", "RDS_PASSWORD", "RDS_DATABASE"):
+    os.environ.setdefault(key, "bench")
+
+from config import config  # noqa: E402
+from services.command_router import CommandRouter  # noqa: E402
+
+SAMPLES = {
+    "reply": "要",
+    "reply_fullwidth": "ＹＥＳ",
+    "stats": "統計",
+    "map": "map",
+    "chatter_short": "哈哈",
+    "chatter_long": "今天下班要不要先去吃個飯再過去球場？我大概六點半會到" * 2,
+}
+
+
+def legacy_route(text):
+    text = text.strip()
+    if text in config.STAT_KEYWORDS:
+        return "stats"
+    if text in config.YES_KEYWORDS + config.NO_KEYWORDS:
+        return "reply"
+    if text in config.NOTIFY_KEYWORDS:
+        return "notify"
+    if text in config.HELP_KEYWORDS:
+        return "help"
+    if text in config.MAP_KEYWORDS:
+        return "map"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=200000)
+    args = parser.parse_args()
+
+    router = CommandRouter()
+    print(f"{'sample':<18}{'legacy ns/op':>14}{'router ns/op':>14}  result")
+    for name, text in SAMPLES.items():
+        legacy = timeit.timeit(lambda: legacy_route(text), number=args.n) / args.n * 1e9
+        routed = timeit.timeit(lambda: router.route(text), number=args.n) / args.n * 1e9
+        print(f"{name:<18}{legacy:>14.0f}{routed:>14.0f}  {router.route(text)}")
+
+
+if __name__ == "__main__":
+    main()
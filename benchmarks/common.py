@@ -0,0 +1,120 @@
+# common.py
+"""基準測試共用工具：簽章 webhook payload、LINE stub、延遲統計"""
+import os
+import sys
+import json
+import time
+import uuid
+import hmac
+import base64
+import hashlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+BENCH_CHANNEL_SECRET = "bench-channel-secret"
+
+# 各指令類型的範例訊息
+COMMAND_TEXTS = {
+    "reply": ["要", "不要"],
+    "stats": ["統計"],
+    "help": ["幫助"],
+    "map": ["地圖"],
+    "chatter": ["哈哈哈", "今天誰有帶球？", "晚點到，先幫我佔場"],
+}
+
+
+def setup_env(stub_url, users_config_path, **overrides):
+    """
+    在匯入 app / config 之前呼叫：指向本地 stub 與本地資料庫。
+
+    一律覆寫（不沿用 shell 中的 RDS_* / LINE_* / SQLITE_PATH 等），即使在設定了正式環境變數的
+    shell 中執行，寫入大量資料的基準測試也不會打到正式資料庫或 LINE API。
+    本地資料庫的位置以 BENCH_RDS_*（預設為 benchmarks/docker-compose.yml 的 MySQL）與
+    BENCH_SQLITE_PATH 指定；DB_BACKEND 照常由環境變數選擇。
+    """
+    workdir = os.path.dirname(os.path.abspath(users_config_path))
+    env = {
+        "LINE_CHANNEL_SECRET": BENCH_CHANNEL_SECRET,
+        "LINE_CHANNEL_ACCESS_TOKEN": "bench-access-token",
+        "LINE_API_HOST": stub_url,
+        "USERS_CONFIG_PATH": users_config_path,
+        "TENANTS_CONFIG_PATH": "",
+        "RDS_HOST": os.getenv("BENCH_RDS_HOST", "127.0.0.1"),
+        "RDS_PORT": os.getenv("BENCH_RDS_PORT", "3307"),
+        "RDS_USER": os.getenv("BENCH_RDS_USER", "bench"),
+        "RDS_PASSWORD": os.getenv("BENCH_RDS_PASSWORD", "bench"),
+        "RDS_DATABASE": os.getenv("BENCH_RDS_DATABASE", "badminton_bench"),
+        "RDS_SSL_CA": "",
+        "RDS_REPLICA_HOSTS": "",
+        "SQLITE_PATH": os.getenv("BENCH_SQLITE_PATH", os.path.join(workdir, "bench.db")),
+        "REPLY_JOURNAL_PATH": os.path.join(workdir, "reply_journal.log"),
+    }
+    env.update({k: str(v) for k, v in overrides.items()})
+    os.environ.update(env)
+
+
+def write_roster(path, size, day="tuesday", hour=9, minute=0, typ="ask"):
+    """產生 size 人、全部在同一時段的 users_config.json，回傳 user_id 清單"""
+    users = [
+        {
+            "user_id": f"U{i:032d}",
+            "name": f"球友{i}",
+            "notification_times": [{"day": day, "hour": hour, "minute": minute, "type": typ}],
+        }
+        for i in range(size)
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"users": users}, f, ensure_ascii=False)
+    return [u["user_id"] for u in users]
+
+
+def make_event(user_id, text):
+    return {
+        "type": "message",
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "source": {"type": "user", "userId": user_id},
+        "webhookEventId": uuid.uuid4().hex.upper()[:26],
+        "deliveryContext": {"isRedelivery": False},
+        "replyToken": uuid.uuid4().hex,
+        "message": {"type": "text", "id": str(uuid.uuid4().int)[:18], "quoteToken": "q", "text": text},
+    }
+
+
+def signed_payload(events, secret=BENCH_CHANNEL_SECRET, destination="Ubench"):
+    """回傳 (body, signature)，與 LINE 平台的簽章方式相同"""
+    body = json.dumps({"destination": destination, "events": events}, ensure_ascii=False)
+    digest = hmac.new(secret.encode("utf-8"), body.encode("utf-8"), hashlib.sha256).digest()
+    return body, base64.b64encode(digest).decode("utf-8")
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(name, latencies, elapsed):
+    """latencies 為秒；回傳一行報表所需的 dict"""
+    values = sorted(latencies)
+    return {
+        "name": name,
+        "count": len(values),
+        "throughput": len(values) / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+    }
+
+
+def print_table(rows):
+    print(f"{'case':<22}{'count':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for r in rows:
+        print(f"{r['name']:<22}{r['count']:>8}{r['throughput']:>10.1f}"
+              f"{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}")
@@ -0,0 +1,127 @@
+# webhook_bench.py
+"""
+Webhook 與排程推播的基準測試。
+
+對 Flask app 送出正確簽章的 /callback 請求（回覆、統計、幫助、地圖、一般聊天），
+LINE API 由本地 stub 代替、資料庫使用本地 MySQL（見 benchmarks/docker-compose.yml），
+輸出各指令類型的吞吐量與 p50/p95/p99 延遲，並量測不同名單大小的一次提醒推播。
+
+    docker compose -f benchmarks/docker-compose.yml up -d
+    python benchmarks/webhook_bench.py --requests 200 --concurrency 4 --roster-sizes 10,100,1000
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+from common import (
+    COMMAND_TEXTS, setup_env, write_roster, make_event, signed_payload,
+    summarize, print_table,
+)
+import line_api_stub
+
+
+def bench_webhooks(app, user_ids, requests_per_case, concurrency):
+    rows = []
+    local = threading.local()
+
+    def client():
+        if not hasattr(local, "client"):
+            local.client = app.test_client()
+        return local.client
+
+    def one(text):
+        body, signature = signed_payload([make_event(random.choice(user_ids), text)])
+        start = time.perf_counter()
+        resp = client().post(
+            "/callback", data=body,
+            headers={"X-Line-Signature": signature, "Content-Type": "application/json"},
+        )
+        elapsed = time.perf_counter() - start
+        if resp.status_code != 200:
+            raise RuntimeError(f"/callback 回傳 {resp.status_code}")
+        return elapsed
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for case, texts in COMMAND_TEXTS.items():
+            inputs = [texts[i % len(texts)] for i in range(requests_per_case)]
+            start = time.perf_counter()
+            latencies = list(pool.map(one, inputs))
+            rows.append(summarize(case, latencies, time.perf_counter() - start))
+    return rows
+
+
+def bench_notification_wave(roster_path, sizes, stub_state):
+    """回傳各名單大小的 {"roster", "seconds", "line_requests", "recipients"}"""
+    from utils.roster import roster
+    import scheduler
+
+    waves = []
+    for size in sizes:
+        write_roster(roster_path, size, day="tuesday", hour=9, minute=0, typ="ask")
+        roster.refresh()
+        scheduler.schedule_from_config()
+        stub_state.reset()
+
+        start = time.perf_counter()
+        scheduler.run_slot("tue", 9, 0, "ask")
+        elapsed = time.perf_counter() - start
+
+        stats = stub_state.snapshot()["endpoints"]
+        waves.append({
+            "roster": size,
+            "seconds": round(elapsed, 3),
+            "line_requests": sum(s["requests"] for s in stats.values()),
+            "recipients": sum(s["recipients"] for s in stats.values()),
+        })
+    return waves
+
+
+def print_waves(waves):
+    print()
+    print(f"{'roster':>8}{'seconds':>10}{'LINE requests':>15}{'recipients':>12}")
+    for w in waves:
+        print(f"{w['roster']:>8}{w['seconds']:>10.3f}{w['line_requests']:>15}{w['recipients']:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook / notification benchmark")
+    parser.add_argument("--requests", type=int, default=200, help="每種指令的請求數")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--roster-sizes", default="10,100,1000")
+    parser.add_argument("--stub-port", type=int, default=8089)
+    parser.add_argument("--stub-latency-ms", type=int, default=0, help="模擬 LINE API 延遲")
+    parser.add_argument("--json", action="store_true", help="以 JSON 輸出（方便比對基準線）")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="badminton-bench-")
+    roster_path = os.path.join(tmpdir, "users_config.json")
+    user_ids = write_roster(roster_path, 50)
+
+    _, stub_state = line_api_stub.serve(port=args.stub_port, latency_ms=args.stub_latency_ms)
+    # 推播量測走 slot 任務（scheduler.run_slot），以 multicast 送出（與先前的基準線相同）
+    setup_env(f"http://127.0.0.1:{args.stub_port}", roster_path, NOTIFY_MULTICAST="true")
+
+    # 需在 setup_env 之後匯入；--json 時啟動訊息改印到 stderr，stdout 只有 JSON
+    with contextlib.redirect_stdout(sys.stderr if args.json else sys.stdout):
+        import app as app_module
+
+    rows = bench_webhooks(app_module.app, user_ids, args.requests, args.concurrency)
+    sizes = [int(x) for x in args.roster_sizes.split(",") if x.strip()]
+    waves = bench_notification_wave(roster_path, sizes, stub_state)
+
+    if args.json:
+        print(json.dumps({"webhooks": rows, "waves": waves}, ensure_ascii=False, indent=2))
+    else:
+        print_table(rows)
+        print_waves(waves)
+
+
+if __name__ == "__main__":
+    main()
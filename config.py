@@ -11,8 +11,17 @@ class Config:
     # LINE Bot 配置
     LINE_CHANNEL_SECRET = os.getenv("LINE_CHANNEL_SECRET")
     LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
+    LINE_API_HOST = os.getenv("LINE_API_HOST")  # 可為空；測試時指向本地 stub，例如 http://127.0.0.1:8089
+    LINE_HTTP_POOL_SIZE = int(os.getenv("LINE_HTTP_POOL_SIZE", "10"))        # keep-alive 連線數
+    LINE_API_RATE = float(os.getenv("LINE_API_RATE", "1000"))                # 每秒請求上限（LINE 推播上限為 2,000/s）
+    LINE_API_BURST = int(os.getenv("LINE_API_BURST", "100"))
+    LINE_API_MAX_RETRIES = int(os.getenv("LINE_API_MAX_RETRIES", "4"))       # 429 / 5xx 重試次數
+    LINE_API_BACKOFF_BASE = float(os.getenv("LINE_API_BACKOFF_BASE", "0.5")) # 退避起始秒數
+    LINE_API_BACKOFF_MAX = float(os.getenv("LINE_API_BACKOFF_MAX", "8"))     # 單次退避上限秒數
     
     # 資料庫配置
+    DB_BACKEND = os.getenv("DB_BACKEND", "mysql").lower()        # mysql / sqlite / memory
+    SQLITE_PATH = os.getenv("SQLITE_PATH", "badminton.db")       # DB_BACKEND=sqlite 時的資料庫檔案
     DB_HOST = os.getenv("RDS_HOST")
     DB_PORT = int(os.getenv("RDS_PORT", "3306"))
     DB_USER = os.getenv("RDS_USER")
@@ -20,17 +29,69 @@ class Config:
     DB_NAME = os.getenv("RDS_DATABASE")
     DB_SSL_CA = os.getenv("RDS_SSL_CA")  # 可為空
     DB_TABLE = "badminton_reply"
+
+    # 資料庫連線池配置
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))              # 每個行程的最大連線數
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))     # 連線存活上限（秒）
+    DB_POOL_PING_AFTER = int(os.getenv("DB_POOL_PING_AFTER", "30")) # 閒置超過幾秒先 ping
+    DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "10"))       # 等待可用連線的上限（秒）
+
+    # 讀取副本（DB_BACKEND=mysql）：逗號分隔的 host[:port]，統計重建與提醒前的查詢改走 replica；未設定 = 全部走 RDS_HOST
+    DB_REPLICA_HOSTS = os.getenv("RDS_REPLICA_HOSTS", "")
+    DB_REPLICA_POOL_SIZE = int(os.getenv("DB_REPLICA_POOL_SIZE", os.getenv("DB_POOL_SIZE", "5")))  # 每個 replica 的最大連線數
+    DB_REPLICA_RETRY_SECONDS = int(os.getenv("DB_REPLICA_RETRY_SECONDS", "30"))  # replica 出錯後暫停使用的秒數
+    DB_READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "5"))  # 本行程剛寫入的回覆疊加到 replica 結果的秒數
+
+    # 啟動時檢查資料表結構版本標記，過舊才執行 migration；false = 啟動時完全不碰 DB 結構（部署時自行執行 migration）
+    DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "true").lower() == "true"
+
+    # 回覆 write-behind：先寫本機 journal 並立即反映在統計，背景每 REPLY_FLUSH_INTERVAL_MS 或累積 REPLY_FLUSH_BATCH 筆時批次寫入 DB
+    REPLY_WRITE_BEHIND = os.getenv("REPLY_WRITE_BEHIND", "false").lower() == "true"
+    REPLY_JOURNAL_PATH = os.getenv("REPLY_JOURNAL_PATH", "reply_journal.log")    # 分段檔名為 <path>.<pid>.<seq>
+    REPLY_JOURNAL_FSYNC = os.getenv("REPLY_JOURNAL_FSYNC", "true").lower() == "true"
+    REPLY_FLUSH_INTERVAL_MS = int(os.getenv("REPLY_FLUSH_INTERVAL_MS", "300"))
+    REPLY_FLUSH_BATCH = int(os.getenv("REPLY_FLUSH_BATCH", "100"))
+
+    # 出席快照：本行程寫入即時更新；超過此秒數視為過期，從 DB 重建（多 worker 時的同步上限）
+    ATTENDANCE_SNAPSHOT_TTL = int(os.getenv("ATTENDANCE_SNAPSHOT_TTL", "10"))
     
     # Flask 應用配置
     FLASK_HOST = os.getenv("FLASK_HOST", "0.0.0.0")
     FLASK_PORT = int(os.getenv("FLASK_PORT", "5003"))
     FLASK_DEBUG = os.getenv("FLASK_DEBUG", "false").lower() == "true"
     
+    # Webhook 處理配置
+    WEBHOOK_ASYNC = os.getenv("WEBHOOK_ASYNC", "false").lower() == "true"  # 立即回 200，背景處理事件
+    WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+    WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "200"))
+    WEBHOOK_DRAIN_TIMEOUT = int(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "10"))  # 關閉時等待佇列清空的秒數
+    WEBHOOK_DEDUP_TTL = int(os.getenv("WEBHOOK_DEDUP_TTL", "600"))          # 記住 webhookEventId 的秒數
+    WEBHOOK_DEDUP_MAX = int(os.getenv("WEBHOOK_DEDUP_MAX", "10000"))        # 本行程去重快取上限
+    WEBHOOK_DEDUP_BACKEND = os.getenv("WEBHOOK_DEDUP_BACKEND", "memory").lower()  # memory / mysql（跨 worker）
+    
+    # 監控配置
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"  # 提供 /metrics（Prometheus 格式；各 worker 各自計數，見 README）
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN")                                # 設定後 /metrics 須帶 Authorization: Bearer <token>
+
+    # Logging 配置（寫 stderr 在背景執行緒進行，見 utils/log.py）
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()                     # text / json
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))               # 佇列滿時丟棄新的 log（計入指標）
+    LOG_SAMPLE_PER_SEC = int(os.getenv("LOG_SAMPLE_PER_SEC", "5"))           # 每則訊息的 debug log 每秒最多幾行
+
+    # 慢請求分析（見 utils/profiler.py）
+    PROFILE_SLOW_MS = int(os.getenv("PROFILE_SLOW_MS", "1000"))               # 超過即記錄各階段耗時；0 關閉
+    PROFILE_CPROFILE = os.getenv("PROFILE_CPROFILE", "false").lower() == "true"  # 以 cProfile 執行並附在明細中
+    PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+    PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))                       # PROFILE_DIR 最多保留幾份明細（所有行程合計）
+    PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN")                    # 設定後開放 POST /admin/profile
+    
     # 時區配置
     TIMEZONE = "Asia/Taipei"
     
     # 檔案路徑配置
-    USERS_CONFIG_PATH = "users_config.json"
+    USERS_CONFIG_PATH = os.getenv("USERS_CONFIG_PATH", "users_config.json")
+    TENANTS_CONFIG_PATH = os.getenv("TENANTS_CONFIG_PATH")  # 多群組設定檔（見 utils/tenants.py）；未設定 = 單一群組
     
     # 羽球活動配置
     BADMINTON_LOCATION = "臺北市信義區信義國民小學"
@@ -38,8 +99,23 @@ class Config:
     BADMINTON_DAY = "friday"
     
     # 通知配置
-    RESET_REPLIES_TIME = "21:00"  # 重置回覆狀態時間（週日）
+    RESET_REPLIES_TIME = "21:00"  # 切換到下一場次的時間（週日）
     RESET_REPLIES_DAY = "sun"
+    REPLY_RETENTION_WEEKS = int(os.getenv("REPLY_RETENTION_WEEKS", "52"))  # 保留幾週的回覆紀錄（0 = 永久保留）
+    NOTIFY_MULTICAST = os.getenv("NOTIFY_MULTICAST", "false").lower() == "true"  # 同一時段的收件人合併成 multicast（預設逐一 push）
+    NOTIFY_PUSH_WORKERS = int(os.getenv("NOTIFY_PUSH_WORKERS", "8"))             # 逐一 push 時同時送出的執行緒數
+    SCHEDULER_COORDINATION = os.getenv("SCHEDULER_COORDINATION", "none").lower()  # none / db（多 worker 同時跑排程，以 DB_BACKEND 協調；舊值 mysql 同 db）
+    SCHEDULER_SHARD_SIZE = int(os.getenv("SCHEDULER_SHARD_SIZE", "500"))          # 每個分片的收件人數
+    SCHEDULER_CLAIM_LEASE = int(os.getenv("SCHEDULER_CLAIM_LEASE", "300"))        # 分片的租約（秒）；須大於送完一個分片的時間，過期未完成由其他 worker 接手
+    SCHEDULER_CLAIM_RETRY = int(os.getenv("SCHEDULER_CLAIM_RETRY", "30"))         # 分片送出失敗後多久重試（秒）
+    SCHEDULER_CLAIM_WAIT = int(os.getenv("SCHEDULER_CLAIM_WAIT", "900"))          # 等待其他 worker 的分片完成（或接手）最多幾秒
+    NOTIFY_OUTBOX = os.getenv("NOTIFY_OUTBOX", "false").lower() == "true"        # 排程只寫入 outbox，由送出 worker 平行推播
+    OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "8"))                      # 同時送出的執行緒數
+    OUTBOX_CLAIM_BATCH = int(os.getenv("OUTBOX_CLAIM_BATCH", "100"))            # 每次 claim 的列數
+    OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "2"))        # 沒有工作時多久檢查一次（秒）
+    OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "120"))        # inflight 超過此秒數視為送出者已當掉，重新 claim
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))            # 超過後標記為 failed
+    ROSTER_RELOAD_INTERVAL = int(os.getenv("ROSTER_RELOAD_INTERVAL", "30"))      # 檢查名單檔變動的秒數（0 = 不檢查）
     
     # 回應關鍵字配置
     YES_KEYWORDS = ["要", "Yes", "yes"]
@@ -52,14 +128,23 @@ class Config:
     @classmethod
     def validate_required_configs(cls) -> bool:
         """驗證必要的配置是否已設定"""
-        required_configs = [
-            ("LINE_CHANNEL_SECRET", cls.LINE_CHANNEL_SECRET),
-            ("LINE_CHANNEL_ACCESS_TOKEN", cls.LINE_CHANNEL_ACCESS_TOKEN),
-            ("RDS_HOST", cls.DB_HOST),
-            ("RDS_USER", cls.DB_USER),
-            ("RDS_PASSWORD", cls.DB_PASSWORD),
-            ("RDS_DATABASE", cls.DB_NAME),
-        ]
+        required_configs = []
+        if cls.TENANTS_CONFIG_PATH:
+            # 多群組：LINE 憑證由各群組的設定提供
+            from utils.tenants import tenants
+            required_configs += [(name, None) for name in tenants.missing_settings()]
+        else:
+            required_configs += [
+                ("LINE_CHANNEL_SECRET", cls.LINE_CHANNEL_SECRET),
+                ("LINE_CHANNEL_ACCESS_TOKEN", cls.LINE_CHANNEL_ACCESS_TOKEN),
+            ]
+        if cls.DB_BACKEND == "mysql":
+            required_configs += [
+                ("RDS_HOST", cls.DB_HOST),
+                ("RDS_USER", cls.DB_USER),
+                ("RDS_PASSWORD", cls.DB_PASSWORD),
+                ("RDS_DATABASE", cls.DB_NAME),
+            ]
         
         missing_configs = []
         for config_name, config_value in required_configs:
@@ -105,7 +190,10 @@ class Config:
         """印出配置摘要（用於除錯）"""
         print("🔧 配置摘要:")
         print(f"  LINE Bot: {'✅' if cls.LINE_CHANNEL_SECRET and cls.LINE_CHANNEL_ACCESS_TOKEN else '❌'}")
-        print(f"  資料庫: {'✅' if cls.DB_HOST and cls.DB_USER and cls.DB_PASSWORD else '❌'}")
+        if cls.DB_BACKEND == "mysql":
+            print(f"  資料庫: {'✅' if cls.DB_HOST and cls.DB_USER and cls.DB_PASSWORD else '❌'}")
+        else:
+            print(f"  資料庫: {cls.DB_BACKEND}{' (' + cls.SQLITE_PATH + ')' if cls.DB_BACKEND == 'sqlite' else ''}")
         print(f"  Flask: {cls.FLASK_HOST}:{cls.FLASK_PORT} (debug: {cls.FLASK_DEBUG})")
         print(f"  時區: {cls.TIMEZONE}")
         print(f"  羽球地點: {cls.BADMINTON_LOCATION}")
@@ -114,6 +202,7 @@ class Config:
 # 建立全域配置實例
 config = Config()
 
-# 驗證配置
-if not config.validate_required_configs():
-    raise ValueError("配置驗證失敗，請檢查環境變數設定")
+def require_valid_config():
+    """在應用程式啟動時呼叫（不在 import 時驗證：工具程式、migration 只匯入 config 時不會因缺少 LINE 設定而失敗）"""
+    if not config.validate_required_configs():
+        raise ValueError("配置驗證失敗，請檢查環境變數設定")
@@ -0,0 +1,154 @@
+# async_db.py
+"""
+database/db.py 的非同步版本（ASGI 模式使用）。
+
+函式名稱、參數與回傳值與 db.py 相同；出席快照也共用 db.attendance，
+因此 Flask 與 ASGI 模式讀到的統計結果一致。各群組的後端共用同一個 aiomysql 連線池。
+"""
+import asyncio
+from database import db
+from database.db import attendance, REPLY_UNCHANGED
+from database.storage import get_store
+from database.async_store import create_async_store
+from utils import metrics
+from utils.date_utils import get_session_date
+from utils.tenants import TenantLocal, each
+
+_root = None
+
+
+def _create_async_store(tenant):
+    global _root
+    if _root is None:
+        _root = create_async_store()
+        # 連線池指標改看非同步連線池
+        for state in ("open", "idle", "in_use"):
+            metrics.DB_POOL.set_function(lambda state=state: _root.stats()[state], state)
+    store = get_store()
+    return _root if _root.store is store else _root.scoped(store)
+
+
+_stores = TenantLocal(_create_async_store)
+# 同一群組同時間只有一個 coroutine 重建出席快照（在事件迴圈中第一次使用時建立）
+_attendance_rebuild_locks = TenantLocal(lambda tenant: asyncio.Lock())
+
+
+def get_async_store():
+    """目前群組的非同步後端"""
+    return _stores.instance()
+
+
+async def init_db():
+    await asyncio.to_thread(db.init_db)
+
+
+async def ensure_schema():
+    return await asyncio.to_thread(db.ensure_schema)
+
+
+async def ensure_all_schemas():
+    return await asyncio.to_thread(db.ensure_all_schemas)
+
+
+async def replay_reply_journal():
+    return await asyncio.to_thread(db.replay_reply_journal)
+
+
+async def preload_attendance():
+    """啟動時預先載入各群組的出席快照"""
+    for _ in each():
+        await get_attendance()
+
+
+async def close():
+    global _root
+    if _root is not None:
+        await _root.close()
+        _root = None
+        _stores.clear()
+
+
+@metrics.timed(metrics.DB_SECONDS, "record_reply")
+async def record_reply(user_id, user_name, reply_text, session=None):
+    session = session or get_session_date()
+    if db.reply_buffer is not None:
+        # write-behind：只寫本機 journal，不必等 DB
+        outcome = db._buffer_reply(session, user_id, user_name, reply_text)
+    else:
+        outcome = await get_async_store().record_reply(session, user_id, user_name, reply_text)
+    if outcome != REPLY_UNCHANGED:
+        db._note_write(session, user_id, user_name, reply_text)
+    return outcome
+
+
+@metrics.timed(metrics.DB_SECONDS, "has_replied")
+async def has_replied(user_id, session=None):
+    session = session or get_session_date()
+    pending = db._local_reply(session, user_id)
+    if pending is not None:
+        return bool(pending[1])
+    return await get_async_store().has_replied(session, user_id)
+
+
+@metrics.timed(metrics.DB_SECONDS, "get_replied_user_ids")
+async def get_replied_user_ids(user_ids, session=None):
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return set()
+    session = session or get_session_date()
+    replied = await get_async_store().get_replied_user_ids(session, user_ids)
+    return db._with_pending_replies(session, replied, user_ids)
+
+
+@metrics.timed(metrics.DB_SECONDS, "update_reply")
+async def update_reply(user_id, reply_text, session=None):
+    session = session or get_session_date()
+    if db.reply_buffer is not None:
+        await asyncio.to_thread(db.reply_buffer.flush)
+    changed = await get_async_store().update_reply(session, user_id, reply_text)
+    if changed:
+        db._note_write(session, user_id, None, reply_text)
+    return changed
+
+
+@metrics.timed(metrics.DB_SECONDS, "load_attendance")
+async def _load_attendance_rows(session):
+    return db._overlay_rows(session, await get_async_store().load_attendance_rows(session))
+
+
+async def get_attendance(user_id=None):
+    """取得本場次的出席快照；過期時 await 重建，同時間只有一個 coroutine 查 DB（user_id 同 db.get_attendance）"""
+    session = get_session_date()
+    snapshot = attendance.instance()
+    if snapshot.is_stale(session):
+        async with _attendance_rebuild_locks.instance():
+            if snapshot.is_stale(session):
+                snapshot.begin_rebuild()
+                try:
+                    rows = await _load_attendance_rows(session)
+                except Exception:
+                    snapshot.abort_rebuild()
+                    raise
+                snapshot.finish_rebuild(rows, session)
+    if user_id and db.recent_writes is not None and db._local_reply(session, user_id) is None:
+        db._confirm_own_reply(snapshot, session, user_id, await get_async_store().get_reply(session, user_id))
+    return snapshot
+
+
+async def get_user_reply():
+    return (await get_attendance()).lists()
+
+
+@metrics.timed(metrics.DB_SECONDS, "claim_webhook_event")
+async def claim_webhook_event(event_id, ttl):
+    return await get_async_store().claim_webhook_event(event_id, ttl)
+
+
+@metrics.timed(metrics.DB_SECONDS, "claim_job_fire")
+async def claim_job_fire(job_id, fire_time, shard, owner, lease_seconds):
+    return await get_async_store().claim_job_fire(job_id, fire_time, shard, owner, lease_seconds)
+
+
+@metrics.timed(metrics.DB_SECONDS, "finish_job_fire")
+async def finish_job_fire(job_id, fire_time, shard, owner, retry_in=None):
+    return await get_async_store().finish_job_fire(job_id, fire_time, shard, owner, retry_in)
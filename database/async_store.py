@@ -0,0 +1,233 @@
+# async_store.py
+"""
+ASGI 模式的非同步後端。
+
+- mysql：aiomysql 連線池，SQL 與 MySQLStore 共用；唯讀查詢依 RDS_REPLICA_HOSTS 送到讀取副本
+  （replica 的健康狀態與同步後端共用）
+- sqlite / memory：本機操作本來就快，包一層 asyncio.to_thread 使用同步後端
+
+建表、清除舊資料等不在熱路徑上的工作一律交給同步後端（在執行緒中執行）。
+"""
+import ssl
+import asyncio
+import logging
+from config import config
+from database.storage import get_store, JOB_CLAIMED, JOB_BUSY, JOB_DONE
+from database.mysql_store import reply_outcome, REPLIED_IDS_CHUNK, PURGE_EVENTS_EVERY, REPLICA_ERRORS
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ThreadedStore:
+    """把同步後端的呼叫丟到執行緒，不卡住事件迴圈"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def __getattr__(self, name):
+        func = getattr(self.store, name)
+        if not callable(func):
+            return func
+
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(func, *args, **kwargs)
+        return call
+
+    def scoped(self, store):
+        return ThreadedStore(store)
+
+    def stats(self) -> dict:
+        return self.store.stats()
+
+    async def close(self):
+        pass
+
+
+class AsyncMySQLStore(ThreadedStore):
+    name = "mysql"
+
+    def __init__(self, store=None, parent=None):
+        """store：同一群組的同步後端（SQL 與資料表名稱取自它）；parent：持有 aiomysql 連線池的那一個"""
+        super().__init__(store or get_store())
+        self.sql = self.store.sql
+        self.replicas = self.store.replicas
+        self._parent = parent
+        self._pool = None
+        self._replica_pools = {}
+        self._pool_lock = asyncio.Lock()
+        self._dedup_claims = 0
+
+    def scoped(self, store):
+        return AsyncMySQLStore(store, parent=self._parent or self)
+
+    @staticmethod
+    async def _create_pool(host, port, maxsize):
+        import aiomysql
+        kwargs = dict(
+            host=host,
+            port=port,
+            user=config.DB_USER,
+            password=config.DB_PASSWORD,
+            db=config.DB_NAME,
+            charset="utf8mb4",
+            connect_timeout=10,
+            autocommit=False,
+            minsize=1,
+            maxsize=maxsize,
+            pool_recycle=config.DB_POOL_RECYCLE,
+        )
+        if config.DB_SSL_CA:
+            kwargs["ssl"] = ssl.create_default_context(cafile=config.DB_SSL_CA)
+        return await aiomysql.create_pool(**kwargs)
+
+    async def get_pool(self):
+        if self._parent is not None:
+            return await self._parent.get_pool()
+        if self._pool is None:
+            async with self._pool_lock:
+                if self._pool is None:
+                    self._pool = await self._create_pool(config.DB_HOST, config.DB_PORT, config.DB_POOL_SIZE)
+        return self._pool
+
+    async def _replica_pool(self, replica):
+        if self._parent is not None:
+            return await self._parent._replica_pool(replica)
+        pool = self._replica_pools.get(replica)
+        if pool is None:
+            async with self._pool_lock:
+                pool = self._replica_pools.get(replica)
+                if pool is None:
+                    pool = self._replica_pools[replica] = await self._create_pool(
+                        replica.host, replica.port, config.DB_REPLICA_POOL_SIZE)
+        return pool
+
+    def stats(self) -> dict:
+        if self._parent is not None:
+            return self._parent.stats()
+        if self._pool is None:
+            return {}
+        idle = self._pool.freesize
+        return {"size": self._pool.maxsize, "open": self._pool.size,
+                "idle": idle, "in_use": self._pool.size - idle}
+
+    async def close(self):
+        if self._parent is not None:
+            return
+        pools = list(self._replica_pools.values())
+        if self._pool is not None:
+            pools.append(self._pool)
+        for pool in pools:
+            pool.close()
+            await pool.wait_closed()
+        self._pool = None
+        self._replica_pools = {}
+
+    async def _execute(self, query, args, fetch=None, commit=False):
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            try:
+                async with conn.cursor() as c:
+                    affected = await c.execute(query, args)
+                    rows = await c.fetchall() if fetch else None
+                if commit:
+                    await conn.commit()
+                else:
+                    # autocommit=False：唯讀查詢也要結束交易，否則 Pool.release 會把 in_trans 的連線關掉，下次重連
+                    await conn.rollback()
+            except Exception:
+                await conn.rollback()
+                raise
+        return rows if fetch else affected
+
+    async def _read(self, query, args):
+        """唯讀查詢：與 MySQLStore._read 相同，有健康的 replica 時送到 replica，失敗時改查 primary"""
+        replica = self.replicas.pick() if self.replicas else None
+        if replica is not None:
+            try:
+                pool = await self._replica_pool(replica)
+                async with pool.acquire() as conn:
+                    async with conn.cursor() as c:
+                        await c.execute(query, args)
+                        rows = await c.fetchall()
+                    await conn.rollback()   # 結束唯讀交易，連線才會留在池中（同 _execute）
+                metrics.DB_READS.labels("replica").inc()
+                return rows
+            except (*REPLICA_ERRORS, OSError, asyncio.TimeoutError) as e:
+                self.replicas.mark_down(replica, e)
+            metrics.DB_READS.labels("fallback").inc()
+        else:
+            metrics.DB_READS.labels("primary").inc()
+        return await self._execute(query, args, fetch=True)
+
+    # ---------- 熱路徑 ----------
+
+    async def record_reply(self, session, user_id, user_name, reply_text):
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            try:
+                async with conn.cursor() as c:
+                    affected = await c.execute(self.sql.upsert_reply, (session, user_id, user_name, reply_text))
+                    renamed = 0
+                    if affected != 1:
+                        renamed = await c.execute(self.sql.rename_reply, (user_name, session, user_id, user_name))
+                    if affected or renamed:
+                        await c.execute(self.sql.upsert_member, (user_id, user_name))
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+        return reply_outcome(affected, renamed)
+
+    async def has_replied(self, session, user_id):
+        rows = await self._read(self.sql.has_replied, (session, user_id))
+        return rows[0][0] > 0
+
+    async def get_replied_user_ids(self, session, user_ids):
+        replied = set()
+        for i in range(0, len(user_ids), REPLIED_IDS_CHUNK):
+            chunk = user_ids[i:i + REPLIED_IDS_CHUNK]
+            query = self.sql.replied_ids.format(placeholders=", ".join(["%s"] * len(chunk)))
+            rows = await self._read(query, [session] + chunk)
+            replied.update(row[0] for row in rows)
+        return replied
+
+    async def get_reply(self, session, user_id):
+        rows = await self._execute(self.sql.own_reply, (session, user_id), fetch=True)
+        return rows[0] if rows else None
+
+    async def update_reply(self, session, user_id, reply_text):
+        affected = await self._execute(self.sql.update_reply, (reply_text, session, user_id, reply_text), commit=True)
+        return affected > 0
+
+    async def load_attendance_rows(self, session):
+        return await self._read(self.sql.attendance, (session,))
+
+    async def claim_webhook_event(self, event_id, ttl):
+        affected = await self._execute(self.sql.claim_event, (event_id, int(ttl)), commit=True)
+        self._dedup_claims += 1
+        if self._dedup_claims % PURGE_EVENTS_EVERY == 0:
+            await self._execute(self.sql.purge_events, (), commit=True)
+        return affected > 0
+
+    async def claim_job_fire(self, job_id, fire_time, shard, owner, lease_seconds):
+        key = (job_id, fire_time, shard)
+        if await self._execute(self.sql.claim_job, key + (owner, int(lease_seconds)), commit=True):
+            return JOB_CLAIMED
+        if await self._execute(self.sql.take_over_job, (owner, int(lease_seconds)) + key, commit=True):
+            return JOB_CLAIMED
+        rows = await self._execute(self.sql.job_done, key, fetch=True)
+        return JOB_DONE if rows and rows[0][0] else JOB_BUSY
+
+    async def finish_job_fire(self, job_id, fire_time, shard, owner, retry_in=None):
+        if retry_in is None:
+            await self._execute(self.sql.finish_job, (job_id, fire_time, shard), commit=True)
+        else:
+            await self._execute(self.sql.release_job, (int(retry_in), job_id, fire_time, shard, owner), commit=True)
+
+
+def create_async_store(backend=None):
+    backend = (backend or config.DB_BACKEND).lower()
+    if backend == "mysql":
+        return AsyncMySQLStore()
+    return ThreadedStore(get_store())
@@ -0,0 +1,131 @@
+# attendance.py
+"""
+出席狀態的記憶體快照（要 / 不要 / 未回應 + 人數）。
+
+- 本行程寫入回覆時即時增量更新，不必重查整張表
+- 啟動時、超過 TTL（其他 worker 可能寫入）或場次切換時，由 DB 重新建立
+- version 在內容變動時遞增，供上層快取判斷是否需要重新產生訊息
+"""
+import time
+import threading
+from config import config
+
+
+class AttendanceSnapshot:
+    def __init__(self, ttl=10, cfg=config):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._users = {}         # user_id -> [user_name, reply_text]（依出現順序）
+        self._yes = {}           # user_id -> user_name
+        self._no = {}
+        self._no_reply = {}
+        self._loaded_at = None   # None 代表尚未載入
+        self.session = None      # 快照所屬的場次
+        self._pending = None     # 重建期間的本地變更，重建完成後補套用
+        self.version = 0
+        self._yes_keywords = frozenset(cfg.YES_KEYWORDS)
+        self._no_keywords = frozenset(cfg.NO_KEYWORDS)
+
+    # ---------- 狀態 ----------
+
+    def is_stale(self, session=None) -> bool:
+        if self._loaded_at is None:
+            return True
+        if session is not None and session != self.session:
+            return True
+        return self.ttl >= 0 and time.monotonic() - self._loaded_at >= self.ttl
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    # ---------- 重建 ----------
+
+    def rebuild(self, loader, session=None):
+        """loader() 回傳 [(user_id, user_name, reply_text), ...]；DB 查詢期間不持有鎖"""
+        self.begin_rebuild()
+        try:
+            rows = loader()
+        except Exception:
+            self.abort_rebuild()
+            raise
+        self.finish_rebuild(rows, session)
+
+    def begin_rebuild(self):
+        """開始記錄本地變更；之後查詢 DB（非同步模式由呼叫端 await），再呼叫 finish_rebuild"""
+        with self._lock:
+            if self._pending is None:
+                self._pending = []
+
+    def abort_rebuild(self):
+        with self._lock:
+            self._pending = None
+
+    def finish_rebuild(self, rows, session=None):
+        with self._lock:
+            pending, self._pending = self._pending or [], None
+            self._users, self._yes, self._no, self._no_reply = {}, {}, {}, {}
+            for user_id, user_name, reply_text in rows:
+                self._set(user_id, user_name, reply_text)
+            # 查詢開始後本行程才寫入的變更，DB 結果可能還沒有，補套用一次
+            for user_id, user_name, reply_text, op_session in pending:
+                if op_session is None or op_session == session:
+                    self._set(user_id, user_name, reply_text)
+            self.session = session
+            self._loaded_at = time.monotonic()
+            self.version += 1
+
+    # ---------- 增量更新 ----------
+
+    def apply_reply(self, user_id, user_name, reply_text, session=None):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((user_id, user_name, reply_text, session))
+            if session is not None and self.session is not None and session != self.session:
+                # 其他場次的寫入與目前快照無關
+                return
+            self._set(user_id, user_name, reply_text)
+            self.version += 1
+
+    def _set(self, user_id, user_name, reply_text):
+        entry = self._users.get(user_id)
+        if entry is None:
+            if user_name is None:
+                # 不認識的使用者又沒有名字可用：下次讀取時整份重建
+                self._loaded_at = None
+                return
+            entry = self._users[user_id] = [user_name, reply_text]
+        else:
+            if user_name is not None:
+                entry[0] = user_name
+            entry[1] = reply_text
+        name = entry[0]
+
+        for bucket in (self._yes, self._no, self._no_reply):
+            bucket.pop(user_id, None)
+        if not reply_text:
+            self._no_reply[user_id] = name
+        elif reply_text in self._yes_keywords:
+            self._yes[user_id] = name
+        elif reply_text in self._no_keywords:
+            self._no[user_id] = name
+        # 其他內容：視為已回覆但不列入要/不要（與 get_user_reply 原本行為相同）
+
+    # ---------- 讀取 ----------
+
+    def reply_of(self, user_id, session=None):
+        """快照中的 (user_name, reply_text)；快照未載入、場次不同或不認識此人時回傳 None"""
+        with self._lock:
+            if self._loaded_at is None or (session is not None and session != self.session):
+                return None
+            entry = self._users.get(user_id)
+            return tuple(entry) if entry is not None else None
+
+    def lists(self):
+        """回傳 (yes_list, no_list, no_reply_list) 姓名清單"""
+        with self._lock:
+            return list(self._yes.values()), list(self._no.values()), list(self._no_reply.values())
+
+    def counts(self) -> dict:
+        with self._lock:
+            return {"yes": len(self._yes), "no": len(self._no), "no_reply": len(self._no_reply)}
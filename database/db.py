@@ -1,213 +1,323 @@
-# db_mysql.py
+# db.py
+"""
+資料存取的模組介面。實際的儲存由 DB_BACKEND 選出的後端負責（見 database/storage.py）；
+這裡負責場次預設值、出席快照與指標。
+
+多群組時一律作用在目前群組（utils/tenants.py）：後端、出席快照、write-behind 緩衝都是每個群組各一份。
+
+有讀取副本（RDS_REPLICA_HOSTS）時，唯讀查詢由後端送到 replica；本行程剛寫入的回覆由 recent_writes
+疊加到查詢結果上，查詢「統計」時再以 primary 確認查詢者本人的回覆（read-your-writes）。
+"""
 import os
-import json
+import atexit
 import logging
-from datetime import datetime
-import pymysql
+from datetime import timedelta
+import threading
 from config import config
+from database.attendance import AttendanceSnapshot
+from database.reply_buffer import ReplyBuffer
+from database.replicas import RecentWrites
+# 回傳值由 storage 定義（各後端共用）；資料表名稱、JOB_* 等請直接由 database.storage 匯入
+from database.storage import (
+    get_store, root_store, SCHEMA_VERSION,
+    REPLY_INSERTED, REPLY_UPDATED, REPLY_RENAMED, REPLY_UNCHANGED,
+)
+from utils.roster import roster
+from utils import metrics
+from utils.date_utils import get_session_date
+from utils.tenants import TenantLocal, use, each
 
 # 設定 logger
 logger = logging.getLogger(__name__)
 
-# 使用配置管理系統
-DB_HOST = config.DB_HOST
-DB_PORT = config.DB_PORT
-DB_USER = config.DB_USER
-DB_PASSWORD = config.DB_PASSWORD
-DB_NAME = config.DB_NAME
-DB_SSL_CA = config.DB_SSL_CA  # 可為空
+# 出席狀態快照（本行程寫入時增量更新，逾時由 DB 重建）
+attendance = TenantLocal(lambda tenant: AttendanceSnapshot(ttl=config.ATTENDANCE_SNAPSHOT_TTL, cfg=tenant))
+_attendance_rebuild_locks = TenantLocal(lambda tenant: threading.Lock())
 
-TABLE = config.DB_TABLE
+# 連線池狀態（只有 mysql 後端有；其他後端輸出時略過；各群組共用同一個連線池）
+for _state in ("open", "idle", "in_use"):
+    metrics.DB_POOL.set_function(lambda state=_state: root_store().stats()[state], _state)
 
-def _conn():
-    kwargs = dict(
-        host=DB_HOST,
-        port=DB_PORT,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME,
-        charset="utf8mb4",
-        cursorclass=pymysql.cursors.Cursor,
-        connect_timeout=10,
-        autocommit=False,
+@metrics.timed(metrics.DB_SECONDS, "record_replies")
+def _write_replies(rows):
+    get_store().record_replies(rows)
+
+def _journal_path(tenant):
+    """單一群組沿用 REPLY_JOURNAL_PATH；多群組時插入群組 ID（reply_journal.<id>.log），replay 不會讀到其他群組的分段"""
+    if tenant.legacy:
+        return config.REPLY_JOURNAL_PATH
+    root, ext = os.path.splitext(config.REPLY_JOURNAL_PATH)
+    return f"{root}.{tenant.id}{ext}"
+
+def _create_reply_buffer(tenant):
+    def write(rows):
+        # 背景 flush 執行緒沒有群組 context，寫入時指定
+        with use(tenant):
+            _write_replies(rows)
+    return ReplyBuffer(
+        write,
+        _journal_path(tenant),
+        flush_interval=config.REPLY_FLUSH_INTERVAL_MS / 1000,
+        flush_batch=config.REPLY_FLUSH_BATCH,
+        fsync=config.REPLY_JOURNAL_FSYNC,
     )
-    if DB_SSL_CA:
-        kwargs["ssl"] = {"ca": DB_SSL_CA}
-    return pymysql.connect(**kwargs)
 
+def _close_reply_buffers():
+    for buffer in reply_buffer.created():
+        buffer.close()
+
+# 回覆 write-behind（REPLY_WRITE_BEHIND=true）：先寫 journal，背景批次寫入 DB
+reply_buffer = None
+if config.REPLY_WRITE_BEHIND:
+    reply_buffer = TenantLocal(_create_reply_buffer)
+    atexit.register(_close_reply_buffers)
+    metrics.REPLY_BUFFER_PENDING.set_function(lambda: sum(b.size() for b in reply_buffer.created()))
+
+# read-your-writes：只有讀取副本時需要（primary 上的查詢本來就看得到剛寫入的資料）
+recent_writes = None
+if config.DB_BACKEND == "mysql" and config.DB_REPLICA_HOSTS:
+    recent_writes = TenantLocal(lambda tenant: RecentWrites(config.DB_READ_YOUR_WRITES_SECONDS))
+
+def _note_write(session, user_id, user_name, reply_text):
+    """寫入成功後：更新出席快照，並記住這筆寫入（replica 追上之前疊加到查詢結果）"""
+    attendance.apply_reply(user_id, user_name, reply_text, session)
+    if recent_writes is not None:
+        recent_writes.note(session, user_id, user_name, reply_text)
+
+def replay_reply_journal():
+    """啟動時把前一次執行遺留在 journal、尚未寫入 DB 的回覆補寫進去（各群組；未開啟 write-behind 時不做事）"""
+    if reply_buffer is None:
+        return 0
+    return sum(reply_buffer.replay() for _ in each())
+
+def _conn():
+    """MySQL 連線（migration 用）；呼叫端照舊 conn.close() 即可歸還"""
+    return get_store().connection()
+
+@metrics.timed(metrics.DB_SECONDS, "init_db")
 def init_db():
-    """若你想用程式側建立表，可呼叫這個。通常建議用上面的 SQL 建表即可。"""
-    ddl = f"""
-    CREATE TABLE IF NOT EXISTS `{TABLE}` (
-      `id`           BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
-      `user_id`      VARCHAR(64),
-      `user_name`    VARCHAR(128),
-      `reply_text`   VARCHAR(255),
-      `has_replied`  TINYINT(1) NOT NULL DEFAULT 0,
-      `timestamp`    DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
-                                    ON UPDATE CURRENT_TIMESTAMP,
-      KEY `idx_user_ts` (`user_id`,`timestamp`),
-      KEY `idx_ts_date` ((date(`timestamp`)))
-    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+    """建立目前後端所需的資料表（已存在則略過）"""
+    get_store().init_db()
+
+def ensure_all_schemas():
+    """啟動時使用：依序檢查每個群組的資料表；回傳執行過 migration 的群組數"""
+    return sum(ensure_schema() for _ in each())
+
+@metrics.timed(metrics.DB_SECONDS, "ensure_schema")
+def ensure_schema():
     """
-    conn = _conn()
-    try:
-        with conn.cursor() as c:
-            c.execute(ddl)
-        conn.commit()
-    finally:
-        conn.close()
+    啟動時使用：結構版本標記已是最新時只做一次 SELECT，不執行任何 DDL。
+    標記不存在或較舊時才執行 migrations（建表 + 升級步驟），完成後更新標記。
+    回傳是否有執行 migration。
+    """
+    current = get_store().get_schema_version()
+    if current >= SCHEMA_VERSION:
+        return False
+    from database import migrations
+    logger.info("資料表結構版本 %d → %d，執行 migration", current, SCHEMA_VERSION)
+    migrations.run_all()
+    return True
+
+@metrics.timed(metrics.DB_SECONDS, "record_reply")
+def record_reply(user_id, user_name, reply_text, session=None):
+    """
+    新增或更新本場次的回覆（同人同場次只有一列），並登記為成員。
+    回傳 REPLY_INSERTED / REPLY_UPDATED / REPLY_RENAMED / REPLY_UNCHANGED；內容完全相同時不寫入。
+    """
+    session = session or get_session_date()
+    if reply_buffer is not None:
+        outcome = _buffer_reply(session, user_id, user_name, reply_text)
+    else:
+        outcome = get_store().record_reply(session, user_id, user_name, reply_text)
+    if outcome != REPLY_UNCHANGED:
+        _note_write(session, user_id, user_name, reply_text)
+    return outcome
+
+def _buffer_reply(session, user_id, user_name, reply_text):
+    """write-behind：依待寫入表與（未過期的）出席快照判斷結果，內容有變才寫入 journal"""
+    previous = reply_buffer.get(session, user_id)
+    if previous is None and not attendance.is_stale(session):
+        previous = attendance.reply_of(user_id, session)
+    if previous == (user_name, reply_text):
+        return REPLY_UNCHANGED
+    reply_buffer.submit(session, user_id, user_name, reply_text)
+    # 快照中「未回應」的成員也算新增（與 DB 中沒有本場次的列一致）
+    if not (previous and previous[1]):
+        return REPLY_INSERTED
+    return REPLY_RENAMED if previous[1] == reply_text else REPLY_UPDATED
 
 def insert_reply(user_id, user_name, reply_text):
-    """同人：若有則更新；沒有則新增。不區分日期。"""
-    conn = _conn()
-    try:
-        with conn.cursor() as c:
-            # 查使用者是否已存在（不分日期）
-            c.execute(
-                f"""
-                SELECT id FROM `{TABLE}`
-                WHERE user_id=%s
-                LIMIT 1
-                """,
-                (user_id,),
-            )
-            row = c.fetchone()
-
-            if row:
-                # 使用者已存在，更新回覆
-                c.execute(
-                    f"""
-                    UPDATE `{TABLE}`
-                    SET reply_text=%s, user_name=%s, has_replied=1, `timestamp`=NOW()
-                    WHERE user_id=%s
-                    """,
-                    (reply_text, user_name, user_id),
-                )
-            else:
-                # 使用者不存在，新增記錄
-                c.execute(
-                    f"""
-                    INSERT INTO `{TABLE}` (user_id, user_name, reply_text, has_replied, `timestamp`)
-                    VALUES (%s, %s, %s, 1, NOW())
-                    """,
-                    (user_id, user_name, reply_text),
-                )
-        conn.commit()
-    finally:
-        conn.close()
-
-def has_replied(user_id):
-    """檢查使用者是否有回覆（不分時間，只看 reply_text 是否有值）"""
-    conn = _conn()
-    try:
-        with conn.cursor() as c:
-            c.execute(
-                f"""
-                SELECT COUNT(*) FROM `{TABLE}`
-                WHERE user_id=%s AND reply_text IS NOT NULL AND reply_text != ''
-                """,
-                (user_id,),
-            )
-            (count,) = c.fetchone()
-            return count > 0
-    finally:
-        conn.close()
-
-def update_reply(user_id, reply_text):
-    """更新使用者的回覆（不分時間，僅當內容不同時才更新）"""
-    conn = _conn()
-    try:
-        with conn.cursor() as c:
-            c.execute(
-                f"""
-                SELECT reply_text FROM `{TABLE}`
-                WHERE user_id=%s
-                LIMIT 1
-                """,
-                (user_id,),
-            )
-            row = c.fetchone()
-            if row is None or row[0] == reply_text:
-                return False
-
-            c.execute(
-                f"""
-                UPDATE `{TABLE}`
-                SET reply_text=%s, has_replied=1, `timestamp`=NOW()
-                WHERE user_id=%s
-                """,
-                (reply_text, user_id),
-            )
-        conn.commit()
-        return True
-    finally:
-        conn.close()
+    """同人同場次：若有則更新；沒有則新增。（保留舊介面，改走 record_reply）"""
+    return record_reply(user_id, user_name, reply_text)
+
+@metrics.timed(metrics.DB_SECONDS, "has_replied")
+def has_replied(user_id, session=None):
+    """檢查使用者在本場次是否有回覆（只看 reply_text 是否有值）"""
+    session = session or get_session_date()
+    pending = _local_reply(session, user_id)
+    if pending is not None:
+        return bool(pending[1])
+    return get_store().has_replied(session, user_id)
+
+def _local_reply(session, user_id):
+    """本行程已知、DB（或 replica）可能還沒有的 (user_name, reply_text)；沒有時回傳 None"""
+    if reply_buffer is not None:
+        pending = reply_buffer.get(session, user_id)
+        if pending is not None:
+            return pending
+    if recent_writes is not None:
+        return recent_writes.get(session, user_id)
+    return None
+
+@metrics.timed(metrics.DB_SECONDS, "get_replied_user_ids")
+def get_replied_user_ids(user_ids, session=None):
+    """一次查詢：回傳 user_ids 中本場次已回覆（reply_text 有值）的使用者 ID 集合"""
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return set()
+    session = session or get_session_date()
+    return _with_pending_replies(session, get_store().get_replied_user_ids(session, user_ids), user_ids)
+
+def _with_pending_replies(session, replied, user_ids):
+    """疊加 write-behind 中尚未寫入 DB、以及 replica 可能還沒追上的回覆"""
+    for source in (recent_writes, reply_buffer):
+        if source is not None:
+            pending = source.pending(session)
+            replied = replied | {uid for uid in user_ids if uid in pending and pending[uid][1]}
+    return replied
 
+@metrics.timed(metrics.DB_SECONDS, "update_reply")
+def update_reply(user_id, reply_text, session=None):
+    """更新使用者本場次的回覆（僅當內容不同時才更新）"""
+    session = session or get_session_date()
+    if reply_buffer is not None:
+        # 先寫入緩衝中的回覆，避免稍後的批次寫入蓋掉這次更新
+        reply_buffer.flush()
+    changed = get_store().update_reply(session, user_id, reply_text)
+    if changed:
+        _note_write(session, user_id, None, reply_text)
+    return changed
+
+@metrics.timed(metrics.DB_SECONDS, "load_attendance")
+def _load_attendance_rows(session):
+    """一次查出所有成員在指定場次的回覆（沒回覆的 reply_text 為空字串）"""
+    return _overlay_rows(session, get_store().load_attendance_rows(session))
+
+def _overlay_rows(session, rows):
+    # 先疊加最近寫入，再疊加 write-behind（較新）
+    for source in (recent_writes, reply_buffer):
+        if source is not None:
+            rows = source.overlay_rows(session, rows)
+    return rows
+
+def get_attendance(user_id=None):
+    """
+    取得目前群組本場次的出席快照；尚未載入、已過期或場次已切換時由 DB 重建。
+    user_id：查詢者本人；有讀取副本時確認快照中本人的回覆與 primary 一致。
+    """
+    session = get_session_date()
+    snapshot = attendance.instance()
+    if snapshot.is_stale(session):
+        with _attendance_rebuild_locks.instance():
+            if snapshot.is_stale(session):
+                snapshot.rebuild(lambda: _load_attendance_rows(session), session)
+    if user_id and recent_writes is not None and _local_reply(session, user_id) is None:
+        _confirm_own_reply(snapshot, session, user_id, get_store().get_reply(session, user_id))
+    return snapshot
+
+def _confirm_own_reply(snapshot, session, user_id, row):
+    """
+    本人的回覆可能由其他 worker 寫入、replica 還沒追上：以 primary 的單列（主鍵）查詢結果為準。
+    本行程剛寫入或尚在 write-behind 中的回覆快照已包含，呼叫端不必查。
+    """
+    if row is not None and snapshot.reply_of(user_id, session) != tuple(row):
+        snapshot.apply_reply(user_id, row[0], row[1], session)
+
+def preload_attendance():
+    """啟動時預先載入各群組的出席快照"""
+    for _ in each():
+        get_attendance()
+
+@metrics.timed(metrics.DB_SECONDS, "get_user_reply")
 def get_user_reply():
     """
     回傳: (yes_list, no_list, no_reply_list)
     - yes_list：reply_text 為"要"的使用者
     - no_list：reply_text 為"不要"的使用者  
-    - no_reply_list：reply_text 為 NULL 或空的使用者
+    - no_reply_list：回覆過的成員中，本場次尚未回覆的使用者
+    由記憶體快照提供，不再每次掃整張表。
     """
-    conn = _conn()
-    try:
-        with conn.cursor() as c:
-            # 查詢所有使用者的當前回覆狀態（不分時間）
-            c.execute(f"""
-                SELECT user_id, user_name, reply_text
-                FROM `{TABLE}`
-                WHERE reply_text IS NOT NULL AND reply_text != ''
-            """)
-            replied_users = c.fetchall()
-            
-            # 查詢所有使用者（不分時間）
-            c.execute(f"SELECT DISTINCT user_id, user_name FROM `{TABLE}`")
-            all_users = c.fetchall()
-    finally:
-        conn.close()
-
-    # 分類回覆狀態
-    yes_list = [r[1] for r in replied_users if r[2] in config.YES_KEYWORDS]
-    no_list = [r[1] for r in replied_users if r[2] in config.NO_KEYWORDS]
-    
-    # 找出沒有回覆的使用者（reply_text 為 NULL 或空）
-    replied_user_ids = {r[0] for r in replied_users}
-    no_reply_list = [name for uid, name in all_users if uid not in replied_user_ids]
-    
-    return yes_list, no_list, no_reply_list
+    return get_attendance().lists()
 
 def reset_replies_db():
-    """將所有人的 reply_text 變為空，has_replied 設為 0"""
-    conn = _conn()
+    """
+    換週。場次由 get_session_date() 依時間決定，換週本身不需要改寫任何資料；
+    這裡只清掉本行程的快照，並依保留政策刪除過舊的場次。
+    """
+    attendance.invalidate()
     try:
-        with conn.cursor() as c:
-            c.execute(
-                f"""
-                UPDATE `{TABLE}`
-                SET reply_text = '', has_replied = 0
-                """
-            )
-        conn.commit()
-        logger.info("已重置所有使用者的回覆狀態")
+        removed = prune_old_sessions()
+        logger.info("已切換至場次 %s（清除 %d 筆過期回覆）", get_session_date(), removed)
     except Exception as e:
-        logger.error(f"重置回覆狀態時發生錯誤: {e}")
+        logger.error("清除過期回覆時發生錯誤: %s", e)
         raise
-    finally:
-        conn.close()
 
-# 你原本的輔助：讀 config 取名字（保持不變）
+@metrics.timed(metrics.DB_SECONDS, "prune_old_sessions")
+def prune_old_sessions(retention_weeks=None, batch_size=1000):
+    """刪除早於保留期限的場次；分批刪除，避免長時間鎖住表。回傳刪除筆數。"""
+    retention_weeks = config.REPLY_RETENTION_WEEKS if retention_weeks is None else retention_weeks
+    if retention_weeks <= 0:
+        return 0
+
+    cutoff = get_session_date() - timedelta(weeks=retention_weeks)
+    return get_store().prune_sessions(cutoff, batch_size)
+
+@metrics.timed(metrics.DB_SECONDS, "claim_webhook_event")
+def claim_webhook_event(event_id, ttl):
+    """跨 worker 的 webhook 去重：第一次（或前一筆已過期）claim 成功回傳 True"""
+    return get_store().claim_webhook_event(event_id, ttl)
+
+@metrics.timed(metrics.DB_SECONDS, "claim_job_fire")
+def claim_job_fire(job_id, fire_time, shard, owner, lease_seconds):
+    """
+    取得某次排程觸發（某個分片）的執行權，租約 lease_seconds 秒；主鍵保證同時只有一個 worker 持有。
+    回傳 JOB_CLAIMED（由呼叫者執行）/ JOB_BUSY（其他 worker 執行中）/ JOB_DONE（已完成）。
+    """
+    return get_store().claim_job_fire(job_id, fire_time, shard, owner, lease_seconds)
+
+@metrics.timed(metrics.DB_SECONDS, "finish_job_fire")
+def finish_job_fire(job_id, fire_time, shard, owner, retry_in=None):
+    """執行完成時標記完成；失敗時放棄執行權，retry_in 秒後可再被 claim"""
+    return get_store().finish_job_fire(job_id, fire_time, shard, owner, retry_in)
+
+@metrics.timed(metrics.DB_SECONDS, "prune_job_claims")
+def prune_job_claims(days=14):
+    """刪除過舊的排程執行紀錄"""
+    return get_store().prune_job_claims(days)
+
+@metrics.timed(metrics.DB_SECONDS, "enqueue_outbox")
+def enqueue_outbox(rows):
+    """新增待推播的通知 [(idempotency_key, kind, user_id, message)]；已存在的 key 略過，回傳新增筆數"""
+    return get_store().enqueue_outbox(rows)
+
+@metrics.timed(metrics.DB_SECONDS, "claim_outbox")
+def claim_outbox(owner, limit, lease_seconds):
+    """取得一批可送出的通知（標記為 inflight），回傳 (claim_token, rows)"""
+    return get_store().claim_outbox(owner, limit, lease_seconds)
+
+@metrics.timed(metrics.DB_SECONDS, "mark_outbox_sent")
+def mark_outbox_sent(ids, claim_token):
+    get_store().mark_outbox_sent(ids, claim_token)
+
+@metrics.timed(metrics.DB_SECONDS, "mark_outbox_failed")
+def mark_outbox_failed(outbox_id, claim_token, error, retry_in=None):
+    get_store().mark_outbox_failed(outbox_id, claim_token, error, retry_in)
+
+@metrics.timed(metrics.DB_SECONDS, "prune_outbox")
+def prune_outbox(days=14):
+    """刪除過舊、已結束（sent / failed）的 outbox 紀錄"""
+    return get_store().prune_outbox(days)
+
+# 你原本的輔助：讀 config 取名字（改由共用名單快取提供）
 def get_name_from_config(user_id):
-    config_path = config.USERS_CONFIG_PATH
-    if not os.path.exists(config_path):
-        return "未知使用者"
-    try:
-        with open(config_path, encoding="utf-8") as f:
-            data = json.load(f)
-            for user in data.get("users", []):
-                if user.get("user_id") == user_id:
-                    return user.get("name", "未知使用者")
-    except Exception:
-        return "未知使用者"
-    return "未知使用者"
+    return roster.get_name(user_id)
@@ -0,0 +1,196 @@
+# memory_store.py
+"""
+純記憶體後端：測試與基準測試用，不需要任何資料庫，行程結束即消失。
+只在單一行程內共用（多個 Gunicorn worker 各有一份），不適合正式環境。
+"""
+import uuid
+import threading
+from datetime import datetime, timedelta
+from database.storage import (
+    ReplyStore, REPLY_INSERTED, REPLY_UPDATED, REPLY_RENAMED, REPLY_UNCHANGED,
+    OUTBOX_PENDING, OUTBOX_INFLIGHT, OUTBOX_SENT, OUTBOX_FAILED,
+    JOB_CLAIMED, JOB_BUSY, JOB_DONE,
+)
+
+
+class MemoryStore(ReplyStore):
+    name = "memory"
+
+    def __init__(self, tables=None):
+        super().__init__(tables)
+        self._lock = threading.Lock()
+        self._replies = {}   # (session, user_id) -> (user_name, reply_text)
+        self._members = {}   # user_id -> user_name（dict 保持登記順序，等同 created_at 排序）
+        self._dedup = {}     # event_id -> expires_at
+        self._job_claims = {}  # (job_id, fire_time, shard) -> {owner, lease_until, done}
+        self._outbox = {}      # id -> dict（依新增順序）
+        self._outbox_keys = set()
+        self._outbox_seq = 0
+        self._schema_version = 0
+
+    def scoped(self, tables):
+        # 記憶體後端沒有共用的連線：每個群組各自一份資料
+        return MemoryStore(tables)
+
+    def init_db(self):
+        pass
+
+    def get_schema_version(self):
+        return self._schema_version
+
+    def set_schema_version(self, version):
+        self._schema_version = version
+
+    def record_reply(self, session, user_id, user_name, reply_text):
+        key = (session, user_id)
+        with self._lock:
+            previous = self._replies.get(key)
+            if previous == (user_name, reply_text):
+                return REPLY_UNCHANGED
+            self._replies[key] = (user_name, reply_text)
+            self._members[user_id] = user_name
+        if previous is None:
+            return REPLY_INSERTED
+        return REPLY_RENAMED if previous[1] == reply_text else REPLY_UPDATED
+
+    def has_replied(self, session, user_id):
+        reply = self._replies.get((session, user_id))
+        return bool(reply and reply[1])
+
+    def get_replied_user_ids(self, session, user_ids):
+        return {uid for uid in user_ids if self.has_replied(session, uid)}
+
+    def get_reply(self, session, user_id):
+        return self._replies.get((session, user_id))
+
+    def update_reply(self, session, user_id, reply_text):
+        key = (session, user_id)
+        with self._lock:
+            previous = self._replies.get(key)
+            if previous is None or previous[1] == reply_text:
+                return False
+            self._replies[key] = (previous[0], reply_text)
+        return True
+
+    def load_attendance_rows(self, session):
+        with self._lock:
+            rows = []
+            for uid, member_name in self._members.items():
+                name, text = self._replies.get((session, uid), (None, ""))
+                rows.append((uid, name if name is not None else member_name, text or ""))
+        return rows
+
+    def prune_sessions(self, cutoff, batch_size=1000):
+        with self._lock:
+            stale = [key for key in self._replies if key[0] < cutoff]
+            for key in stale:
+                del self._replies[key]
+        return len(stale)
+
+    def claim_webhook_event(self, event_id, ttl):
+        now = datetime.now()
+        with self._lock:
+            expires = self._dedup.get(event_id)
+            if expires is not None and expires >= now:
+                return False
+            self._dedup[event_id] = now + timedelta(seconds=int(ttl))
+            if len(self._dedup) > 10000:
+                self._dedup = {k: v for k, v in self._dedup.items() if v >= now}
+        return True
+
+    def claim_job_fire(self, job_id, fire_time, shard, owner, lease_seconds):
+        now = datetime.now()
+        key = (job_id, fire_time, shard)
+        with self._lock:
+            claim = self._job_claims.get(key)
+            if claim is not None:
+                if claim["done"]:
+                    return JOB_DONE
+                if claim["lease_until"] >= now:
+                    return JOB_BUSY
+            self._job_claims[key] = {
+                "owner": owner, "lease_until": now + timedelta(seconds=int(lease_seconds)), "done": False,
+            }
+        return JOB_CLAIMED
+
+    def finish_job_fire(self, job_id, fire_time, shard, owner, retry_in=None):
+        with self._lock:
+            claim = self._job_claims.get((job_id, fire_time, shard))
+            if claim is None or claim["done"]:
+                return
+            if retry_in is None:
+                claim["done"] = True
+            elif claim["owner"] == owner:
+                claim["lease_until"] = datetime.now() + timedelta(seconds=int(retry_in))
+
+    def prune_job_claims(self, days=14):
+        cutoff = datetime.now() - timedelta(days=int(days))
+        with self._lock:
+            stale = [key for key in self._job_claims if key[1] < cutoff]
+            for key in stale:
+                del self._job_claims[key]
+        return len(stale)
+
+    # ---------- outbox ----------
+
+    def enqueue_outbox(self, rows):
+        now = datetime.now()
+        inserted = 0
+        with self._lock:
+            for key, kind, user_id, message in rows:
+                if key in self._outbox_keys:
+                    continue
+                self._outbox_seq += 1
+                self._outbox_keys.add(key)
+                self._outbox[self._outbox_seq] = {
+                    "key": key, "kind": kind, "user_id": user_id, "message": message,
+                    "state": OUTBOX_PENDING, "attempts": 0, "owner": None, "claim_token": None, "claimed_at": None,
+                    "next_attempt_at": now, "created_at": now, "last_error": None,
+                }
+                inserted += 1
+        return inserted
+
+    def claim_outbox(self, owner, limit, lease_seconds):
+        token = str(uuid.uuid4())
+        now = datetime.now()
+        expired = now - timedelta(seconds=int(lease_seconds))
+        claimed = []
+        with self._lock:
+            for outbox_id, row in self._outbox.items():
+                if len(claimed) >= limit:
+                    break
+                ready = row["state"] == OUTBOX_PENDING and row["next_attempt_at"] <= now
+                stuck = row["state"] == OUTBOX_INFLIGHT and row["claimed_at"] < expired
+                if not (ready or stuck):
+                    continue
+                row.update(state=OUTBOX_INFLIGHT, owner=owner, claim_token=token, claimed_at=now,
+                           attempts=row["attempts"] + 1)
+                claimed.append((outbox_id, row["key"], row["kind"], row["user_id"], row["message"], row["attempts"]))
+        return token, claimed
+
+    def mark_outbox_sent(self, ids, claim_token):
+        with self._lock:
+            for outbox_id in ids:
+                row = self._outbox[outbox_id]
+                if row["claim_token"] == claim_token:
+                    row.update(state=OUTBOX_SENT, claim_token=None, last_error=None)
+
+    def mark_outbox_failed(self, outbox_id, claim_token, error, retry_in=None):
+        with self._lock:
+            row = self._outbox[outbox_id]
+            if row["claim_token"] != claim_token:
+                return
+            row.update(claim_token=None, last_error=str(error)[:255])
+            if retry_in is None:
+                row["state"] = OUTBOX_FAILED
+            else:
+                row.update(state=OUTBOX_PENDING, next_attempt_at=datetime.now() + timedelta(seconds=int(retry_in)))
+
+    def prune_outbox(self, days=14):
+        cutoff = datetime.now() - timedelta(days=int(days))
+        with self._lock:
+            stale = [i for i, row in self._outbox.items()
+                     if row["state"] in (OUTBOX_SENT, OUTBOX_FAILED) and row["created_at"] < cutoff]
+            for outbox_id in stale:
+                self._outbox_keys.discard(self._outbox.pop(outbox_id)["key"])
+        return len(stale)
@@ -0,0 +1,204 @@
+# migrations.py
+"""
+資料表升級腳本（MySQL）。可重複執行（已套用的步驟會自動略過）。
+sqlite / memory 後端沒有舊資料表，init_db 即為最新結構（sqlite 缺少的欄位由 init_db 補上）。
+
+    python -m database.migrations      # 依序升級每個群組的資料表
+"""
+import logging
+from config import config
+from database.db import _conn, init_db, get_store, SCHEMA_VERSION
+from utils.tenants import each
+from utils.date_utils import get_session_date
+
+logger = logging.getLogger(__name__)
+
+def _index_exists(c, index_name):
+    c.execute(
+        """
+        SELECT COUNT(*) FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        """,
+        (get_store().t.reply, index_name),
+    )
+    (count,) = c.fetchone()
+    return count > 0
+
+def _column_exists(c, column_name, table=None):
+    c.execute(
+        """
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        """,
+        (table or get_store().t.reply, column_name),
+    )
+    (count,) = c.fetchone()
+    return count > 0
+
+def migrate_unique_user_id():
+    """
+    清除同一 user_id 的重複列（保留最新一筆），再建立 uk_user_id 唯一索引，
+    讓 record_reply 的 INSERT ... ON DUPLICATE KEY UPDATE 生效。
+    """
+    t = get_store().t
+    conn = _conn()
+    try:
+        with conn.cursor() as c:
+            if _column_exists(c, "session_date") or _index_exists(c, "uk_user_id"):
+                logger.info("uk_user_id 已存在（或已改為場次制），略過")
+                return 0
+
+            # 同一人保留 timestamp 最新（相同時取 id 最大）的那一筆
+            removed = c.execute(
+                f"""
+                DELETE r FROM `{t.reply}` r
+                JOIN `{t.reply}` k
+                  ON r.user_id = k.user_id
+                 AND (r.`timestamp` < k.`timestamp`
+                      OR (r.`timestamp` = k.`timestamp` AND r.id < k.id))
+                """
+            )
+            c.execute(f"ALTER TABLE `{t.reply}` ADD UNIQUE KEY `uk_user_id` (`user_id`)")
+        conn.commit()
+        logger.info("已移除 %d 筆重複回覆並建立 uk_user_id", removed)
+        return removed
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def _column_nullable(c, column_name):
+    c.execute(
+        """
+        SELECT is_nullable FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        """,
+        (get_store().t.reply, column_name),
+    )
+    row = c.fetchone()
+    return row is not None and row[0] == "YES"
+
+def migrate_session_epoch():
+    """
+    改為依場次儲存回覆：
+    1. 所有既有使用者登記到成員表（保留「未回應」名單）
+    2. 新增 session_date；目前有回覆內容的列歸到本場次，空白列刪除
+    3. 唯一索引由 (user_id) 改為 (session_date, user_id)
+
+    ALTER TABLE 會隱含 commit，整個 migration 無法包在一個交易裡：
+    中途失敗時已完成的步驟不會復原。每個步驟各自檢查是否已套用，重新執行即可從中斷處繼續。
+    """
+    session = get_session_date()
+    t = get_store().t
+    conn = _conn()
+    try:
+        with conn.cursor() as c:
+            has_column = _column_exists(c, "session_date")
+            if has_column and not _column_nullable(c, "session_date") and _index_exists(c, "uk_session_user"):
+                logger.info("已是場次制，略過")
+                return
+
+            if not has_column:
+                c.execute(
+                    f"""
+                    INSERT IGNORE INTO `{t.member}` (user_id, user_name, created_at)
+                    SELECT user_id, MAX(user_name), MIN(`timestamp`)
+                    FROM `{t.reply}`
+                    WHERE user_id IS NOT NULL
+                    GROUP BY user_id
+                    """
+                )
+                conn.commit()
+                c.execute(f"ALTER TABLE `{t.reply}` ADD COLUMN `session_date` DATE NULL AFTER `id`")
+
+            # 尚未歸入場次的列：有回覆內容的歸到本場次，其餘刪除（重跑時已歸入的列不受影響）
+            c.execute(
+                f"""
+                UPDATE `{t.reply}` SET session_date = %s
+                WHERE session_date IS NULL AND reply_text IS NOT NULL AND reply_text != ''
+                """,
+                (session,),
+            )
+            c.execute(f"DELETE FROM `{t.reply}` WHERE session_date IS NULL")
+            conn.commit()
+
+            alters = []
+            if _column_nullable(c, "session_date"):
+                alters.append("MODIFY `session_date` DATE NOT NULL")
+            if _index_exists(c, "uk_user_id"):
+                alters.append("DROP INDEX `uk_user_id`")
+            if _index_exists(c, "idx_ts_date"):
+                alters.append("DROP INDEX `idx_ts_date`")
+            if not _index_exists(c, "uk_session_user"):
+                alters.append("ADD UNIQUE KEY `uk_session_user` (`session_date`, `user_id`)")
+            if alters:
+                c.execute(f"ALTER TABLE `{t.reply}` " + ", ".join(alters))
+        logger.info("已改為場次制儲存，目前場次 %s", session)
+    finally:
+        conn.close()
+
+def migrate_job_claim_lease():
+    """
+    job_claim 加上租約（lease_until）與完成時間（done_at）：
+    送出前當掉或送出失敗的分片在租約到期後由其他 worker 接手。
+    既有的列 lease_until 為 NULL，視為已完成。
+    """
+    t = get_store().t
+    conn = _conn()
+    try:
+        with conn.cursor() as c:
+            alters = [
+                f"ADD COLUMN `{column}` DATETIME NULL"
+                for column in ("lease_until", "done_at")
+                if not _column_exists(c, column, t.job_claim)
+            ]
+            if not alters:
+                logger.info("job_claim 已有租約欄位，略過")
+                return
+            c.execute(f"ALTER TABLE `{t.job_claim}` " + ", ".join(alters))
+        conn.commit()
+        logger.info("job_claim 已加上租約欄位")
+    finally:
+        conn.close()
+
+MIGRATIONS = [
+    migrate_unique_user_id,
+    migrate_session_epoch,
+    migrate_job_claim_lease,
+]
+
+def run_all():
+    """建表、執行所有升級步驟，最後寫入結構版本標記（目前群組的資料表）"""
+    if config.DB_BACKEND != "mysql":
+        logger.info("DB_BACKEND=%s 不需要 migration，只建立資料表", config.DB_BACKEND)
+        init_db()
+        get_store().set_schema_version(SCHEMA_VERSION)
+        return
+
+    # 多個 worker 同時啟動時只讓一個執行 DDL，其他等它完成（之後的步驟都會自動略過）
+    lock_conn = _conn()
+    try:
+        with lock_conn.cursor() as c:
+            c.execute("SELECT GET_LOCK(%s, 60)", (get_store().t.migration_lock,))
+            (locked,) = c.fetchone()
+        if locked != 1:
+            raise RuntimeError("等待 migration 鎖逾時")
+        try:
+            # 先建立新增的資料表（成員表等）；既有的表不受影響
+            init_db()
+            for migration in MIGRATIONS:
+                logger.info("執行 migration: %s", migration.__name__)
+                migration()
+            get_store().set_schema_version(SCHEMA_VERSION)
+            logger.info("資料表結構已更新至版本 %d", SCHEMA_VERSION)
+        finally:
+            with lock_conn.cursor() as c:
+                c.execute("SELECT RELEASE_LOCK(%s)", (get_store().t.migration_lock,))
+    finally:
+        lock_conn.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s] %(message)s')
+    for _ in each():
+        run_all()
@@ -0,0 +1,650 @@
+# mysql_store.py
+"""
+MySQL / RDS 後端（PyMySQL + 連線池）。
+
+設定 RDS_REPLICA_HOSTS 時，唯讀查詢（has_replied、get_replied_user_ids、load_attendance_rows）
+送到讀取副本，其餘（寫入、claim、migration）一律在 primary（見 database/replicas.py）。
+"""
+import uuid
+import logging
+import threading
+import pymysql
+from config import config
+from database.pool import ConnectionPool, PoolTimeout
+from database.replicas import ReplicaSet, parse_hosts
+from utils import metrics
+from database.storage import (
+    ReplyStore,
+    REPLY_INSERTED, REPLY_UPDATED, REPLY_RENAMED, REPLY_UNCHANGED,
+    OUTBOX_PENDING, OUTBOX_INFLIGHT, OUTBOX_SENT, OUTBOX_FAILED,
+    JOB_CLAIMED, JOB_BUSY, JOB_DONE,
+)
+
+logger = logging.getLogger(__name__)
+
+# replica 上視為「副本壞了」而改查 primary 的錯誤（SQL 本身的錯誤照常拋出）
+REPLICA_ERRORS = (pymysql.err.OperationalError, pymysql.err.InterfaceError)
+
+# 熱路徑的 SQL（PyMySQL 與 aiomysql 共用，參數格式都是 %s）；{t.*} 由 Statements 依群組的資料表名稱展開
+# 已有的列不在這裡改名字：affected rows 只反映回覆內容，名字改變由 RENAME_REPLY_SQL 另外判斷
+UPSERT_REPLY_SQL = """
+INSERT INTO `{t.reply}` (session_date, user_id, user_name, reply_text, has_replied, `timestamp`)
+VALUES (%s, %s, %s, %s, 1, NOW())
+ON DUPLICATE KEY UPDATE
+  reply_text  = VALUES(reply_text),
+  has_replied = 1
+"""
+RENAME_REPLY_SQL = """
+UPDATE `{t.reply}` SET user_name=%s
+WHERE session_date=%s AND user_id=%s AND NOT (user_name <=> %s)
+"""
+UPSERT_MEMBER_SQL = """
+INSERT INTO `{t.member}` (user_id, user_name)
+VALUES (%s, %s)
+ON DUPLICATE KEY UPDATE user_name = VALUES(user_name)
+"""
+UPSERT_REPLIES_SQL = """
+INSERT INTO `{t.reply}` (session_date, user_id, user_name, reply_text, has_replied, `timestamp`)
+VALUES {{values}}
+ON DUPLICATE KEY UPDATE
+  user_name   = VALUES(user_name),
+  reply_text  = VALUES(reply_text),
+  has_replied = 1
+"""
+UPSERT_REPLIES_ROW = "(%s, %s, %s, %s, 1, NOW())"
+UPSERT_REPLIES_CHUNK = 500  # 每個多列 INSERT 的列數上限
+HAS_REPLIED_SQL = """
+SELECT COUNT(*) FROM `{t.reply}`
+WHERE session_date=%s AND user_id=%s
+  AND reply_text IS NOT NULL AND reply_text != ''
+"""
+REPLIED_IDS_SQL = """
+SELECT user_id FROM `{t.reply}`
+WHERE session_date=%s AND user_id IN ({{placeholders}})
+  AND reply_text IS NOT NULL AND reply_text != ''
+"""
+REPLIED_IDS_CHUNK = 1000  # IN 清單分段，避免名單過大時超過 max_allowed_packet
+UPDATE_REPLY_SQL = """
+UPDATE `{t.reply}`
+SET reply_text=%s, has_replied=1, `timestamp`=NOW()
+WHERE session_date=%s AND user_id=%s AND NOT (reply_text <=> %s)
+"""
+ATTENDANCE_SQL = """
+SELECT m.user_id,
+       COALESCE(r.user_name, m.user_name),
+       COALESCE(r.reply_text, '')
+FROM `{t.member}` m
+LEFT JOIN `{t.reply}` r
+  ON r.session_date = %s AND r.user_id = m.user_id
+ORDER BY m.created_at, m.user_id
+"""
+CLAIM_EVENT_SQL = """
+INSERT INTO `{t.dedup}` (event_id, expires_at)
+VALUES (%s, NOW() + INTERVAL %s SECOND)
+ON DUPLICATE KEY UPDATE
+  expires_at = IF(expires_at < NOW(), VALUES(expires_at), expires_at)
+"""
+PURGE_EVENTS_SQL = "DELETE FROM `{t.dedup}` WHERE expires_at < NOW() LIMIT 1000"
+PURGE_EVENTS_EVERY = 500  # 每幾次 claim 順手清一次過期紀錄，避免表無限成長
+# 排程 claim：先嘗試新增；已存在時接手租約過期、尚未完成的 claim；都不成功再讀狀態
+CLAIM_JOB_SQL = """
+INSERT IGNORE INTO `{t.job_claim}` (job_id, fire_time, shard, owner, lease_until)
+VALUES (%s, %s, %s, %s, NOW() + INTERVAL %s SECOND)
+"""
+TAKE_OVER_JOB_SQL = """
+UPDATE `{t.job_claim}` SET owner = %s, lease_until = NOW() + INTERVAL %s SECOND, claimed_at = NOW()
+WHERE job_id = %s AND fire_time = %s AND shard = %s
+  AND done_at IS NULL AND lease_until < NOW()
+"""
+JOB_DONE_SQL = """
+SELECT done_at IS NOT NULL OR lease_until IS NULL FROM `{t.job_claim}`
+WHERE job_id = %s AND fire_time = %s AND shard = %s
+"""
+FINISH_JOB_SQL = """
+UPDATE `{t.job_claim}` SET done_at = NOW()
+WHERE job_id = %s AND fire_time = %s AND shard = %s AND done_at IS NULL
+"""
+RELEASE_JOB_SQL = """
+UPDATE `{t.job_claim}` SET lease_until = NOW() + INTERVAL %s SECOND
+WHERE job_id = %s AND fire_time = %s AND shard = %s AND owner = %s AND done_at IS NULL
+"""
+OWN_REPLY_SQL = "SELECT user_name, reply_text FROM `{t.reply}` WHERE session_date=%s AND user_id=%s"
+
+
+class Statements:
+    """一個群組（一組資料表）展開後的 SQL"""
+
+    def __init__(self, t):
+        self.upsert_reply = UPSERT_REPLY_SQL.format(t=t)
+        self.rename_reply = RENAME_REPLY_SQL.format(t=t)
+        self.upsert_member = UPSERT_MEMBER_SQL.format(t=t)
+        self.upsert_replies = UPSERT_REPLIES_SQL.format(t=t)
+        self.has_replied = HAS_REPLIED_SQL.format(t=t)
+        self.replied_ids = REPLIED_IDS_SQL.format(t=t)
+        self.update_reply = UPDATE_REPLY_SQL.format(t=t)
+        self.attendance = ATTENDANCE_SQL.format(t=t)
+        self.claim_event = CLAIM_EVENT_SQL.format(t=t)
+        self.purge_events = PURGE_EVENTS_SQL.format(t=t)
+        self.claim_job = CLAIM_JOB_SQL.format(t=t)
+        self.take_over_job = TAKE_OVER_JOB_SQL.format(t=t)
+        self.job_done = JOB_DONE_SQL.format(t=t)
+        self.finish_job = FINISH_JOB_SQL.format(t=t)
+        self.release_job = RELEASE_JOB_SQL.format(t=t)
+        self.own_reply = OWN_REPLY_SQL.format(t=t)
+
+
+def reply_outcome(affected, renamed=0):
+    """
+    MySQL 的 affected rows：新增 = 1、更新 = 2、內容完全相同 = 0
+    （PyMySQL / aiomysql 預設不帶 CLIENT.FOUND_ROWS，因此「相同」會回 0）；
+    renamed 為 RENAME_REPLY_SQL 的 affected rows（名字有變 = 1）。
+    """
+    if affected == 1:
+        return REPLY_INSERTED
+    if affected == 2:
+        return REPLY_UPDATED
+    return REPLY_RENAMED if renamed else REPLY_UNCHANGED
+
+
+class MySQLStore(ReplyStore):
+    name = "mysql"
+
+    def __init__(self, tables=None, parent=None):
+        super().__init__(tables)
+        self.sql = Statements(self.t)
+        self._parent = parent      # scoped() 而來時，連線池（含 replica）由 parent 持有
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._dedup_claims = 0
+        if parent is not None:
+            self.replicas = parent.replicas
+        else:
+            self.replicas = ReplicaSet(parse_hosts(config.DB_REPLICA_HOSTS, config.DB_PORT),
+                                       retry_seconds=config.DB_REPLICA_RETRY_SECONDS)
+            self._replica_pools = {}
+            for replica in self.replicas.replicas:
+                metrics.DB_REPLICA_UP.set_function(lambda r=replica: 1 if r.healthy() else 0, replica.label)
+
+    def scoped(self, tables):
+        return MySQLStore(tables, parent=self._parent or self)
+
+    # ---------- 連線 ----------
+
+    def _connect(self, host=None, port=None):
+        kwargs = dict(
+            host=host or config.DB_HOST,
+            port=port or config.DB_PORT,
+            user=config.DB_USER,
+            password=config.DB_PASSWORD,
+            database=config.DB_NAME,
+            charset="utf8mb4",
+            cursorclass=pymysql.cursors.Cursor,
+            connect_timeout=10,
+            autocommit=False,
+        )
+        if config.DB_SSL_CA:
+            kwargs["ssl"] = {"ca": config.DB_SSL_CA}
+        return pymysql.connect(**kwargs)
+
+    def get_pool(self):
+        """取得（必要時建立）連線池；第一次使用才建立，Gunicorn fork 前不會開任何連線"""
+        if self._parent is not None:
+            return self._parent.get_pool()
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ConnectionPool(
+                        self._connect,
+                        size=config.DB_POOL_SIZE,
+                        recycle=config.DB_POOL_RECYCLE,
+                        ping_after=config.DB_POOL_PING_AFTER,
+                        timeout=config.DB_POOL_TIMEOUT,
+                    )
+        return self._pool
+
+    def connection(self):
+        """從連線池借出連線；呼叫端照舊 conn.close() 即可歸還"""
+        return self.get_pool().acquire()
+
+    def _replica_pool(self, replica):
+        if self._parent is not None:
+            return self._parent._replica_pool(replica)
+        pool = self._replica_pools.get(replica)
+        if pool is None:
+            with self._pool_lock:
+                pool = self._replica_pools.get(replica)
+                if pool is None:
+                    pool = self._replica_pools[replica] = ConnectionPool(
+                        lambda: self._connect(replica.host, replica.port),
+                        size=config.DB_REPLICA_POOL_SIZE,
+                        recycle=config.DB_POOL_RECYCLE,
+                        ping_after=config.DB_POOL_PING_AFTER,
+                        timeout=config.DB_POOL_TIMEOUT,
+                    )
+        return pool
+
+    def _read(self, query):
+        """
+        唯讀查詢 query(cursor)：有健康的 replica 時送到 replica；
+        replica 連不上或查詢中斷時暫停該 replica，這一次改查 primary。
+        """
+        replica = self.replicas.pick() if self.replicas else None
+        if replica is not None:
+            try:
+                conn = self._replica_pool(replica).acquire()
+                try:
+                    with conn.cursor() as c:
+                        result = query(c)
+                finally:
+                    conn.close()
+                metrics.DB_READS.labels("replica").inc()
+                return result
+            except REPLICA_ERRORS as e:
+                self.replicas.mark_down(replica, e)
+            except PoolTimeout:
+                # replica 本身沒壞，只是連線都在使用中：這一次借用 primary
+                logger.warning("讀取副本 %s 連線池已滿，改查 primary", replica.label)
+            metrics.DB_READS.labels("fallback").inc()
+        else:
+            metrics.DB_READS.labels("primary").inc()
+        conn = self.connection()
+        try:
+            with conn.cursor() as c:
+                return query(c)
+        finally:
+            conn.close()
+
+    def stats(self) -> dict:
+        if self._parent is not None:
+            return self._parent.stats()
+        return self._pool.stats() if self._pool is not None else {}
+
+    # ---------- 介面實作 ----------
+
+    def init_db(self):
+        ddl = f"""
+        CREATE TABLE IF NOT EXISTS `{self.t.reply}` (
+          `id`           BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+          `session_date` DATE NOT NULL,
+          `user_id`      VARCHAR(64),
+          `user_name`    VARCHAR(128),
+          `reply_text`   VARCHAR(255),
+          `has_replied`  TINYINT(1) NOT NULL DEFAULT 0,
+          `timestamp`    DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+                                        ON UPDATE CURRENT_TIMESTAMP,
+          UNIQUE KEY `uk_session_user` (`session_date`, `user_id`),
+          KEY `idx_user_ts` (`user_id`,`timestamp`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+        """
+        member_ddl = f"""
+        CREATE TABLE IF NOT EXISTS `{self.t.member}` (
+          `user_id`      VARCHAR(64) NOT NULL PRIMARY KEY,
+          `user_name`    VARCHAR(128),
+          `created_at`   DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+          KEY `idx_created` (`created_at`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+        """
+        dedup_ddl = f"""
+        CREATE TABLE IF NOT EXISTS `{self.t.dedup}` (
+          `event_id`     VARCHAR(64) NOT NULL PRIMARY KEY,
+          `expires_at`   DATETIME NOT NULL,
+          KEY `idx_expires` (`expires_at`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+        """
+        job_claim_ddl = f"""
+        CREATE TABLE IF NOT EXISTS `{self.t.job_claim}` (
+          `job_id`       VARCHAR(128) NOT NULL,
+          `fire_time`    DATETIME NOT NULL,
+          `shard`        INT NOT NULL DEFAULT 0,
+          `owner`        VARCHAR(128) NOT NULL,
+          `claimed_at`   DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+          `lease_until`  DATETIME NULL,
+          `done_at`      DATETIME NULL,
+          PRIMARY KEY (`job_id`, `fire_time`, `shard`),
+          KEY `idx_fire_time` (`fire_time`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+        """
+        outbox_ddl = f"""
+        CREATE TABLE IF NOT EXISTS `{self.t.outbox}` (
+          `id`              BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+          `idempotency_key` VARCHAR(191) NOT NULL,
+          `kind`            VARCHAR(16) NOT NULL,
+          `user_id`         VARCHAR(64) NOT NULL,
+          `message`         TEXT NOT NULL,
+          `state`           VARCHAR(16) NOT NULL DEFAULT '{OUTBOX_PENDING}',
+          `attempts`        INT NOT NULL DEFAULT 0,
+          `owner`           VARCHAR(128) NULL,
+          `claim_token`     CHAR(36) NULL,
+          `claimed_at`      DATETIME NULL,
+          `next_attempt_at` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+          `sent_at`         DATETIME NULL,
+          `last_error`      VARCHAR(255) NULL,
+          `created_at`      DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+          UNIQUE KEY `uk_idempotency` (`idempotency_key`),
+          KEY `idx_state_next` (`state`, `next_attempt_at`),
+          KEY `idx_claim_token` (`claim_token`),
+          KEY `idx_created` (`created_at`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+        """
+        schema_ddl = f"""
+        CREATE TABLE IF NOT EXISTS `{self.t.schema}` (
+          `id`           TINYINT NOT NULL PRIMARY KEY,
+          `version`      INT NOT NULL,
+          `updated_at`   DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+        """
+        conn = self.connection()
+        try:
+            with conn.cursor() as c:
+                c.execute(ddl)
+                c.execute(member_ddl)
+                c.execute(dedup_ddl)
+                c.execute(job_claim_ddl)
+                c.execute(outbox_ddl)
+                c.execute(schema_ddl)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_schema_version(self):
+        conn = self.connection()
+        try:
+            with conn.cursor() as c:
+                c.execute(f"SELECT version FROM `{self.t.schema}` WHERE id = 1")
+                row = c.fetchone()
+                return row[0] if row else 0
+        except pymysql.err.ProgrammingError as e:
+            if e.args and e.args[0] == 1146:  # ER_NO_SUCH_TABLE
+                return 0
+            raise
+        finally:
+            conn.close()
+
+    def set_schema_version(self, version):
+        conn = self.connection()
+        try:
+            with conn.cursor() as c:
+                c.execute(
+                    f"""
+                    INSERT INTO `{self.t.schema}` (id, version) VALUES (1, %s)
+                    ON DUPLICATE KEY UPDATE version = VALUES(version)
+                    """,
+                    (version,),
+                )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def record_reply(self, session, user_id, user_name, reply_text):
+        """
+        以 INSERT ... ON DUPLICATE KEY UPDATE 記錄（依 uk_session_user 唯一索引）。
+        `timestamp` 交給 ON UPDATE CURRENT_TIMESTAMP，只有內容真的變動才會更新。
+        已有的列再以 RENAME_REPLY_SQL 更新名字，名字沒變時不寫入。
+        """
+        conn = self.connection()
+        try:
+            with conn.cursor() as c:
+                affected = c.execute(self.sql.upsert_reply, (session, user_id, user_name, reply_text))
+                renamed = 0
+                if affected != 1:
+                    renamed = c.execute(self.sql.rename_reply, (user_name, session, user_id, user_name))
+                if affected or renamed:
+                    # 同一交易內登記成員（「未回應」名單的來源）
+                    c.execute(self.sql.upsert_member, (user_id, user_name))
+            conn.commit()
+        finally:
+            conn.close()
+        return reply_outcome(affected, renamed)
+
+    def record_replies(self, rows):
+        """多列 INSERT ... ON DUPLICATE KEY UPDATE：一批回覆只有一次 commit"""
+        if not rows:
+            return
+        members = {user_id: user_name for _, user_id, user_name, _ in rows}
+        conn = self.connection()
+        try:
+            with conn.cursor() as c:
+                for i in range(0, len(rows), UPSERT_REPLIES_CHUNK):
+                    chunk = rows[i:i + UPSERT_REPLIES_CHUNK]
+                    c.execute(
+                        self.sql.upsert_replies.format(values=", ".join([UPSERT_REPLIES_ROW] * len(chunk))),
+                        [value for row in chunk for value in row],
+                    )
+                # 純 %s 的 INSERT，PyMySQL 的 executemany 會自動合併成多列
+                c.executemany(self.sql.upsert_member, list(members.items()))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def has_replied(self, session, user_id):
+        def query(c):
+            c.execute(self.sql.has_replied, (session, user_id))
+            (count,) = c.fetchone()
+            return count > 0
+        return self._read(query)
+
+    def get_replied_user_ids(self, session, user_ids):
+        def query(c):
+            replied = set()
+            for i in range(0, len(user_ids), REPLIED_IDS_CHUNK):
+                chunk = user_ids[i:i + REPLIED_IDS_CHUNK]
+                sql = self.sql.replied_ids.format(placeholders=", ".join(["%s"] * len(chunk)))
+                c.execute(sql, [session] + chunk)
+                replied.update(row[0] for row in c.fetchall())
+            return replied
+        return self._read(query)
+
+    def get_reply(self, session, user_id):
+        conn = self.connection()
+        try:
+            with conn.cursor() as c:
+                c.execute(self.sql.own_reply, (session, user_id))
+                return c.fetchone()
+        finally:
+            conn.close()
+
+    def update_reply(self, session, user_id, reply_text):
+        conn = self.connection()
+        try:
+            with conn.cursor() as c:
+                affected = c.execute(self.sql.update_reply, (reply_text, session, user_id, reply_text))
+            conn.commit()
+        finally:
+            conn.close()
+        return affected > 0
+
+    def load_attendance_rows(self, session):
+        def query(c):
+            c.execute(self.sql.attendance, (session,))
+            return c.fetchall()
+        return self._read(query)
+
+    def prune_sessions(self, cutoff, batch_size=1000):
+        removed = 0
+        conn = self.connection()
+        try:
+            with conn.cursor() as c:
+                while True:
+                    n = c.execute(
+                        f"DELETE FROM `{self.t.reply}` WHERE session_date < %s LIMIT %s",
+                        (cutoff, batch_size),
+                    )
+                    conn.commit()
+                    removed += n
+                    if n < batch_size:
+                        break
+        finally:
+            conn.close()
+        return removed
+
+    def claim_webhook_event(self, event_id, ttl):
+        """affected rows：新增 = 1、過期後重新佔用 = 2、仍在有效期內 = 0"""
+        conn = self.connection()
+        try:
+            with conn.cursor() as c:
+                affected = c.execute(self.sql.claim_event, (event_id, int(ttl)))
+                self._dedup_claims += 1
+                if self._dedup_claims % PURGE_EVENTS_EVERY == 0:
+                    c.execute(self.sql.purge_events)
+            conn.commit()
+            return affected > 0
+        finally:
+            conn.close()
+
+    def claim_job_fire(self, job_id, fire_time, shard, owner, lease_seconds):
+        key = (job_id, fire_time, shard)
+        conn = self.connection()
+        try:
+            with conn.cursor() as c:
+                if c.execute(self.sql.claim_job, key + (owner, int(lease_seconds))):
+                    status = JOB_CLAIMED
+                elif c.execute(self.sql.take_over_job, (owner, int(lease_seconds)) + key):
+                    status = JOB_CLAIMED
+                else:
+                    c.execute(self.sql.job_done, key)
+                    (done,) = c.fetchone()
+                    status = JOB_DONE if done else JOB_BUSY
+            conn.commit()
+            return status
+        finally:
+            conn.close()
+
+    def finish_job_fire(self, job_id, fire_time, shard, owner, retry_in=None):
+        key = (job_id, fire_time, shard)
+        conn = self.connection()
+        try:
+            with conn.cursor() as c:
+                if retry_in is None:
+                    c.execute(self.sql.finish_job, key)
+                else:
+                    c.execute(self.sql.release_job, (int(retry_in),) + key + (owner,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def prune_job_claims(self, days=14):
+        conn = self.connection()
+        try:
+            with conn.cursor() as c:
+                removed = c.execute(
+                    f"DELETE FROM `{self.t.job_claim}` WHERE fire_time < NOW() - INTERVAL %s DAY",
+                    (int(days),),
+                )
+            conn.commit()
+            return removed
+        finally:
+            conn.close()
+
+    # ---------- outbox ----------
+
+    def enqueue_outbox(self, rows):
+        if not rows:
+            return 0
+        conn = self.connection()
+        try:
+            with conn.cursor() as c:
+                inserted = c.executemany(
+                    f"""
+                    INSERT IGNORE INTO `{self.t.outbox}` (idempotency_key, kind, user_id, message)
+                    VALUES (%s, %s, %s, %s)
+                    """,
+                    rows,
+                )
+            conn.commit()
+            return inserted
+        finally:
+            conn.close()
+
+    def claim_outbox(self, owner, limit, lease_seconds):
+        """以單一 UPDATE ... LIMIT 搶列（各 worker 的 claim_token 不同），再依 token 取回"""
+        token = str(uuid.uuid4())
+        conn = self.connection()
+        try:
+            with conn.cursor() as c:
+                claimed = c.execute(
+                    f"""
+                    UPDATE `{self.t.outbox}`
+                    SET state = '{OUTBOX_INFLIGHT}', owner = %s, claim_token = %s,
+                        claimed_at = NOW(), attempts = attempts + 1
+                    WHERE (state = '{OUTBOX_PENDING}' AND next_attempt_at <= NOW())
+                       OR (state = '{OUTBOX_INFLIGHT}' AND claimed_at < NOW() - INTERVAL %s SECOND)
+                    ORDER BY id
+                    LIMIT %s
+                    """,
+                    (owner, token, int(lease_seconds), int(limit)),
+                )
+                rows = []
+                if claimed:
+                    c.execute(
+                        f"""
+                        SELECT id, idempotency_key, kind, user_id, message, attempts
+                        FROM `{self.t.outbox}` WHERE claim_token = %s ORDER BY id
+                        """,
+                        (token,),
+                    )
+                    rows = c.fetchall()
+            conn.commit()
+            return token, list(rows)
+        finally:
+            conn.close()
+
+    def mark_outbox_sent(self, ids, claim_token):
+        if not ids:
+            return
+        conn = self.connection()
+        try:
+            with conn.cursor() as c:
+                c.execute(
+                    f"""
+                    UPDATE `{self.t.outbox}`
+                    SET state = '{OUTBOX_SENT}', sent_at = NOW(), claim_token = NULL, last_error = NULL
+                    WHERE id IN ({", ".join(["%s"] * len(ids))}) AND claim_token = %s
+                    """,
+                    list(ids) + [claim_token],
+                )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def mark_outbox_failed(self, outbox_id, claim_token, error, retry_in=None):
+        conn = self.connection()
+        try:
+            with conn.cursor() as c:
+                if retry_in is None:
+                    c.execute(
+                        f"""
+                        UPDATE `{self.t.outbox}`
+                        SET state = '{OUTBOX_FAILED}', claim_token = NULL, last_error = %s
+                        WHERE id = %s AND claim_token = %s
+                        """,
+                        (str(error)[:255], outbox_id, claim_token),
+                    )
+                else:
+                    c.execute(
+                        f"""
+                        UPDATE `{self.t.outbox}`
+                        SET state = '{OUTBOX_PENDING}', claim_token = NULL, last_error = %s,
+                            next_attempt_at = NOW() + INTERVAL %s SECOND
+                        WHERE id = %s AND claim_token = %s
+                        """,
+                        (str(error)[:255], int(retry_in), outbox_id, claim_token),
+                    )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def prune_outbox(self, days=14):
+        conn = self.connection()
+        try:
+            with conn.cursor() as c:
+                removed = c.execute(
+                    f"""
+                    DELETE FROM `{self.t.outbox}`
+                    WHERE state IN ('{OUTBOX_SENT}', '{OUTBOX_FAILED}') AND created_at < NOW() - INTERVAL %s DAY
+                    """,
+                    (int(days),),
+                )
+            conn.commit()
+            return removed
+        finally:
+            conn.close()
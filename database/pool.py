@@ -0,0 +1,176 @@
+# pool.py
+"""
+執行緒安全的 PyMySQL 連線池。
+
+- 固定上限（size），閒置連線放在 LIFO 堆疊中重複使用
+- 取出前若閒置過久會先 ping 做健康檢查，壞掉的連線直接丟棄重建
+- 超過 recycle 秒數的連線會被回收，避免被 RDS wait_timeout 砍掉
+- 以 PID 偵測 fork（Gunicorn preload / 多 worker），子行程不會沿用父行程的 socket
+"""
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """等待可用連線逾時"""
+
+
+class PooledConnection:
+    """包裝實體連線；close() 時歸還連線池而不是真的關閉"""
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def close(self):
+        raw, self._raw = self._raw, None
+        if raw is not None:
+            self._pool._release(raw)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    def __init__(self, connect, size=5, recycle=3600, ping_after=30, timeout=10):
+        """
+        connect:    建立新實體連線的函式
+        size:       同時存在的最大連線數（借出 + 閒置）
+        recycle:    連線建立超過幾秒即淘汰（<=0 表示不淘汰）
+        ping_after: 閒置超過幾秒，取出前先 ping 一次
+        timeout:    連線池用盡時最多等待幾秒
+        """
+        self._connect = connect
+        self.size = size
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self.timeout = timeout
+
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = []          # [(raw, created_at, last_used)]
+        self._created = {}       # id(raw) -> created_at（含借出中的連線）
+        self._pid = os.getpid()
+
+    # ---------- 公開介面 ----------
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._cond:
+                self._check_fork()
+                while not self._idle and len(self._created) >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"等待資料庫連線逾時（pool size={self.size}）")
+                    self._cond.wait(remaining)
+                if not self._idle:
+                    # 先佔位再於鎖外建立連線，避免阻塞其他執行緒
+                    placeholder = object()
+                    self._created[id(placeholder)] = time.monotonic()
+                    break
+                raw, created_at, last_used = self._idle.pop()
+
+            # 健康檢查（ping）在鎖外進行：連線已從 _idle 取出，仍計入 _created，不會超過 size
+            if self._usable(raw, created_at, last_used):
+                return PooledConnection(self, raw)
+            with self._cond:
+                self._created.pop(id(raw), None)
+                self._cond.notify()
+            self._close(raw)
+
+        try:
+            raw = self._connect()
+        except Exception:
+            with self._cond:
+                self._created.pop(id(placeholder), None)
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._created.pop(id(placeholder), None)
+            self._created[id(raw)] = time.monotonic()
+        return PooledConnection(self, raw)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self.size,
+                "open": len(self._created),
+                "idle": len(self._idle),
+                "in_use": len(self._created) - len(self._idle),
+            }
+
+    def close_all(self):
+        """關閉所有閒置連線；借出中的連線不受影響，歸還後照常放回連線池"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            for raw, _, _ in idle:
+                self._discard(raw)
+            self._cond.notify_all()
+
+    # ---------- 內部 ----------
+
+    def _release(self, raw):
+        # 結束交易：避免 REPEATABLE READ 快照或未提交的寫入被下一位使用者沿用
+        try:
+            raw.rollback()
+            healthy = True
+        except Exception:
+            healthy = False
+
+        with self._cond:
+            if os.getpid() != self._pid or id(raw) not in self._created:
+                # fork 之後或已被 close_all 移除的連線，不再放回
+                self._created.pop(id(raw), None)
+                self._cond.notify()
+                return
+            created_at = self._created[id(raw)]
+            if healthy and not self._expired(created_at):
+                self._idle.append((raw, created_at, time.monotonic()))
+            else:
+                self._discard(raw)
+            self._cond.notify()
+
+    def _usable(self, raw, created_at, last_used):
+        if self._expired(created_at):
+            return False
+        if self.ping_after >= 0 and time.monotonic() - last_used >= self.ping_after:
+            try:
+                raw.ping(reconnect=False)
+            except Exception as e:
+                logger.warning("資料庫連線健康檢查失敗，重新建立: %s", e)
+                return False
+        return True
+
+    def _expired(self, created_at):
+        return self.recycle > 0 and time.monotonic() - created_at >= self.recycle
+
+    def _discard(self, raw):
+        self._created.pop(id(raw), None)
+        self._close(raw)
+
+    @staticmethod
+    def _close(raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _check_fork(self):
+        """fork 後子行程不可關閉繼承來的 socket（會送出 COM_QUIT 影響父行程），只能丟棄"""
+        pid = os.getpid()
+        if pid != self._pid:
+            logger.info("偵測到 fork（%s -> %s），重設資料庫連線池", self._pid, pid)
+            self._pid = pid
+            self._idle = []
+            self._created = {}
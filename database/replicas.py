@@ -0,0 +1,128 @@
+# replicas.py
+"""
+MySQL 讀取副本（RDS_REPLICA_HOSTS 有設定時使用）。
+
+- 唯讀、可容忍些許延遲的查詢（出席統計重建、提醒前的 has_replied）送到 replica，primary 只處理寫入
+- 多個 replica 輪流使用；連線或查詢失敗的 replica 暫停 DB_REPLICA_RETRY_SECONDS 秒，期間改查 primary
+- read-your-writes：本行程剛寫入的回覆在 DB_READ_YOUR_WRITES_SECONDS 秒內由 RecentWrites 疊加到
+  replica 的結果上，replica 延遲期間也不會「消失」（見 database/db.py）
+"""
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Replica:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.down_until = 0.0
+
+    @property
+    def label(self):
+        return f"{self.host}:{self.port}"
+
+    def healthy(self, now=None) -> bool:
+        return (now or time.monotonic()) >= self.down_until
+
+
+def parse_hosts(value, default_port=3306):
+    """"host1,host2:3307" -> [Replica, ...]"""
+    replicas = []
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.partition(":")
+        replicas.append(Replica(host, int(port) if port else default_port))
+    return replicas
+
+
+class ReplicaSet:
+    """replica 的健康狀態與輪詢；連線池由各後端（PyMySQL / aiomysql）自行管理"""
+
+    def __init__(self, replicas, retry_seconds=30):
+        self.replicas = list(replicas)
+        self.retry_seconds = retry_seconds
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.replicas)
+
+    def pick(self):
+        """下一個健康的 replica；全部暫停中時回傳 None（改查 primary）"""
+        now = time.monotonic()
+        with self._lock:
+            for _ in range(len(self.replicas)):
+                replica = self.replicas[self._next % len(self.replicas)]
+                self._next += 1
+                if replica.healthy(now):
+                    return replica
+        return None
+
+    def mark_down(self, replica, error):
+        with self._lock:
+            was_healthy = replica.healthy()
+            replica.down_until = time.monotonic() + self.retry_seconds
+        if was_healthy:
+            logger.warning("讀取副本 %s 無法使用，%d 秒內改查 primary: %s", replica.label, self.retry_seconds, error)
+
+
+class RecentWrites:
+    """
+    本行程最近寫入的回覆（read-your-writes）：{(session, user_id): (user_name, reply_text, 寫入時間)}。
+    超過 window 秒的紀錄視為 replica 已追上，不再疊加。
+    """
+
+    def __init__(self, window=5.0):
+        self.window = window
+        self._lock = threading.Lock()
+        self._writes = {}
+
+    def note(self, session, user_id, user_name, reply_text):
+        now = time.monotonic()
+        with self._lock:
+            previous = self._writes.get((session, user_id))
+            if user_name is None and previous is not None:
+                # update_reply 沒有名字：沿用上一次的
+                user_name = previous[0]
+            self._writes[(session, user_id)] = (user_name, reply_text, now)
+            if len(self._writes) > 1000:
+                self._expire(now)
+
+    def get(self, session, user_id):
+        """視窗內的 (user_name, reply_text)，沒有時回傳 None"""
+        with self._lock:
+            entry = self._writes.get((session, user_id))
+        if entry is None or time.monotonic() - entry[2] >= self.window:
+            return None
+        return entry[0], entry[1]
+
+    def pending(self, session) -> dict:
+        """視窗內本場次的 {user_id: (user_name, reply_text)}"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            return {uid: (name, text) for (s, uid), (name, text, _) in self._writes.items() if s == session}
+
+    def overlay_rows(self, session, rows):
+        """把視窗內的寫入疊加到 load_attendance_rows 的結果上"""
+        recent = self.pending(session)
+        if not recent:
+            return rows
+        merged = {uid: (uid, name, text) for uid, name, text in rows}
+        for uid, (name, text) in recent.items():
+            if name is None:
+                name = merged[uid][1] if uid in merged else None
+                if name is None:
+                    continue
+            merged[uid] = (uid, name, text)
+        return list(merged.values())
+
+    def _expire(self, now):
+        expired = [key for key, (_, _, at) in self._writes.items() if now - at >= self.window]
+        for key in expired:
+            del self._writes[key]
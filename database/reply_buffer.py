@@ -0,0 +1,260 @@
+# reply_buffer.py
+"""
+回覆的 write-behind 緩衝（REPLY_WRITE_BEHIND=true 時使用）。
+
+提醒發出後幾秒內會湧入大量「要 / 不要」，逐則寫 DB 就是逐則 commit。開啟後：
+
+1. 回覆先附加到本機 journal（每行一筆 JSON，預設 fsync），行程當掉也不會遺失
+2. 放進記憶體中的待寫入表（同人同場次只留最後一筆），讀取時會疊加上去（read-your-writes）
+3. 背景執行緒每 flush_interval 秒、或累積 flush_batch 筆時，以一次多列 upsert 寫入 DB
+
+journal 依「行程 PID + 序號」分段：每次 flush 封存目前的分段並開新檔，
+寫入 DB 成功後才刪除已封存的分段。啟動時 replay() 會把遺留的分段補寫進 DB；
+多個 worker 同時啟動時以 <journal_path>.lock（flock）排隊，同一個分段只會被一個 worker 補寫。
+"""
+import os
+import glob
+import fcntl
+import json
+import time
+import logging
+import threading
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+
+def _segment_pid(path):
+    """journal 分段檔名為 <path>.<pid>.<seq>；格式不符時回傳 None"""
+    parts = path.rsplit(".", 2)
+    if len(parts) != 3 or not parts[1].isdigit() or not parts[2].isdigit():
+        return None
+    return int(parts[1])
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ReplyBuffer:
+    def __init__(self, writer, journal_path, flush_interval=0.3, flush_batch=100, fsync=True):
+        """
+        writer: 寫入 DB 的函式 writer([(session, user_id, user_name, reply_text), ...])
+        journal_path: journal 分段的路徑前綴
+        """
+        self.writer = writer
+        self.journal_path = journal_path
+        self.flush_interval = flush_interval
+        self.flush_batch = max(1, flush_batch)
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()   # 同一時間只有一個 flush 在寫 DB
+        self._wakeup = threading.Condition(self._lock)
+        self._pending = {}    # (session, user_id) -> (user_name, reply_text)
+        self._inflight = {}   # 正在寫入 DB 的那一批（寫入完成前讀取仍要看得到）
+        self._file = None
+        self._seq = 0
+        self._pid = None
+        self._thread = None
+        self._closed = False
+
+    # ---------- journal ----------
+
+    def _segment(self, seq):
+        return f"{self.journal_path}.{os.getpid()}.{seq}"
+
+    def _ensure_process(self):
+        """fork 後（PID 不同）不沿用父行程的 journal 與執行緒"""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._file = None
+        self._seq = 0
+        self._thread = None
+        self._pending, self._inflight = {}, {}
+
+    def _open_segment(self):
+        self._seq += 1
+        self._file = open(self._segment(self._seq), "a", encoding="utf-8")
+
+    def _append(self, record):
+        if self._file is None:
+            self._open_segment()
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def _seal(self):
+        """封存目前的分段（之後的回覆寫到新檔）；回傳封存的序號"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        return self._seq
+
+    def _remove_segments(self, upto):
+        for seq in range(1, upto + 1):
+            try:
+                os.remove(self._segment(seq))
+            except FileNotFoundError:
+                pass
+
+    # ---------- 寫入 ----------
+
+    def submit(self, session, user_id, user_name, reply_text):
+        """記錄一筆回覆：寫入 journal 後即返回，DB 由背景執行緒批次寫入"""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("ReplyBuffer 已關閉")
+            self._ensure_process()
+            self._append({
+                "ts": time.time(),
+                "session": session.isoformat(),
+                "user_id": user_id,
+                "user_name": user_name,
+                "reply_text": reply_text,
+            })
+            self._pending[(session, user_id)] = (user_name, reply_text)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="reply-flusher", daemon=True)
+                self._thread.start()
+            if len(self._pending) >= self.flush_batch:
+                self._wakeup.notify()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._closed and len(self._pending) < self.flush_batch:
+                    self._wakeup.wait(self.flush_interval)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                # 保留在待寫入表與 journal，下一輪重試
+                logger.error("回覆批次寫入失敗，稍後重試: %s", e)
+                time.sleep(self.flush_interval)
+
+    def flush(self):
+        """把目前待寫入的回覆以一批寫進 DB；回傳筆數"""
+        with self._flush_lock:
+            with self._lock:
+                self._ensure_process()
+                if not self._pending:
+                    return 0
+                batch, self._pending = self._pending, {}
+                self._inflight = batch
+                sealed = self._seal()
+            try:
+                self.writer([(s, uid, name, text) for (s, uid), (name, text) in batch.items()])
+            except Exception:
+                with self._lock:
+                    # 失敗：放回待寫入表（期間的新回覆較新，優先保留）；已封存的分段留著，成功後一併刪除
+                    for key, value in batch.items():
+                        self._pending.setdefault(key, value)
+                    self._inflight = {}
+                raise
+            with self._lock:
+                self._inflight = {}
+            self._remove_segments(sealed)
+            return len(batch)
+
+    def close(self, timeout=10):
+        """停止背景執行緒並寫入剩餘的回覆（失敗時留在 journal，下次啟動 replay）"""
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify_all()
+            thread = self._thread if self._pid == os.getpid() else None
+        if thread is not None:
+            thread.join(timeout)
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error("關閉時寫入回覆失敗，已保留在 journal: %s", e)
+        with self._lock:
+            self._seal()
+
+    # ---------- 讀取（疊加尚未寫入 DB 的回覆） ----------
+
+    def get(self, session, user_id):
+        """尚未寫入 DB 的回覆 (user_name, reply_text)；沒有時回傳 None"""
+        key = (session, user_id)
+        with self._lock:
+            return self._pending.get(key) or self._inflight.get(key)
+
+    def pending(self, session):
+        """該場次尚未寫入 DB 的回覆：{user_id: (user_name, reply_text)}"""
+        with self._lock:
+            merged = {uid: value for (s, uid), value in self._inflight.items() if s == session}
+            merged.update({uid: value for (s, uid), value in self._pending.items() if s == session})
+        return merged
+
+    def size(self) -> int:
+        return len(self._pending) + len(self._inflight)
+
+    def overlay_rows(self, session, rows):
+        """把尚未寫入的回覆疊加到 load_attendance_rows 的結果上"""
+        pending = self.pending(session)
+        if not pending:
+            return rows
+        merged = {uid: (uid, name, text) for uid, name, text in rows}
+        for uid, (name, text) in pending.items():
+            merged[uid] = (uid, name, text)
+        return list(merged.values())
+
+    # ---------- 啟動時補寫 ----------
+
+    def replay(self):
+        """
+        把先前行程遺留的 journal 分段補寫進 DB，成功後刪除；回傳補寫筆數。
+        仍在執行中的其他行程（例如同機的其他 worker）的分段不處理。
+        整個過程持有 <journal_path>.lock 的排他鎖：後到的 worker 等前一個補寫完，看到的分段已刪除。
+        """
+        with open(f"{self.journal_path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                return self._replay_locked()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _replay_locked(self):
+        paths = []
+        with self._lock:
+            # 本行程已開始寫入時，同 PID 的分段是自己的（不是前一次啟動留下的）
+            own_active = self._pid == os.getpid() and self._seq > 0
+        for path in glob.glob(f"{glob.escape(self.journal_path)}.*.*"):
+            pid = _segment_pid(path)
+            if pid is None:
+                continue
+            if pid == os.getpid() and own_active or pid != os.getpid() and _pid_alive(pid):
+                continue
+            paths.append(path)
+        if not paths:
+            return 0
+
+        records = []
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # 寫到一半當掉的最後一行
+                        logger.warning("略過 journal 中不完整的一行: %s", path)
+        records.sort(key=lambda r: r["ts"])
+
+        latest = {}
+        for r in records:
+            latest[(date.fromisoformat(r["session"]), r["user_id"])] = (r["user_name"], r["reply_text"])
+        if latest:
+            self.writer([(s, uid, name, text) for (s, uid), (name, text) in latest.items()])
+        for path in paths:
+            os.remove(path)
+        logger.info("已從 journal 補寫 %d 筆回覆（%d 個分段）", len(latest), len(paths))
+        return len(latest)
@@ -0,0 +1,472 @@
+# sqlite_store.py
+"""
+本機 SQLite 後端（WAL 模式）。
+
+單一群組的機器人不需要遠端資料庫：每個 webhook 少一次網路往返。
+WAL 讓讀取不會被寫入擋住；同一檔案可由多個 Gunicorn worker 共用
+（寫入以 BEGIN IMMEDIATE 序列化，busy_timeout 內自動等待）。
+"""
+import os
+import uuid
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from database.storage import (
+    ReplyStore,
+    REPLY_INSERTED, REPLY_UPDATED, REPLY_RENAMED, REPLY_UNCHANGED,
+    OUTBOX_PENDING, OUTBOX_INFLIGHT, OUTBOX_SENT, OUTBOX_FAILED,
+    JOB_CLAIMED, JOB_BUSY, JOB_DONE,
+)
+
+BUSY_TIMEOUT_MS = 5000
+
+
+def _ts(value):
+    """date / datetime 一律以 ISO 字串存放（與 CURRENT_TIMESTAMP 的格式相同，可直接比較）"""
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class SQLiteStore(ReplyStore):
+    name = "sqlite"
+
+    def __init__(self, path, tables=None):
+        super().__init__(tables)
+        self.path = path
+        self._local = threading.local()
+        self._dedup_claims = 0
+
+    def scoped(self, tables):
+        store = SQLiteStore(self.path, tables)
+        store._local = self._local   # 同一個檔案：共用各執行緒的連線
+        return store
+
+    # ---------- 連線 ----------
+
+    def _connection(self):
+        """每個執行緒一條連線；fork 後（PID 不同）重新開啟，不沿用父行程的連線"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _write(self, func):
+        """以 BEGIN IMMEDIATE 執行一段寫入（一開始就取得寫鎖，避免讀後升級寫鎖時的 SQLITE_BUSY）"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(conn)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    # ---------- 介面實作 ----------
+
+    def init_db(self):
+        conn = self._connection()
+        conn.executescript(f"""
+        CREATE TABLE IF NOT EXISTS "{self.t.reply}" (
+          id           INTEGER PRIMARY KEY AUTOINCREMENT,
+          session_date TEXT NOT NULL,
+          user_id      TEXT,
+          user_name    TEXT,
+          reply_text   TEXT,
+          has_replied  INTEGER NOT NULL DEFAULT 0,
+          timestamp    TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+          UNIQUE (session_date, user_id)
+        );
+        CREATE INDEX IF NOT EXISTS "idx_{self.t.reply}_user_ts" ON "{self.t.reply}" (user_id, timestamp);
+        CREATE TABLE IF NOT EXISTS "{self.t.member}" (
+          user_id      TEXT NOT NULL PRIMARY KEY,
+          user_name    TEXT,
+          created_at   TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS "{self.t.dedup}" (
+          event_id     TEXT NOT NULL PRIMARY KEY,
+          expires_at   TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS "idx_{self.t.dedup}_expires" ON "{self.t.dedup}" (expires_at);
+        CREATE TABLE IF NOT EXISTS "{self.t.job_claim}" (
+          job_id       TEXT NOT NULL,
+          fire_time    TEXT NOT NULL,
+          shard        INTEGER NOT NULL DEFAULT 0,
+          owner        TEXT NOT NULL,
+          claimed_at   TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+          lease_until  TEXT,
+          done_at      TEXT,
+          PRIMARY KEY (job_id, fire_time, shard)
+        );
+        CREATE TABLE IF NOT EXISTS "{self.t.outbox}" (
+          id              INTEGER PRIMARY KEY AUTOINCREMENT,
+          idempotency_key TEXT NOT NULL UNIQUE,
+          kind            TEXT NOT NULL,
+          user_id         TEXT NOT NULL,
+          message         TEXT NOT NULL,
+          state           TEXT NOT NULL DEFAULT '{OUTBOX_PENDING}',
+          attempts        INTEGER NOT NULL DEFAULT 0,
+          owner           TEXT,
+          claim_token     TEXT,
+          claimed_at      TEXT,
+          next_attempt_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+          sent_at         TEXT,
+          last_error      TEXT,
+          created_at      TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS "idx_{self.t.outbox}_state_next" ON "{self.t.outbox}" (state, next_attempt_at);
+        CREATE INDEX IF NOT EXISTS "idx_{self.t.outbox}_claim_token" ON "{self.t.outbox}" (claim_token);
+        CREATE TABLE IF NOT EXISTS "{self.t.schema}" (
+          id           INTEGER NOT NULL PRIMARY KEY,
+          version      INTEGER NOT NULL,
+          updated_at   TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+        # 結構版本 3：job_claim 加上租約（較早建立的檔案補上欄位）
+        columns = {row[1] for row in conn.execute(f'PRAGMA table_info("{self.t.job_claim}")')}
+        for column in ("lease_until", "done_at"):
+            if column not in columns:
+                conn.execute(f'ALTER TABLE "{self.t.job_claim}" ADD COLUMN {column} TEXT')
+
+    def get_schema_version(self):
+        conn = self._connection()
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (self.t.schema,)
+        ).fetchone()
+        if not exists:
+            return 0
+        row = conn.execute(f'SELECT version FROM "{self.t.schema}" WHERE id = 1').fetchone()
+        return row[0] if row else 0
+
+    def set_schema_version(self, version):
+        self._write(lambda conn: conn.execute(
+            f"""
+            INSERT INTO "{self.t.schema}" (id, version, updated_at) VALUES (1, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET version = excluded.version, updated_at = excluded.updated_at
+            """,
+            (version, _now()),
+        ))
+
+    def record_reply(self, session, user_id, user_name, reply_text):
+        session = _ts(session)
+
+        def write(conn):
+            row = conn.execute(
+                f'SELECT user_name, reply_text, has_replied FROM "{self.t.reply}" WHERE session_date=? AND user_id=?',
+                (session, user_id),
+            ).fetchone()
+            if row == (user_name, reply_text, 1):
+                return REPLY_UNCHANGED
+            if row is None:
+                conn.execute(
+                    f"""
+                    INSERT INTO "{self.t.reply}" (session_date, user_id, user_name, reply_text, has_replied, timestamp)
+                    VALUES (?, ?, ?, ?, 1, ?)
+                    """,
+                    (session, user_id, user_name, reply_text, _now()),
+                )
+                outcome = REPLY_INSERTED
+            else:
+                conn.execute(
+                    f"""
+                    UPDATE "{self.t.reply}" SET user_name=?, reply_text=?, has_replied=1, timestamp=?
+                    WHERE session_date=? AND user_id=?
+                    """,
+                    (user_name, reply_text, _now(), session, user_id),
+                )
+                outcome = REPLY_RENAMED if row[1:] == (reply_text, 1) else REPLY_UPDATED
+            conn.execute(
+                f"""
+                INSERT INTO "{self.t.member}" (user_id, user_name) VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET user_name = excluded.user_name
+                """,
+                (user_id, user_name),
+            )
+            return outcome
+
+        return self._write(write)
+
+    def record_replies(self, rows):
+        if not rows:
+            return
+        now = _now()
+
+        def write(conn):
+            conn.executemany(
+                f"""
+                INSERT INTO "{self.t.reply}" (session_date, user_id, user_name, reply_text, has_replied, timestamp)
+                VALUES (?, ?, ?, ?, 1, ?)
+                ON CONFLICT(session_date, user_id) DO UPDATE SET
+                  user_name = excluded.user_name, reply_text = excluded.reply_text,
+                  has_replied = 1, timestamp = excluded.timestamp
+                """,
+                [(_ts(session), uid, name, text, now) for session, uid, name, text in rows],
+            )
+            conn.executemany(
+                f"""
+                INSERT INTO "{self.t.member}" (user_id, user_name) VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET user_name = excluded.user_name
+                """,
+                list({uid: name for _, uid, name, _ in rows}.items()),
+            )
+
+        self._write(write)
+
+    def has_replied(self, session, user_id):
+        row = self._connection().execute(
+            f"""
+            SELECT COUNT(*) FROM "{self.t.reply}"
+            WHERE session_date=? AND user_id=? AND reply_text IS NOT NULL AND reply_text != ''
+            """,
+            (_ts(session), user_id),
+        ).fetchone()
+        return row[0] > 0
+
+    def get_reply(self, session, user_id):
+        row = self._connection().execute(
+            f'SELECT user_name, reply_text FROM "{self.t.reply}" WHERE session_date=? AND user_id=?',
+            (_ts(session), user_id),
+        ).fetchone()
+        return tuple(row) if row is not None else None
+
+    def get_replied_user_ids(self, session, user_ids):
+        replied = set()
+        conn = self._connection()
+        # SQLite 的參數上限預設 999
+        for i in range(0, len(user_ids), 900):
+            chunk = user_ids[i:i + 900]
+            placeholders = ", ".join(["?"] * len(chunk))
+            rows = conn.execute(
+                f"""
+                SELECT user_id FROM "{self.t.reply}"
+                WHERE session_date=? AND user_id IN ({placeholders})
+                  AND reply_text IS NOT NULL AND reply_text != ''
+                """,
+                [_ts(session)] + chunk,
+            ).fetchall()
+            replied.update(row[0] for row in rows)
+        return replied
+
+    def update_reply(self, session, user_id, reply_text):
+        def write(conn):
+            cur = conn.execute(
+                f"""
+                UPDATE "{self.t.reply}" SET reply_text=?, has_replied=1, timestamp=?
+                WHERE session_date=? AND user_id=? AND reply_text IS NOT ?
+                """,
+                (reply_text, _now(), _ts(session), user_id, reply_text),
+            )
+            return cur.rowcount > 0
+
+        return self._write(write)
+
+    def load_attendance_rows(self, session):
+        return self._connection().execute(
+            f"""
+            SELECT m.user_id,
+                   COALESCE(r.user_name, m.user_name),
+                   COALESCE(r.reply_text, '')
+            FROM "{self.t.member}" m
+            LEFT JOIN "{self.t.reply}" r
+              ON r.session_date = ? AND r.user_id = m.user_id
+            ORDER BY m.created_at, m.user_id
+            """,
+            (_ts(session),),
+        ).fetchall()
+
+    def prune_sessions(self, cutoff, batch_size=1000):
+        removed = 0
+        while True:
+            n = self._write(lambda conn: conn.execute(
+                f"""
+                DELETE FROM "{self.t.reply}" WHERE id IN (
+                  SELECT id FROM "{self.t.reply}" WHERE session_date < ? LIMIT ?
+                )
+                """,
+                (_ts(cutoff), batch_size),
+            ).rowcount)
+            removed += n
+            if n < batch_size:
+                return removed
+
+    def claim_webhook_event(self, event_id, ttl):
+        now = datetime.now()
+        expires = _ts(now + timedelta(seconds=int(ttl)))
+
+        def write(conn):
+            # 新增，或前一筆已過期時重新佔用；仍在有效期內則不變（rowcount = 0）
+            cur = conn.execute(
+                f"""
+                INSERT INTO "{self.t.dedup}" (event_id, expires_at) VALUES (?, ?)
+                ON CONFLICT(event_id) DO UPDATE SET expires_at = excluded.expires_at
+                WHERE expires_at < ?
+                """,
+                (event_id, expires, _ts(now)),
+            )
+            self._dedup_claims += 1
+            if self._dedup_claims % 500 == 0:
+                conn.execute(f'DELETE FROM "{self.t.dedup}" WHERE expires_at < ?', (_ts(now),))
+            return cur.rowcount > 0
+
+        return self._write(write)
+
+    def claim_job_fire(self, job_id, fire_time, shard, owner, lease_seconds):
+        now = datetime.now()
+        key = (job_id, _ts(fire_time), shard)
+        lease_until = _ts(now + timedelta(seconds=int(lease_seconds)))
+
+        def write(conn):
+            inserted = conn.execute(
+                f"""
+                INSERT OR IGNORE INTO "{self.t.job_claim}" (job_id, fire_time, shard, owner, lease_until)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                key + (owner, lease_until),
+            ).rowcount
+            if inserted:
+                return JOB_CLAIMED
+            # 租約過期、尚未完成：原本的 worker 送出前當掉或放棄，由本 worker 接手
+            taken = conn.execute(
+                f"""
+                UPDATE "{self.t.job_claim}" SET owner = ?, lease_until = ?, claimed_at = ?
+                WHERE job_id = ? AND fire_time = ? AND shard = ?
+                  AND done_at IS NULL AND lease_until IS NOT NULL AND lease_until < ?
+                """,
+                (owner, lease_until, _ts(now)) + key + (_ts(now),),
+            ).rowcount
+            if taken:
+                return JOB_CLAIMED
+            # lease_until 為 NULL：舊版（沒有租約）的 claim，視為已完成
+            (done,) = conn.execute(
+                f"""
+                SELECT done_at IS NOT NULL OR lease_until IS NULL FROM "{self.t.job_claim}"
+                WHERE job_id = ? AND fire_time = ? AND shard = ?
+                """,
+                key,
+            ).fetchone()
+            return JOB_DONE if done else JOB_BUSY
+
+        return self._write(write)
+
+    def finish_job_fire(self, job_id, fire_time, shard, owner, retry_in=None):
+        key = (job_id, _ts(fire_time), shard)
+        if retry_in is None:
+            # 已送出就記錄完成（即使租約已被接手，也讓之後的 worker 不再重送）
+            self._write(lambda conn: conn.execute(
+                f"""
+                UPDATE "{self.t.job_claim}" SET done_at = ?
+                WHERE job_id = ? AND fire_time = ? AND shard = ? AND done_at IS NULL
+                """,
+                (_now(),) + key,
+            ))
+            return
+        lease_until = _ts(datetime.now() + timedelta(seconds=int(retry_in)))
+        self._write(lambda conn: conn.execute(
+            f"""
+            UPDATE "{self.t.job_claim}" SET lease_until = ?
+            WHERE job_id = ? AND fire_time = ? AND shard = ? AND owner = ? AND done_at IS NULL
+            """,
+            (lease_until,) + key + (owner,),
+        ))
+
+    def prune_job_claims(self, days=14):
+        cutoff = _ts(datetime.now() - timedelta(days=int(days)))
+        return self._write(lambda conn: conn.execute(
+            f'DELETE FROM "{self.t.job_claim}" WHERE fire_time < ?', (cutoff,),
+        ).rowcount)
+
+    # ---------- outbox ----------
+
+    def enqueue_outbox(self, rows):
+        if not rows:
+            return 0
+        now = _now()
+        return self._write(lambda conn: conn.executemany(
+            f"""
+            INSERT OR IGNORE INTO "{self.t.outbox}" (idempotency_key, kind, user_id, message, next_attempt_at, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            [tuple(row) + (now, now) for row in rows],
+        ).rowcount)
+
+    def claim_outbox(self, owner, limit, lease_seconds):
+        token = str(uuid.uuid4())
+        now = datetime.now()
+
+        def write(conn):
+            conn.execute(
+                f"""
+                UPDATE "{self.t.outbox}"
+                SET state = '{OUTBOX_INFLIGHT}', owner = ?, claim_token = ?, claimed_at = ?, attempts = attempts + 1
+                WHERE id IN (
+                  SELECT id FROM "{self.t.outbox}"
+                  WHERE (state = '{OUTBOX_PENDING}' AND next_attempt_at <= ?)
+                     OR (state = '{OUTBOX_INFLIGHT}' AND claimed_at < ?)
+                  ORDER BY id LIMIT ?
+                )
+                """,
+                (owner, token, _ts(now), _ts(now), _ts(now - timedelta(seconds=int(lease_seconds))), int(limit)),
+            )
+            rows = conn.execute(
+                f"""
+                SELECT id, idempotency_key, kind, user_id, message, attempts
+                FROM "{self.t.outbox}" WHERE claim_token = ? ORDER BY id
+                """,
+                (token,),
+            ).fetchall()
+            return token, rows
+
+        return self._write(write)
+
+    def mark_outbox_sent(self, ids, claim_token):
+        if not ids:
+            return
+        self._write(lambda conn: conn.execute(
+            f"""
+            UPDATE "{self.t.outbox}"
+            SET state = '{OUTBOX_SENT}', sent_at = ?, claim_token = NULL, last_error = NULL
+            WHERE id IN ({", ".join(["?"] * len(ids))}) AND claim_token = ?
+            """,
+            [_now()] + list(ids) + [claim_token],
+        ))
+
+    def mark_outbox_failed(self, outbox_id, claim_token, error, retry_in=None):
+        if retry_in is None:
+            self._write(lambda conn: conn.execute(
+                f"""
+                UPDATE "{self.t.outbox}" SET state = '{OUTBOX_FAILED}', claim_token = NULL, last_error = ?
+                WHERE id = ? AND claim_token = ?
+                """,
+                (str(error)[:255], outbox_id, claim_token),
+            ))
+            return
+        retry_at = _ts(datetime.now() + timedelta(seconds=int(retry_in)))
+        self._write(lambda conn: conn.execute(
+            f"""
+            UPDATE "{self.t.outbox}"
+            SET state = '{OUTBOX_PENDING}', claim_token = NULL, last_error = ?, next_attempt_at = ?
+            WHERE id = ? AND claim_token = ?
+            """,
+            (str(error)[:255], retry_at, outbox_id, claim_token),
+        ))
+
+    def prune_outbox(self, days=14):
+        cutoff = _ts(datetime.now() - timedelta(days=int(days)))
+        return self._write(lambda conn: conn.execute(
+            f"""
+            DELETE FROM "{self.t.outbox}"
+            WHERE state IN ('{OUTBOX_SENT}', '{OUTBOX_FAILED}') AND created_at < ?
+            """,
+            (cutoff,),
+        ).rowcount)
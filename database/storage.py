@@ -0,0 +1,221 @@
+# storage.py
+"""
+儲存後端介面。database/db.py 的模組函式都透過這裡選出的後端存取資料：
+
+- mysql：PyMySQL + 連線池（RDS，預設）
+- sqlite：本機 SQLite 檔案（WAL 模式），單一群組不需要網路往返
+- memory：純記憶體，測試與基準測試用，行程結束即消失
+
+以 DB_BACKEND 環境變數選擇。
+
+多群組時每個群組有自己的一組資料表（前綴為該群組的 DB_TABLE），
+各群組的後端共用同一個連線池（見 get_store）。
+"""
+import abc
+import threading
+from config import config
+from utils.tenants import TenantLocal
+
+
+class Tables:
+    """一個群組的資料表名稱"""
+
+    def __init__(self, prefix):
+        self.reply = prefix                         # 每場次每人一列：(session_date, user_id) 唯一
+        self.member = f"{prefix}_member"            # 回覆過的所有人（「未回應」名單的母體）
+        self.dedup = f"{prefix}_event_dedup"
+        self.job_claim = f"{prefix}_job_claim"      # 排程每次觸發（與分片）的執行權
+        self.schema = f"{prefix}_schema"            # 資料表結構版本標記（啟動時只讀這一列）
+        self.outbox = f"{prefix}_outbox"            # 待推播的通知（每位收件人一列，idempotency_key 唯一）
+        self.migration_lock = f"{prefix}_migrations"
+
+
+TABLES = Tables(config.DB_TABLE)
+
+# 目前程式需要的資料表結構版本；結構有變動（新增表、欄位、索引）時遞增，並在 migrations 加上對應步驟
+SCHEMA_VERSION = 3
+
+# outbox 的狀態
+OUTBOX_PENDING = "pending"
+OUTBOX_INFLIGHT = "inflight"
+OUTBOX_SENT = "sent"
+OUTBOX_FAILED = "failed"
+
+# claim_job_fire 的回傳值
+JOB_CLAIMED = "claimed"   # 取得執行權（新的 claim，或接手租約已過期的 claim）
+JOB_BUSY = "busy"         # 其他 worker 正在執行（租約未到期）
+JOB_DONE = "done"         # 已執行完成
+
+# record_reply 的回傳值
+REPLY_INSERTED = "inserted"
+REPLY_UPDATED = "updated"
+REPLY_RENAMED = "renamed"      # 回覆內容相同，只有名字（LINE 顯示名稱）改變
+REPLY_UNCHANGED = "unchanged"
+
+
+class ReplyStore(abc.ABC):
+    """所有後端共同的介面；session 一律由呼叫端（database/db.py）決定"""
+
+    name = ""
+
+    def __init__(self, tables=None):
+        self.t = tables or TABLES
+
+    @abc.abstractmethod
+    def scoped(self, tables):
+        """同一個後端（共用連線）、另一組資料表；多群組時每個群組一個"""
+
+    @abc.abstractmethod
+    def init_db(self):
+        ...
+
+    @abc.abstractmethod
+    def record_reply(self, session, user_id, user_name, reply_text):
+        """新增或更新本場次的回覆並登記成員；回傳 REPLY_INSERTED / REPLY_UPDATED / REPLY_RENAMED / REPLY_UNCHANGED"""
+
+    def record_replies(self, rows):
+        """
+        批次寫入 [(session, user_id, user_name, reply_text), ...]（write-behind flush 使用），
+        同一筆交易內完成；(session, user_id) 在 rows 中不重複。預設逐筆呼叫 record_reply。
+        """
+        for session, user_id, user_name, reply_text in rows:
+            self.record_reply(session, user_id, user_name, reply_text)
+
+    @abc.abstractmethod
+    def has_replied(self, session, user_id):
+        ...
+
+    @abc.abstractmethod
+    def get_replied_user_ids(self, session, user_ids):
+        ...
+
+    @abc.abstractmethod
+    def get_reply(self, session, user_id):
+        """本場次此人的 (user_name, reply_text)，沒有時回傳 None；一律查 primary（read-your-writes 確認用）"""
+
+    @abc.abstractmethod
+    def update_reply(self, session, user_id, reply_text):
+        """只更新既有的回覆且內容不同時才寫入；回傳是否有變更"""
+
+    @abc.abstractmethod
+    def load_attendance_rows(self, session):
+        """回傳所有成員在該場次的 [(user_id, user_name, reply_text)]，未回覆者 reply_text 為空字串"""
+
+    @abc.abstractmethod
+    def prune_sessions(self, cutoff, batch_size=1000):
+        """刪除 session_date < cutoff 的回覆，回傳筆數"""
+
+    @abc.abstractmethod
+    def claim_webhook_event(self, event_id, ttl):
+        ...
+
+    @abc.abstractmethod
+    def claim_job_fire(self, job_id, fire_time, shard, owner, lease_seconds):
+        """
+        取得某次觸發（某個分片）的執行權，租約 lease_seconds 秒。
+        回傳 JOB_CLAIMED / JOB_BUSY / JOB_DONE；租約過期且尚未完成的 claim 可被接手。
+        """
+
+    @abc.abstractmethod
+    def finish_job_fire(self, job_id, fire_time, shard, owner, retry_in=None):
+        """
+        retry_in 為 None：標記已完成。
+        否則放棄執行權（僅限 owner 本人），retry_in 秒後可再被 claim。
+        """
+
+    @abc.abstractmethod
+    def prune_job_claims(self, days=14):
+        ...
+
+    @abc.abstractmethod
+    def enqueue_outbox(self, rows):
+        """
+        新增待推播的通知 [(idempotency_key, kind, user_id, message), ...]；
+        idempotency_key 已存在的列略過。回傳實際新增的筆數。
+        """
+
+    @abc.abstractmethod
+    def claim_outbox(self, owner, limit, lease_seconds):
+        """
+        取得最多 limit 筆可送出的通知並標記為 inflight：pending 且已到重試時間，
+        或 inflight 超過 lease_seconds（送出者中途當掉）。
+        回傳 (claim_token, [(id, idempotency_key, kind, user_id, message, attempts)])，attempts 已含本次。
+        """
+
+    @abc.abstractmethod
+    def mark_outbox_sent(self, ids, claim_token):
+        """
+        標記為已送出。只更新仍屬於 claim_token 的列：租約過期後被其他 worker 重新 claim 的列，
+        原本（逾時）的 worker 不能再改動。
+        """
+
+    @abc.abstractmethod
+    def mark_outbox_failed(self, outbox_id, claim_token, error, retry_in=None):
+        """
+        送出失敗：retry_in 秒後重試（回到 pending）；retry_in 為 None 時標記為 failed 不再重試。
+        與 mark_outbox_sent 相同，只更新仍屬於 claim_token 的列。
+        """
+
+    @abc.abstractmethod
+    def prune_outbox(self, days=14):
+        """刪除早於 days 天、已 sent / failed 的列，回傳筆數"""
+
+    @abc.abstractmethod
+    def get_schema_version(self) -> int:
+        """已套用的結構版本；尚未建立標記時回傳 0"""
+
+    @abc.abstractmethod
+    def set_schema_version(self, version):
+        ...
+
+    def stats(self) -> dict:
+        """連線池等狀態（供監控使用）；沒有時回傳空 dict"""
+        return {}
+
+
+_root = None
+_root_lock = threading.Lock()
+
+
+def create_store(backend=None, tables=None) -> ReplyStore:
+    backend = (backend or config.DB_BACKEND).lower()
+    if backend == "mysql":
+        from database.mysql_store import MySQLStore
+        return MySQLStore(tables)
+    if backend == "sqlite":
+        from database.sqlite_store import SQLiteStore
+        return SQLiteStore(config.SQLITE_PATH, tables)
+    if backend == "memory":
+        from database.memory_store import MemoryStore
+        return MemoryStore(tables)
+    raise ValueError(f"未知的 DB_BACKEND: {backend}")
+
+
+def root_store() -> ReplyStore:
+    """持有連線池的後端（預設資料表）；各群組的後端由它 scoped() 而來"""
+    global _root
+    if _root is None:
+        with _root_lock:
+            if _root is None:
+                _root = create_store()
+    return _root
+
+
+def _create_tenant_store(tenant):
+    root = root_store()
+    if tenant.DB_TABLE == root.t.reply:
+        return root
+    return root.scoped(Tables(tenant.DB_TABLE))
+
+
+_stores = TenantLocal(_create_tenant_store)
+
+
+def get_store() -> ReplyStore:
+    """取得目前群組的後端（第一次使用才建立）"""
+    return _stores.instance()
+
+
+def set_store(store):
+    """替換目前群組的後端（基準測試或工具程式使用）"""
+    _stores.set(store)
@@ -0,0 +1,50 @@
+# gunicorn.conf.py
+"""
+Gunicorn 設定（gunicorn -c gunicorn.conf.py app:app）。
+
+預設與直接執行 gunicorn 相同：1 個 worker、不 preload（gunicorn 會自動讀取工作目錄下的本檔，
+既有部署不會因此改變行為）。
+
+preload_app（GUNICORN_PRELOAD=true）：master 只匯入一次 app（import、結構版本檢查、載入出席快照），
+worker 直接 fork，重啟時不必每個 worker 重做一遍。
+排程器等執行緒不會跟著 fork，由 post_fork 在各 worker 啟動。
+
+RUN_SCHEDULER=true 時每個 worker 都會啟動排程器：多個 worker 必須設定 SCHEDULER_COORDINATION=db，
+否則每次提醒會送出多次，on_starting 直接拒絕啟動。
+"""
+import os
+import sys
+import time
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('FLASK_PORT', '5003')}")
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "15"))
+preload_app = os.getenv("GUNICORN_PRELOAD", "false").lower() == "true"
+
+if preload_app:
+    # app.py 看到這個變數就不在匯入時啟動背景執行緒
+    os.environ["APP_PRELOADED"] = "true"
+
+
+def on_starting(server):
+    # server.cfg.workers 已套用命令列的 -w / --workers
+    coordinated = os.getenv("SCHEDULER_COORDINATION", "none").lower() in ("db", "mysql")
+    if server.cfg.workers > 1 and os.getenv("RUN_SCHEDULER") == "true" and not coordinated:
+        sys.exit(
+            f"RUN_SCHEDULER=true 搭配 {server.cfg.workers} 個 worker 時每個 worker 都會執行排程，"
+            "請設定 SCHEDULER_COORDINATION=db，或改為單一 worker"
+        )
+
+
+def post_fork(server, worker):
+    worker.boot_started = time.perf_counter()
+    if preload_app:
+        import app
+        app.start_worker_services()
+
+
+def post_worker_init(worker):
+    from utils import startup
+    startup.worker_ready(time.perf_counter() - worker.boot_started)
@@ -1,19 +1,307 @@
+import os
+import time
+import uuid
+import random
+import asyncio
+import threading
 from linebot.v3.messaging import MessagingApi, Configuration, ApiClient
-from linebot.v3.messaging.models import TextMessage, PushMessageRequest
+from linebot.v3.messaging.exceptions import ApiException
+from linebot.v3.messaging.models import TextMessage, PushMessageRequest, MulticastRequest
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
 from config import config
+from utils import metrics
+from utils.log import get_logger
+from utils.tenants import current
 
-# 使用配置管理系統
-configuration = Configuration(access_token=config.LINE_CHANNEL_ACCESS_TOKEN)
-api_client = ApiClient(configuration=configuration)
-line_bot_api = MessagingApi(api_client)
+logger = get_logger(__name__)
+
+# LINE multicast 單次請求的收件人上限
+MULTICAST_MAX_RECIPIENTS = 500
+
+
+class TokenBucket:
+    """簡單的 token bucket：每秒補 rate 個，最多累積 burst 個"""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self):
+        """取得一個 token 回傳 0，否則回傳需要等待的秒數"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        if self.rate <= 0:
+            return
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+class LineClient:
+    """
+    全行程共用的 LINE Messaging API 客戶端（reply / push / multicast 都走這裡）。
+
+    - 共用一個 ApiClient（urllib3 keep-alive 連線池），第一次使用才建立；fork 後在子行程重建
+    - token bucket 限速，避免超過 LINE 的每秒請求上限
+    - 429 / 5xx / 連線錯誤以 jittered exponential backoff 重試
+    - push / multicast 帶 X-Line-Retry-Key，重試不會重複送出
+    - 多群組時依目前群組的 channel access token 送出（連線池與限速各群組共用）
+    """
+
+    def __init__(self):
+        self._api = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._bucket = TokenBucket(config.LINE_API_RATE, config.LINE_API_BURST)
+        self.max_retries = config.LINE_API_MAX_RETRIES
+        self.backoff_base = config.LINE_API_BACKOFF_BASE
+        self.backoff_max = config.LINE_API_BACKOFF_MAX
+
+    @property
+    def api(self) -> MessagingApi:
+        if self._api is None or self._pid != os.getpid():
+            with self._lock:
+                if self._api is None or self._pid != os.getpid():
+                    # Gunicorn preload_app：master 若已建立連線池，worker 不沿用（socket 不能跨行程共用）
+                    self._api = MessagingApi(ApiClient(configuration=self._configuration()))
+                    self._pid = os.getpid()
+        return self._api
+
+    @staticmethod
+    def _configuration():
+        # LINE_API_HOST 指向本地 stub（tools/line_api_stub.py）做測試；host 只能在建構時指定
+        configuration = Configuration(access_token=config.LINE_CHANNEL_ACCESS_TOKEN, host=config.LINE_API_HOST or None)
+        configuration.connection_pool_maxsize = config.LINE_HTTP_POOL_SIZE
+        return configuration
+
+    # ---------- 對外介面（與 MessagingApi 相同簽名） ----------
+
+    def reply_message(self, reply_message_request):
+        # reply token 只能用一次、且沒有 retry key：只在確定未被受理的 429 時重試
+        return self._call("reply", self.api.reply_message, reply_message_request, retry_5xx=False)
+
+    def push_message(self, push_message_request, retry_key=None):
+        return self._call("push", self.api.push_message, push_message_request,
+                          retry_key=retry_key or str(uuid.uuid4()))
+
+    def multicast(self, multicast_request, retry_key=None):
+        return self._call("multicast", self.api.multicast, multicast_request,
+                          retry_key=retry_key or str(uuid.uuid4()))
+
+    # ---------- 內部 ----------
+
+    @staticmethod
+    def _call_kwargs(retry_key):
+        kwargs = {}
+        if retry_key is not None:
+            kwargs["x_line_retry_key"] = retry_key
+        tenant = current()
+        if not tenant.legacy:
+            # Configuration 只有一組 token；其他群組逐次覆寫 Authorization header
+            kwargs["_request_auth"] = {"in": "header", "type": "bearer", "key": "Authorization",
+                                       "value": f"Bearer {tenant.LINE_CHANNEL_ACCESS_TOKEN}"}
+        return kwargs
+
+    def _call(self, endpoint, func, request, retry_key=None, retry_5xx=True):
+        attempt = 0
+        while True:
+            self._bucket.acquire()
+            start = time.perf_counter()
+            try:
+                result = func(request, **self._call_kwargs(retry_key))
+                self._observe(endpoint, 200, start)
+                return result
+            except ApiException as e:
+                status = e.status or 0
+                self._observe(endpoint, status, start)
+                if status == 409 and retry_key is not None:
+                    # 相同 retry key 已被受理過：前一次其實成功了
+                    logger.info("[LINE %s] retry key 已受理，視為成功", endpoint)
+                    return None
+                retryable = status == 429 or (retry_5xx and status >= 500)
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                delay = self._retry_after(e) or self._backoff(attempt)
+                logger.warning("[LINE %s] HTTP %s，%.2f 秒後重試（第 %d 次）", endpoint, status, delay, attempt + 1)
+            except Urllib3HTTPError as e:
+                self._observe(endpoint, "error", start)
+                if not retry_5xx or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning("[LINE %s] 連線錯誤 %s，%.2f 秒後重試（第 %d 次）", endpoint, e, delay, attempt + 1)
+            attempt += 1
+            time.sleep(delay)
+
+    @staticmethod
+    def _observe(endpoint, status, start):
+        elapsed = time.perf_counter() - start
+        metrics.LINE_API_SECONDS.labels(endpoint).observe(elapsed)
+        metrics.record_timing(f"line_{endpoint}", elapsed)
+        metrics.LINE_API_REQUESTS.labels(endpoint, status).inc()
+
+    def _backoff(self, attempt):
+        # full jitter：0 ~ min(max, base * 2^attempt)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    @staticmethod
+    def _retry_after(exc):
+        headers = getattr(exc, "headers", None) or {}
+        value = headers.get("Retry-After") if hasattr(headers, "get") else None
+        try:
+            return float(value) if value else None
+        except ValueError:
+            return None
+
+
+class AsyncLineClient(LineClient):
+    """
+    ASGI 模式用的 LINE 客戶端：AsyncMessagingApi（aiohttp），限速、重試與指標和 LineClient 相同。
+    須在事件迴圈中建立與使用；關閉時 await close()。
+    """
+
+    @property
+    def api(self):
+        if self._api is None:
+            from linebot.v3.messaging import AsyncApiClient, AsyncMessagingApi
+            self._api = AsyncMessagingApi(AsyncApiClient(configuration=self._configuration()))
+        return self._api
+
+    async def close(self):
+        if self._api is not None:
+            await self._api.api_client.close()
+            self._api = None
+
+    async def reply_message(self, reply_message_request):
+        return await self._call("reply", self.api.reply_message, reply_message_request, retry_5xx=False)
+
+    async def push_message(self, push_message_request, retry_key=None):
+        return await self._call("push", self.api.push_message, push_message_request,
+                                retry_key=retry_key or str(uuid.uuid4()))
+
+    async def multicast(self, multicast_request, retry_key=None):
+        return await self._call("multicast", self.api.multicast, multicast_request,
+                                retry_key=retry_key or str(uuid.uuid4()))
+
+    async def _call(self, endpoint, func, request, retry_key=None, retry_5xx=True):
+        import aiohttp
+        attempt = 0
+        while True:
+            await self._bucket.acquire_async()
+            start = time.perf_counter()
+            try:
+                result = await func(request, **self._call_kwargs(retry_key))
+                self._observe(endpoint, 200, start)
+                return result
+            except ApiException as e:
+                status = e.status or 0
+                self._observe(endpoint, status, start)
+                if status == 409 and retry_key is not None:
+                    logger.info("[LINE %s] retry key 已受理，視為成功", endpoint)
+                    return None
+                retryable = status == 429 or (retry_5xx and status >= 500)
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                delay = self._retry_after(e) or self._backoff(attempt)
+                logger.warning("[LINE %s] HTTP %s，%.2f 秒後重試（第 %d 次）", endpoint, status, delay, attempt + 1)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self._observe(endpoint, "error", start)
+                if not retry_5xx or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning("[LINE %s] 連線錯誤 %s，%.2f 秒後重試（第 %d 次）", endpoint, e, delay, attempt + 1)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+
+# 全域共用實例
+line_client = LineClient()
 
 def push_message_to_user(user_id, message):
     try:
-        line_bot_api.push_message(
+        line_client.push_message(
             PushMessageRequest(
                 to=user_id,
                 messages=[TextMessage(text=message)]
             )
         )
+        return True
     except Exception as e:
-        print("[Push to user error]", e)
+        logger.error("[Push to user error] %s: %s", user_id, e)
+        return False
+
+def multicast_message(user_ids, message):
+    """
+    以 multicast 一次送給多位使用者（每批最多 500 人）。
+    回傳每一批的結果：[{"batch": i, "recipients": n, "ok": bool, "error": str|None}]
+    """
+    user_ids = list(dict.fromkeys(user_ids))  # 去重、保留順序
+    results = []
+    for i in range(0, len(user_ids), MULTICAST_MAX_RECIPIENTS):
+        batch = user_ids[i:i + MULTICAST_MAX_RECIPIENTS]
+        result = {"batch": i // MULTICAST_MAX_RECIPIENTS, "recipients": len(batch), "ok": True, "error": None}
+        try:
+            line_client.multicast(
+                MulticastRequest(
+                    to=batch,
+                    messages=[TextMessage(text=message)]
+                )
+            )
+        except Exception as e:
+            result["ok"] = False
+            result["error"] = str(e)
+            logger.error("[Multicast error] %s", e)
+        results.append(result)
+    return results
+
+async def push_message_to_user_async(client, user_id, message):
+    """push_message_to_user 的非同步版本（client 為 AsyncLineClient）"""
+    try:
+        await client.push_message(
+            PushMessageRequest(
+                to=user_id,
+                messages=[TextMessage(text=message)]
+            )
+        )
+        return True
+    except Exception as e:
+        logger.error("[Push to user error] %s: %s", user_id, e)
+        return False
+
+async def multicast_message_async(client, user_ids, message):
+    """multicast_message 的非同步版本：各批同時送出，回傳格式相同"""
+    user_ids = list(dict.fromkeys(user_ids))
+    batches = [user_ids[i:i + MULTICAST_MAX_RECIPIENTS] for i in range(0, len(user_ids), MULTICAST_MAX_RECIPIENTS)]
+
+    async def send(index, batch):
+        result = {"batch": index, "recipients": len(batch), "ok": True, "error": None}
+        try:
+            await client.multicast(MulticastRequest(to=batch, messages=[TextMessage(text=message)]))
+        except Exception as e:
+            result["ok"] = False
+            result["error"] = str(e)
+            logger.error("[Multicast error] %s", e)
+        return result
+
+    return list(await asyncio.gather(*(send(i, b) for i, b in enumerate(batches))))
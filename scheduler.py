@@ -1,25 +1,28 @@
 # scheduler_setup.py  （你的原檔名照舊也可以）
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.events import (
+    EVENT_JOB_SUBMITTED, EVENT_JOB_EXECUTED, EVENT_JOB_ERROR, EVENT_JOB_MISSED,
+)
 from zoneinfo import ZoneInfo
 from datetime import datetime
-import logging
+import threading
+import time
 
 from services.notification_service import (
     load_user_config,
-    send_ask_notification,
-    send_summary_notification,
+    send_ask_notification_batch,
+    send_summary_notification_batch,
     reset_replies_with_log,
 )
 from config import config
+from utils.roster import roster
+from services import job_claims
+from utils import metrics, profiler
+from utils.log import get_logger
+from utils.tenants import tenants, current, use, each, TenantLocal
 
 # ✅ logger
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-if not logger.handlers:
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter('[%(asctime)s] [%(levelname)s] %(message)s', '%Y-%m-%d %H:%M:%S')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+logger = get_logger(__name__)
 
 # ✅ 建立排程器（帶時區）
 scheduler = BackgroundScheduler(timezone=config.TIMEZONE)
@@ -27,6 +30,47 @@ scheduler = BackgroundScheduler(timezone=config.TIMEZONE)
 # 防止重複啟動的標記
 _scheduler_started = False
 
+# 時段表：(day, hour, minute, type) -> [user_id]；到點時才依目前名單展開（每個群組一份）
+_slot_users = TenantLocal(lambda tenant: {})
+_slot_lock = threading.Lock()
+# 群組 ID -> 已套用的名單 version
+_applied_roster_versions = {}
+
+# slot 任務實際執行的函式；ASGI 模式由 use_asyncio() 換成 coroutine
+_slot_runner = None
+
+# ✅ 任務執行時間與延遲（送出時間 - 預定時間）
+_job_started = {}
+
+def _job_label(job_id):
+    # 多群組時去掉群組前綴（同一種任務合併成一個標籤）
+    return job_id.rpartition(":")[2]
+
+def job_tenant(tenant_id):
+    """任務所屬的群組（任務以 kwargs 帶 tenant_id）"""
+    return tenants.get(tenant_id) if tenant_id else tenants.default
+
+def _on_job_event(event):
+    label = _job_label(event.job_id)
+    if event.code == EVENT_JOB_SUBMITTED:
+        now = datetime.now(ZoneInfo(config.TIMEZONE))
+        for run_time in event.scheduled_run_times:
+            metrics.JOB_LAG_SECONDS.labels(label).observe(max(0.0, (now - run_time).total_seconds()))
+        _job_started[event.job_id] = time.perf_counter()
+        return
+    if event.code == EVENT_JOB_MISSED:
+        metrics.JOB_RUNS.labels(label, "missed").inc()
+        return
+    start = _job_started.pop(event.job_id, None)
+    if start is not None:
+        metrics.JOB_SECONDS.labels(label).observe(time.perf_counter() - start)
+    metrics.JOB_RUNS.labels(label, "error" if event.code == EVENT_JOB_ERROR else "ok").inc()
+
+scheduler.add_listener(
+    _on_job_event,
+    EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED,
+)
+
 def _cron_day(d: str) -> str:
     """把 full name 轉 APScheduler 縮寫 (tuesday -> tue)"""
     d = (d or "").strip().lower()
@@ -36,42 +80,155 @@ def _cron_day(d: str) -> str:
     }
     return mapping.get(d, d[:3])
 
-def schedule_from_config():
-    """依 users 的 notification_times 直接建立 cron 任務"""
-    cfg = load_user_config()
-    tz = ZoneInfo(config.TIMEZONE)
-
-    # 先移除舊的 user-* 任務（避免重複）
-    for job in list(scheduler.get_jobs()):
-        if job.id and job.id.startswith("user-"):
-            scheduler.remove_job(job.id)
-            logger.info("移除舊任務: %s", job.id)
-
+def _iter_user_slots(cfg):
+    """逐一產生 (user, index, day, hour, minute, type)"""
     for user in cfg.get("users", []):
-        uid = user["user_id"]
-        uname = user.get("name", uid)
-
         for i, nt in enumerate(user.get("notification_times", [])):
             day  = _cron_day(nt["day"])
             hour = int(nt["hour"])
             minute = int(nt["minute"])
             typ  = nt.get("type", "ask").lower()
+            yield user, i, day, hour, minute, typ
 
-            func = send_summary_notification if typ == "summary" else send_ask_notification
-            job_id = f"user-{uid}-{i}-{typ}"
+def schedule_from_config():
+    """依目前群組 users 的 notification_times 建立 cron 任務（每個時段一個，見 schedule_slots_from_config）"""
+    schedule_slots_from_config()
 
-            scheduler.add_job(
-                func=func,
-                trigger="cron",
-                day_of_week=day,
-                hour=hour,
-                minute=minute,
-                args=[user],                  # 把 user 當參數傳進通知函式
-                id=job_id,
-                replace_existing=True,
-                timezone=tz
-            )
-            logger.info("已排程 → %s：%s %02d:%02d (%s)", uname, day, hour, minute, typ)
+def _build_slot_table(cfg):
+    """依名單算出每個時段要通知的使用者（同一時段同一人只算一次）"""
+    slots = {}
+    for user, _, day, hour, minute, typ in _iter_user_slots(cfg):
+        slots.setdefault((day, hour, minute, typ), {})[user["user_id"]] = None
+    return {slot: list(uids) for slot, uids in slots.items()}
+
+def _slot_job_id(slot, tenant=None):
+    day, hour, minute, typ = slot
+    return f"{(tenant or current()).key_prefix}slot-{day}-{hour:02d}{minute:02d}-{typ}"
+
+def slot_recipients(day, hour, minute, typ):
+    """依目前群組「目前」的名單展開某時段的收件人"""
+    with _slot_lock:
+        user_ids = sorted(_slot_users.instance().get((day, hour, minute, typ), []))
+    users = [u for u in (roster.get_user(uid) for uid in user_ids) if u is not None]
+    if not users:
+        logger.info("時段 %s %02d:%02d (%s) 沒有收件人，略過", day, hour, minute, typ)
+    return users
+
+def scheduled_fire_time(job_id):
+    """任務本次的預定觸發時間（所有 worker 相同），作為 claim 與 outbox 的 key"""
+    job = scheduler.get_job(job_id)
+    return job_claims.last_fire_time(job.trigger if job else None)
+
+def run_slot(day, hour, minute, typ, tenant_id=None):
+    """
+    slot 任務：到點時依「目前」的名單展開收件人，名單異動不必重建任務。
+    整個時段只查一次已回覆名單，再依 NOTIFY_MULTICAST 合併成 multicast 或逐一 push。
+    """
+    tenant = job_tenant(tenant_id)
+    job_id = _slot_job_id((day, hour, minute, typ), tenant)
+    with use(tenant), profiler.trace("job", job_id):
+        users = slot_recipients(day, hour, minute, typ)
+        if not users:
+            return
+
+        # 多 worker 時：收件人切成分片，各 worker 一次 claim 一個分片
+        send = send_summary_notification_batch if typ == "summary" else send_ask_notification_batch
+        when = scheduled_fire_time(job_id)
+        # fire 讓 outbox 的 idempotency key 以預定時間為準
+        job_claims.run_shards(job_id, users, when, lambda shard: send(shard, fire=when))
+
+def run_weekly_reset(tenant_id=None):
+    # 執行權記錄在各群組自己的資料表，任務名稱不必加前綴
+    tenant = job_tenant(tenant_id)
+    with use(tenant):
+        when = scheduled_fire_time(f"{tenant.key_prefix}weekly-reset")
+        job_claims.run_once("weekly-reset", when, reset_replies_with_log)
+
+def schedule_slots_from_config():
+    """同一 (星期, 時, 分, 類型) 只建立一個任務；任務數量隨不同時段數成長，而不是名單人數"""
+    tenant = current()
+    tz = ZoneInfo(config.TIMEZONE)
+    version = roster.version
+    new_slots = _build_slot_table(load_user_config())
+
+    with _slot_lock:
+        slot_users = _slot_users.instance()
+        old_keys = set(slot_users)
+        slot_users.clear()
+        slot_users.update(new_slots)
+        _applied_roster_versions[tenant.id] = version
+
+    removed = old_keys - set(new_slots)
+    added = set(new_slots) - old_keys
+    for slot in removed:
+        if scheduler.get_job(_slot_job_id(slot)):
+            scheduler.remove_job(_slot_job_id(slot))
+        logger.info("移除時段: %s", _slot_job_id(slot))
+
+    for slot in new_slots:
+        # 既有時段的任務不動（收件人在觸發時才查）；只補上新時段或遺失的任務
+        if slot not in added and scheduler.get_job(_slot_job_id(slot)):
+            continue
+        day, hour, minute, typ = slot
+        scheduler.add_job(
+            func=_slot_runner or run_slot,
+            trigger="cron",
+            day_of_week=day,
+            hour=hour,
+            minute=minute,
+            args=list(slot),
+            kwargs={"tenant_id": tenant.id},
+            id=_slot_job_id(slot),
+            replace_existing=True,
+            timezone=tz
+        )
+        logger.info("已排程 → %s %02d:%02d (%s)：%d 人", day, hour, minute, typ, len(new_slots[slot]))
+
+    logger.info("時段表已更新（名單 version %s）：%d 個時段，新增 %d、移除 %d",
+                version, len(new_slots), len(added), len(removed))
+
+def reload_roster_if_changed():
+    """定期檢查各群組的 users_config.json；有變動就更新排程，不需要重啟服務"""
+    for tenant in each():
+        try:
+            roster.refresh()
+            if roster.version == _applied_roster_versions.get(tenant.id):
+                continue
+            logger.info("偵測到使用者名單變動，重新套用排程")
+            schedule_from_config()
+        except Exception as e:
+            logger.error("重新載入名單時發生錯誤: %s", e)
+
+def _schedule_weekly_reset():
+    """每週換場次（清除過期紀錄），時間依目前群組的 RESET_REPLIES_DAY / RESET_REPLIES_TIME"""
+    tenant = current()
+    reset_hour, reset_minute = (int(x) for x in tenant.RESET_REPLIES_TIME.split(":"))
+    scheduler.add_job(
+        run_weekly_reset,
+        'cron',
+        day_of_week=tenant.RESET_REPLIES_DAY,
+        hour=reset_hour,
+        minute=reset_minute,
+        kwargs={"tenant_id": tenant.id},
+        id=f"{tenant.key_prefix}weekly-reset",
+        replace_existing=True
+    )
+
+def use_asyncio(slot_runner):
+    """
+    ASGI 模式：改用 AsyncIOScheduler，slot 任務改由 coroutine slot_runner 執行。
+    須在事件迴圈中、start_scheduler() 之前呼叫；其餘（同步）任務由執行緒池執行。
+    """
+    global scheduler, _slot_runner
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    if scheduler.running:
+        raise RuntimeError("排程器已啟動，無法切換為 AsyncIOScheduler")
+    scheduler = AsyncIOScheduler(timezone=config.TIMEZONE)
+    scheduler.add_listener(
+        _on_job_event,
+        EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED,
+    )
+    _slot_runner = slot_runner
 
 def start_scheduler():
     global _scheduler_started
@@ -87,19 +244,20 @@ def start_scheduler():
         return
     
     try:
-        # ✅ 用 cron 固定時間觸發，不再每分鐘輪詢
-        schedule_from_config()
+        # ✅ 用 cron 固定時間觸發，不再每分鐘輪詢；每個群組各自的通知與換場次任務
+        for _ in each():
+            schedule_from_config()
+            _schedule_weekly_reset()
 
-        # 保留每週重置任務
-        scheduler.add_job(
-            reset_replies_with_log,
-            'cron',
-            day_of_week=config.RESET_REPLIES_DAY,
-            hour=21,
-            minute=0,
-            id="weekly-reset",
-            replace_existing=True
-        )
+        # 名單熱更新：檔案變動時只增減有變化的時段
+        if config.ROSTER_RELOAD_INTERVAL > 0:
+            scheduler.add_job(
+                reload_roster_if_changed,
+                'interval',
+                seconds=config.ROSTER_RELOAD_INTERVAL,
+                id="roster-reload",
+                replace_existing=True
+            )
 
         scheduler.start()
         _scheduler_started = True
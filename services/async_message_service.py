@@ -0,0 +1,99 @@
+# async_message_service.py
+"""
+MessageService 的 asyncio 版本（ASGI 模式）。
+
+指令判斷、訊息內容與同步版完全相同（繼承 MessageService）；
+只把 DB 與 LINE API 的呼叫改成 await，等待 I/O 時不佔用執行緒。
+"""
+import logging
+from linebot.v3.messaging import ReplyMessageRequest, TextMessage
+from database import async_db
+from database.db import get_name_from_config
+from services.message_service import MessageService
+from services.message_renderer import renderer
+from services.command_router import CMD_STATS, CMD_REPLY, CMD_NOTIFY, CMD_HELP, CMD_MAP
+from services import async_notification_service
+from utils import profiler
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncMessageService(MessageService):
+    """line_bot_api 為 AsyncLineClient"""
+
+    async def handle_message(self, event):
+        try:
+            route = self.router.route(event.message.text)
+            if route is None:
+                return
+            command, keyword = route
+
+            user_id = event.source.user_id
+
+            if command == CMD_STATS:
+                logger.info("[MessageEvent] 使用者 %s 輸入：%s", user_id, keyword)
+                await self._handle_stats_request(event)
+                return
+
+            if command == CMD_HELP:
+                await self._reply(event, renderer.help_text())
+                return
+
+            if command == CMD_MAP:
+                await self._handle_map_request(event)
+                return
+
+            with profiler.stage("get_name_from_config"):
+                user_name = get_name_from_config(user_id)
+            logger.info("[MessageEvent] 使用者 %s（%s）輸入：%s", user_id, user_name, keyword)
+
+            if command == CMD_REPLY:
+                await self._handle_reply(event, user_id, user_name, keyword)
+                return
+
+            if command == CMD_NOTIFY:
+                await self._handle_notify_request(event, user_id, user_name)
+                return
+
+        except Exception as e:
+            logger.error("[Unhandled error in handle_message] %s", e)
+
+    async def _handle_stats_request(self, event):
+        attendance = await async_db.get_attendance(event.source.user_id)
+        with profiler.stage("render_stats"):
+            text = renderer.attendance_text(attendance)
+        await self._reply(event, text)
+
+    async def _handle_reply(self, event, user_id, user_name, reply_text):
+        try:
+            result = await async_db.record_reply(user_id, user_name, reply_text)
+            self._log_reply_result(result, user_name, reply_text)
+        except Exception as e:
+            logger.error("[資料庫錯誤] %s", e)
+
+    async def _handle_notify_request(self, event, user_id, user_name):
+        user = {
+            "user_id": user_id,
+            "name": user_name
+        }
+        await async_notification_service.send_ask_notification(self.line_bot_api, user)
+        await self._reply(event, "已發送提醒通知！")
+
+    async def _handle_map_request(self, event):
+        await self.line_bot_api.reply_message(
+            ReplyMessageRequest(
+                reply_token=event.reply_token,
+                messages=[renderer.map_message()]
+            )
+        )
+
+    async def _reply(self, event, text):
+        try:
+            await self.line_bot_api.reply_message(
+                ReplyMessageRequest(
+                    reply_token=event.reply_token,
+                    messages=[TextMessage(text=text)]
+                )
+            )
+        except Exception as e:
+            logger.error("[Reply error] %s", e)
@@ -0,0 +1,69 @@
+# async_notification_service.py
+"""notification_service 的非同步版本（ASGI 模式的排程與「通知」指令使用）；訊息內容與同步版相同"""
+import asyncio
+import logging
+from config import config
+from database import async_db
+from line_service import push_message_to_user_async, multicast_message_async
+from services.notification_service import _build_ask_message, _log_batches, _enqueue
+from services.message_renderer import renderer
+
+logger = logging.getLogger(__name__)
+
+
+async def send_ask_notification(client, user):
+    """發送詢問通知（已回覆者略過）"""
+    if await async_db.has_replied(user["user_id"]):
+        logger.info("%s 已回覆，不發送詢問通知", user["name"])
+        return
+
+    if config.NOTIFY_OUTBOX:
+        await asyncio.to_thread(_enqueue, "ask", [user], _build_ask_message(), None)
+        return
+    await push_message_to_user_async(client, user["user_id"], _build_ask_message())
+    logger.info("已向 %s 發送詢問通知", user["name"])
+
+
+async def _deliver(client, kind, users, message, fire):
+    """同一時段的收件人：排入 outbox、合併成 multicast，或逐一 push（同時送出）。回傳 multicast 每批結果。"""
+    if config.NOTIFY_OUTBOX:
+        return await asyncio.to_thread(_enqueue, kind, users, message, fire)
+    if config.NOTIFY_MULTICAST:
+        results = await multicast_message_async(client, [u["user_id"] for u in users], message)
+        _log_batches(kind, results)
+        return results
+    sent = await asyncio.gather(*(push_message_to_user_async(client, u["user_id"], message) for u in users))
+    failed = sent.count(False)
+    if failed:
+        logger.error("[%s] push 失敗 %d / %d 人", kind, failed, len(users))
+    return []
+
+
+async def send_ask_notification_batch(client, users, fire=None):
+    """同一時段的詢問通知：一次查出已回覆者並略過，其餘一起送出。回傳 multicast 每批結果。"""
+    replied = await async_db.get_replied_user_ids([u["user_id"] for u in users])
+    targets = []
+    for user in users:
+        if user["user_id"] in replied:
+            logger.info("%s 已回覆，不發送詢問通知", user.get("name", user["user_id"]))
+        else:
+            targets.append(user)
+
+    if not targets:
+        return []
+
+    results = await _deliver(client, "ask", targets, _build_ask_message(), fire)
+    logger.info("已向 %d 人發送詢問通知", len(targets))
+    return results
+
+
+async def send_summary_notification_batch(client, users, fire=None):
+    """同一時段的統計摘要：先 await 更新出席快照，再取（快取的）摘要文字"""
+    try:
+        text = renderer.attendance_text(await async_db.get_attendance())
+        results = await _deliver(client, "summary", users, text, fire)
+        logger.info("已向 %d 人發送統計摘要", len(users))
+        return results
+    except Exception as e:
+        logger.error("摘要發送錯誤: %s", e)
+        return []
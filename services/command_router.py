@@ -0,0 +1,53 @@
+# command_router.py
+"""
+指令路由：啟動時把 Config 的各組關鍵字正規化後編進同一張 dict，
+每則訊息只做一次正規化 + 一次 dict 查找。
+
+正規化規則：NFKC（全形 → 半形）、casefold（大小寫）、移除所有空白。
+"""
+import unicodedata
+from config import config
+from utils.tenants import TenantLocal
+
+# 指令名稱
+CMD_STATS = "stats"
+CMD_REPLY = "reply"
+CMD_NOTIFY = "notify"
+CMD_HELP = "help"
+CMD_MAP = "map"
+
+
+def normalize(text) -> str:
+    return "".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+class CommandRouter:
+    def __init__(self, cfg=config):
+        # 依原本 if-chain 的優先順序登記；同一關鍵字先登記者優先
+        groups = [
+            (CMD_STATS, cfg.STAT_KEYWORDS),
+            (CMD_REPLY, list(cfg.YES_KEYWORDS) + list(cfg.NO_KEYWORDS)),
+            (CMD_NOTIFY, cfg.NOTIFY_KEYWORDS),
+            (CMD_HELP, cfg.HELP_KEYWORDS),
+            (CMD_MAP, cfg.MAP_KEYWORDS),
+        ]
+        table = {}
+        for command, keywords in groups:
+            for keyword in keywords:
+                # 值帶原始關鍵字：例如「ＹＥＳ」會對應回設定中的「Yes」，寫入 DB 時仍能被正確分類
+                table.setdefault(normalize(keyword), (command, keyword))
+        self._table = table
+        self._max_len = max((len(k) for k in table), default=0)
+
+    def route(self, text):
+        """回傳 (command, keyword)；不是指令時回傳 None"""
+        if not text:
+            return None
+        # 明顯比最長關鍵字長很多的聊天內容直接略過，不做正規化
+        if len(text) > self._max_len * 4 + 16:
+            return None
+        return self._table.get(normalize(text))
+
+
+# 全域共用實例（依目前群組的關鍵字）
+router = TenantLocal(CommandRouter)
@@ -0,0 +1,109 @@
+# event_dedup.py
+"""
+Webhook 重送去重。
+
+LINE 在逾時時會重送同一個 webhook（webhookEventId 相同、deliveryContext.isRedelivery=true）。
+以 webhookEventId 為鍵：
+- 本行程內：有上限的 TTL + LRU 快取
+- 跨 Gunicorn worker（可選）：共用後端 claim(event_id, ttl)，第一個 claim 成功的才處理
+重複事件在任何 DB / LINE API 工作之前就被丟棄，並計數。
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def event_key(event):
+    """取事件的去重鍵：優先 webhookEventId，沒有時退回訊息 ID"""
+    key = getattr(event, "webhook_event_id", None)
+    if key:
+        return key
+    message = getattr(event, "message", None)
+    message_id = getattr(message, "id", None)
+    return f"msg:{message_id}" if message_id else None
+
+
+class EventDeduplicator:
+    def __init__(self, ttl=600, max_size=10000, shared_claim=None):
+        """
+        ttl:          記住事件 ID 的秒數
+        max_size:     本行程快取上限（超過時淘汰最舊的）
+        shared_claim: 可選的共用後端 claim(event_id, ttl) -> bool（True = 第一次看到）
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.shared_claim = shared_claim
+        self._seen = OrderedDict()   # event_id -> expires_at
+        self._lock = threading.Lock()
+        self.counters = {"accepted": 0, "skipped_local": 0, "skipped_shared": 0, "shared_errors": 0}
+
+    def accept(self, event) -> bool:
+        """第一次看到的事件回傳 True；重送的事件回傳 False"""
+        key = event_key(event)
+        if key is None:
+            return True
+        if not self._accept_local(key):
+            return False
+
+        if self.shared_claim is not None:
+            try:
+                claimed = self.shared_claim(key, self.ttl)
+            except Exception as e:
+                claimed = self._shared_error(e)
+            if not claimed:
+                return self._skip_shared()
+        return self._accepted()
+
+    async def accept_async(self, event) -> bool:
+        """ASGI 模式：shared_claim 為 async 函式"""
+        key = event_key(event)
+        if key is None:
+            return True
+        if not self._accept_local(key):
+            return False
+
+        if self.shared_claim is not None:
+            try:
+                claimed = await self.shared_claim(key, self.ttl)
+            except Exception as e:
+                claimed = self._shared_error(e)
+            if not claimed:
+                return self._skip_shared()
+        return self._accepted()
+
+    def _accept_local(self, key) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            expires_at = self._seen.get(key)
+            if expires_at is not None and expires_at > now:
+                self.counters["skipped_local"] += 1
+                return False
+            self._seen[key] = now + self.ttl
+            self._seen.move_to_end(key)
+            while len(self._seen) > self.max_size:
+                self._seen.popitem(last=False)
+        return True
+
+    def _shared_error(self, e) -> bool:
+        # 共用後端異常時寧可重複處理，也不要漏掉事件
+        logger.warning("共用去重後端錯誤，略過檢查: %s", e)
+        with self._lock:
+            self.counters["shared_errors"] += 1
+        return True
+
+    def _skip_shared(self) -> bool:
+        with self._lock:
+            self.counters["skipped_shared"] += 1
+        return False
+
+    def _accepted(self) -> bool:
+        with self._lock:
+            self.counters["accepted"] += 1
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters, cached=len(self._seen))
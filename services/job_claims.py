@@ -0,0 +1,140 @@
+# job_claims.py
+"""
+多 worker / 多節點同時跑排程器時的協調：每次觸發只執行一次。
+
+每個 worker 的 APScheduler 都會在同一時間觸發同一個任務；
+執行前先以 (job_id, fire_time, shard) 向 DB claim，只有成功的那個 worker 真正執行。
+大量收件人會切成分片：每個 worker 一次只 claim 一個分片，送完標記完成後才 claim 下一個，
+分片因此分散到同時觸發的各 worker。
+
+claim 帶有租約（SCHEDULER_CLAIM_LEASE）：worker 在送出前當掉、或送出失敗時，
+該分片在租約到期（失敗時為 SCHEDULER_CLAIM_RETRY 秒）後由其他 worker 接手，不會漏送。
+租約須大於送完一個分片的時間，否則送得慢的分片可能被接手而重送。
+
+fire_time 取自 APScheduler 的預定觸發時間（見 last_fire_time），
+worker 延遲執行、甚至跨過午夜，同一次觸發在所有 worker 得到相同的 key。
+
+SCHEDULER_COORDINATION=none（預設）時不做任何協調，行為與單一排程器相同。
+"""
+import os
+import time
+import socket
+import logging
+from datetime import datetime, timedelta
+import pytz
+from config import config
+from database.storage import JOB_CLAIMED, JOB_BUSY, JOB_DONE
+
+logger = logging.getLogger(__name__)
+
+tz = pytz.timezone(config.TIMEZONE)
+
+# 往回找預定觸發時間的範圍（每週一次的任務，錯過的觸發不會晚於一週才執行）
+FIRE_LOOKBACK = timedelta(days=8)
+# 其他 worker 的分片尚未完成時，多久再檢查一次（秒）
+POLL_SECONDS = 1.0
+
+def owner() -> str:
+    """worker 識別（fork 後 PID 不同，因此每次重新取得）"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enabled() -> bool:
+    return config.SCHEDULER_COORDINATION in ("db", "mysql")
+
+
+def fire_time():
+    """目前時間（精確到分，不含時區，直接寫入 DB）；沒有排程觸發時間可用時的備用值"""
+    return datetime.now(tz).replace(second=0, microsecond=0, tzinfo=None)
+
+
+def last_fire_time(trigger, now=None):
+    """
+    APScheduler trigger 在 now 之前（含）最近一次的預定觸發時間，即目前這次執行所屬的觸發。
+    以預定時間而非執行當下的日期組出 key：延遲執行跨過午夜也不會變成另一次觸發。
+    """
+    now = now or datetime.now(tz)
+    fire = None
+    if trigger is not None:
+        candidate = trigger.get_next_fire_time(None, now - FIRE_LOOKBACK)
+        while candidate is not None and candidate <= now:
+            fire = candidate
+            candidate = trigger.get_next_fire_time(candidate, candidate + timedelta(seconds=1))
+    if fire is None:
+        return fire_time()
+    return fire.astimezone(tz).replace(second=0, microsecond=0, tzinfo=None)
+
+
+def claim(job_id, when, shard=0):
+    """回傳 JOB_CLAIMED / JOB_BUSY / JOB_DONE；DB 錯誤時視為 JOB_BUSY（稍後再試）"""
+    from database.db import claim_job_fire
+    try:
+        return claim_job_fire(job_id, when, shard, owner(), config.SCHEDULER_CLAIM_LEASE)
+    except Exception as e:
+        logger.error("排程 claim 失敗（%s @ %s #%d）: %s", job_id, when, shard, e)
+        return JOB_BUSY
+
+
+def _finish(job_id, when, shard, retry_in=None):
+    from database.db import finish_job_fire
+    try:
+        finish_job_fire(job_id, when, shard, owner(), retry_in)
+    except Exception as e:
+        # 沒記錄到完成：租約到期後可能由其他 worker 重送；沒能放棄：租約到期後照樣可接手
+        logger.error("排程 claim 狀態更新失敗（%s @ %s #%d）: %s", job_id, when, shard, e)
+
+
+def run_shards(job_id, items, when, send, shard_size=None, poll=POLL_SECONDS):
+    """
+    把 items 切成分片，逐一以 send(shard) 送出；回傳本 worker 送出的分片數。
+
+    協調時一次只 claim 一個分片，送完標記完成才 claim 下一個；各 worker 依 PID 從不同分片開始。
+    其他 worker 執行中的分片留到下一輪，直到全部完成，或等待超過 SCHEDULER_CLAIM_WAIT 秒。
+    send 拋出例外時放棄該分片，SCHEDULER_CLAIM_RETRY 秒後再由任一 worker 重試。
+    """
+    shard_size = shard_size or config.SCHEDULER_SHARD_SIZE
+    shards = [items[i:i + shard_size] for i in range(0, len(items), shard_size)]
+    if not enabled():
+        for shard in shards:
+            send(shard)
+        return len(shards)
+
+    start = os.getpid() % len(shards) if shards else 0
+    pending = [(start + k) % len(shards) for k in range(len(shards))]
+    deadline = time.monotonic() + config.SCHEDULER_CLAIM_WAIT
+    sent = 0
+    while pending:
+        waiting = []
+        for index in pending:
+            status = claim(job_id, when, index)
+            if status == JOB_DONE:
+                continue
+            if status != JOB_CLAIMED:
+                waiting.append(index)
+                continue
+            try:
+                send(shards[index])
+            except Exception as e:
+                logger.error("任務 %s @ %s #%d 執行失敗，%d 秒後重試: %s",
+                             job_id, when, index, config.SCHEDULER_CLAIM_RETRY, e)
+                _finish(job_id, when, index, retry_in=config.SCHEDULER_CLAIM_RETRY)
+                waiting.append(index)
+                continue
+            _finish(job_id, when, index)
+            sent += 1
+        pending = waiting
+        if pending:
+            if time.monotonic() >= deadline:
+                logger.warning("任務 %s @ %s 仍有 %d 個分片未完成，停止等待", job_id, when, len(pending))
+                break
+            time.sleep(poll)
+    if sent < len(shards):
+        logger.info("任務 %s @ %s：本 worker 送出 %d / %d 個分片", job_id, when, sent, len(shards))
+    return sent
+
+
+def run_once(job_id, when, func, *args):
+    """整個任務只需執行一次（例如每週換場次）；執行失敗時由任一 worker 稍後重試"""
+    results = []
+    run_shards(job_id, [args], when, lambda shard: results.append(func(*shard[0])), shard_size=1)
+    return results[0] if results else None
@@ -0,0 +1,148 @@
+# message_renderer.py
+"""
+訊息內容的產生與快取（統計、摘要、詢問、幫助、地圖）。
+
+- 出席統計：「統計」回覆與排程摘要共用同一份文字，以出席快照的 version 為鍵；
+  回覆沒有變動時，連續的「統計」與同一時段的摘要推播都直接沿用
+- 詢問訊息：只隨星期與週五日期變化
+- 幫助、地圖：內容固定，第一次使用時產生
+"""
+import threading
+import urllib.parse
+from datetime import datetime
+import pytz
+from linebot.v3.messaging import TemplateMessage, ButtonsTemplate, URIAction
+from config import config
+from utils.date_utils import get_friday, get_session_date, play_day_name
+from utils.tenants import TenantLocal
+
+tz = pytz.timezone(config.TIMEZONE)
+
+
+class MessageRenderer:
+    def __init__(self, cfg=config):
+        self.cfg = cfg                    # 地點、時間等設定（多群組時為 Tenant）
+        self._lock = threading.Lock()
+        self._attendance = (None, None)   # ((snapshot id, version, session), text)
+        self._ask = (None, None)          # ((weekday, friday_str), text)
+        self._help = None
+        self._map = None
+
+    # ---------- 出席統計 ----------
+
+    def attendance_text(self, snapshot):
+        """
+        snapshot 為 AttendanceSnapshot；內容（version）或場次不變時回傳同一份文字。
+        標題日期取自快照所屬的場次：打球日之後到換場次之前，統計仍是本場，不是下週。
+        """
+        session = snapshot.session or get_session_date()
+        key = (id(snapshot), snapshot.version, session)
+        cached_key, text = self._attendance
+        if cached_key == key:
+            return text
+
+        # 先取 version 再取名單：若中途有寫入，version 較舊，下次會重新產生
+        text = self._format_attendance(session.strftime("%m/%d"), *snapshot.lists())
+        with self._lock:
+            self._attendance = (key, text)
+        return text
+
+    @staticmethod
+    def _format_attendance(friday_str, yes_list, no_list, no_reply_list):
+        yes_names = "\n".join(f"- {name}" for name in yes_list)
+        no_names = "\n".join(f"- {name}" for name in no_list)
+        no_reply_names = "\n".join(f"- {name}" for name in no_reply_list)
+
+        response = f"出席統計（{friday_str}）\n"
+        response += f"✅ 要打球（{len(yes_list)}人）:\n{yes_names or '（無）'}\n\n"
+        response += f"❌ 不打球（{len(no_list)}人）:\n{no_names or '（無）'}\n\n"
+        response += f"😡 未回應（{len(no_reply_list)}人）:\n{no_reply_names or '（無）'}"
+        return response
+
+    # ---------- 詢問 ----------
+
+    def ask_text(self):
+        """依今天星期幾產生詢問訊息（同一時間點所有人內容相同）"""
+        friday_str = get_friday()
+        today = datetime.now(tz).strftime("%A").lower()
+        key = (today, friday_str)
+        cached_key, text = self._ask
+        if cached_key == key:
+            return text
+
+        text = self._format_ask(today, friday_str)
+        with self._lock:
+            self._ask = (key, text)
+        return text
+
+    def _format_ask(self, today, friday_str):
+        location, time_range, day = self.cfg.BADMINTON_LOCATION, self.cfg.BADMINTON_TIME, play_day_name()
+        if today == "tuesday":
+            return (
+                f"嗨嗨～再提醒一次！\n禮拜{day}({friday_str})晚上{location}，{time_range}。\n"
+                "目前還有些人沒回覆會不會來，幫個忙回覆一下 🙏\n"
+                "人數掌握一下比較好排場次～\n\n"
+                "請回覆「要」或「不要」喔！"
+            )
+        elif today == "friday":
+            return (
+                f"後天就要打球啦～\n禮拜{day}({friday_str} {time_range}) {location}！\n"
+                "還沒回覆的，今天務必講一下要不要來，\n"
+                "我們要安排場次、人數，不能再靠猜的了～\n"
+                "再不說，真的會派人面對面來問你喔（不是開玩笑）👀\n\n"
+                "請回覆「要」或「不要」喔！"
+            )
+        else:
+            return (
+                f"嗨各位~\n這週{day}({friday_str} {time_range})\n"
+                f"我們照常在{location}打球，\n回復一下你會不會來吧，讓我們好抓人數喔~\n\n"
+                "請回覆「要」或「不要」喔！"
+            )
+
+    # ---------- 固定內容 ----------
+
+    def help_text(self):
+        """指令清單取自目前群組的 *_KEYWORDS，群組自訂的關鍵字也會列出"""
+        if self._help is None:
+            cfg = self.cfg
+            self._help = "可用指令：\n" + "\n".join([
+                f"- {_keywords(cfg.STAT_KEYWORDS)}：查看出席統計",
+                f"- {_keywords(cfg.YES_KEYWORDS)}：參加活動",
+                f"- {_keywords(cfg.NO_KEYWORDS)}：不參加活動",
+                f"- {_keywords(cfg.NOTIFY_KEYWORDS)}：發送提醒通知",
+                f"- {_keywords(cfg.HELP_KEYWORDS)}：顯示這個幫助訊息",
+                f"- {_keywords(cfg.MAP_KEYWORDS)}：導航到{cfg.BADMINTON_LOCATION}",
+            ])
+        return self._help
+
+    def map_message(self) -> TemplateMessage:
+        if self._map is None:
+            destination = self.cfg.BADMINTON_LOCATION
+            encoded_destination = urllib.parse.quote(destination)
+            map_url = f"https://www.google.com/maps/dir/?api=1&destination={encoded_destination}"
+
+            buttons_template = ButtonsTemplate(
+                title=f"導航至{destination}",
+                text="點選下方按鈕，開始導航",
+                actions=[URIAction(label="開啟 Google 導航", uri=map_url)]
+            )
+            self._map = TemplateMessage(
+                alt_text=f"導航到{destination}",
+                template=buttons_template
+            )
+        return self._map
+
+
+def _keywords(words):
+    """「要 / Yes」：指令比對不分大小寫，只差大小寫的關鍵字只列一次"""
+    seen = set()
+    unique = []
+    for word in words:
+        if word.lower() not in seen:
+            seen.add(word.lower())
+            unique.append(word)
+    return " / ".join(unique)
+
+
+# 全域共用實例（每個群組各一份，快取互不影響）
+renderer = TenantLocal(MessageRenderer)
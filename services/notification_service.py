@@ -1,95 +1,118 @@
-import json
-import os
-import logging
-from datetime import datetime
-import pytz
-from line_service import push_message_to_user
-from database.db import get_user_reply, has_replied, reset_replies_db
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from line_service import push_message_to_user, multicast_message
+from database.db import (
+    get_attendance, has_replied, get_replied_user_ids, reset_replies_db, prune_job_claims, prune_outbox,
+)
 from config import config
-from utils.date_utils import get_friday
+from utils.roster import roster
+from services.message_renderer import renderer
+from services import job_claims
+from utils.log import get_logger
 
 # 設定 logger
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-if not logger.handlers:
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter('[%(asctime)s] [%(levelname)s] %(message)s', '%Y-%m-%d %H:%M:%S')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-
-# 設定台灣時區
-tz = pytz.timezone(config.TIMEZONE)
+logger = get_logger(__name__)
 
 def load_user_config():
-    """載入使用者配置"""
-    try:
-        if not os.path.exists(config.USERS_CONFIG_PATH):
-            logger.warning(f"找不到 {config.USERS_CONFIG_PATH}，請建立此檔案")
-            return {"users": []}
-        with open(config.USERS_CONFIG_PATH, encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        logger.error("配置載入錯誤: %s", e)
-        return {"users": []}
+    """載入使用者配置（共用名單快取，檔案變動時才重新解析）"""
+    return roster.get_config()
 
-def send_ask_notification(user):
-    """發送詢問通知"""
-    friday_str = get_friday()
-    today = datetime.now(tz).strftime("%A").lower()
+def _build_ask_message():
+    """依今天星期幾產生詢問訊息（同一時間點所有人內容相同）"""
+    return renderer.ask_text()
+
+def _build_summary_message():
+    """產生出席統計摘要（與「統計」指令同一份文字，內容沒變時直接沿用）"""
+    return renderer.attendance_text(get_attendance())
+
+def _log_batches(kind, results):
+    for r in results:
+        if r["ok"]:
+            logger.info("[%s] multicast 第 %d 批成功（%d 人）", kind, r["batch"], r["recipients"])
+        else:
+            logger.error("[%s] multicast 第 %d 批失敗（%d 人）: %s", kind, r["batch"], r["recipients"], r["error"])
+
+def _push_each(kind, users, message):
+    """
+    NOTIFY_MULTICAST=false：逐一 push（NOTIFY_PUSH_WORKERS 條執行緒同時送出）；回傳失敗人數。
+    每則在呼叫端 context 的複本中執行，沿用目前群組的 access token。
+    """
+    user_ids = [u["user_id"] for u in users]
+    with ThreadPoolExecutor(max_workers=max(1, min(config.NOTIFY_PUSH_WORKERS, len(user_ids)))) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, push_message_to_user, uid, message)
+                   for uid in user_ids]
+        sent = [f.result() for f in futures]
+    failed = sent.count(False)
+    if failed:
+        logger.error("[%s] push 失敗 %d / %d 人", kind, failed, len(user_ids))
+    return failed
+
+def _deliver(kind, users, message, fire):
+    """同一時段的收件人：排入 outbox、合併成 multicast，或逐一 push。回傳 multicast 每批結果。"""
+    if config.NOTIFY_OUTBOX:
+        return _enqueue(kind, users, message, fire)
+    if config.NOTIFY_MULTICAST:
+        results = multicast_message([u["user_id"] for u in users], message)
+        _log_batches(kind, results)
+        return results
+    _push_each(kind, users, message)
+    return []
 
+def _enqueue(kind, users, message, fire):
+    """NOTIFY_OUTBOX=true：只寫入 outbox，由送出端平行推播"""
+    from services import outbox
+    inserted = outbox.enqueue(kind, users, message, fire)
+    logger.info("[%s] 已排入 outbox %d 則（%d 則先前已排入）", kind, inserted, len(users) - inserted)
+    return []
+
+def send_ask_notification(user, fire=None):
+    """發送詢問通知"""
     # 檢查使用者是否已回覆
     if has_replied(user["user_id"]):
         logger.info("%s 已回覆，不發送詢問通知", user["name"])
         return
 
-    if today == "tuesday":
-        message = (
-            f"嗨嗨～再提醒一次！\n禮拜五({friday_str})晚上{config.BADMINTON_LOCATION}，{config.BADMINTON_TIME}。\n"
-            "目前還有些人沒回覆會不會來，幫個忙回覆一下 🙏\n"
-            "人數掌握一下比較好排場次～\n\n"
-            "請回覆「要」或「不要」喔！"
-        )
-    elif today == "friday":
-        message = (
-            f"後天就要打球啦～\n禮拜五({friday_str} {config.BADMINTON_TIME}) {config.BADMINTON_LOCATION}！\n"
-            "還沒回覆的，今天務必講一下要不要來，\n"
-            "我們要安排場次、人數，不能再靠猜的了～\n"
-            "再不說，真的會派人面對面來問你喔（不是開玩笑）👀\n\n"
-            "請回覆「要」或「不要」喔！"
-        )
-    else:
-        message = (
-            f"嗨各位~\n這週五({friday_str} {config.BADMINTON_TIME})\n"
-            f"我們照常在{config.BADMINTON_LOCATION}打球，\n回復一下你會不會來吧，讓我們好抓人數喔~\n\n"
-            "請回覆「要」或「不要」喔！"
-        )
-
-    push_message_to_user(user["user_id"], message)
+    if config.NOTIFY_OUTBOX:
+        _enqueue("ask", [user], _build_ask_message(), fire)
+        return
+    push_message_to_user(user["user_id"], _build_ask_message())
     logger.info("已向 %s 發送詢問通知", user["name"])
 
-def send_summary_notification(user):
-    """發送統計摘要通知"""
-    try:
-        yes_list, no_list, no_reply_list = get_user_reply()
-        friday_str = get_friday()
+def send_ask_notification_batch(users, fire=None):
+    """同一時段的詢問通知：一次查出已回覆者並略過，其餘一起送出。回傳 multicast 每批結果。"""
+    replied = get_replied_user_ids([u["user_id"] for u in users])
+    targets = []
+    for user in users:
+        if user["user_id"] in replied:
+            logger.info("%s 已回覆，不發送詢問通知", user.get("name", user["user_id"]))
+        else:
+            targets.append(user)
+
+    if not targets:
+        return []
 
-        summary = f"出席統計（{friday_str}）\n"
-        summary += f"✅ 要打球（{len(yes_list)}人）:\n"
-        summary += "\n".join(f"- {name}" for name in yes_list) or "（無）"
-        summary += f"\n\n❌ 不打球（{len(no_list)}人）:\n"
-        summary += "\n".join(f"- {name}" for name in no_list) or "（無）"
-        summary += f"\n\n😡 未回應（{len(no_reply_list)}人）:\n"
-        summary += "\n".join(f"- {name}" for name in no_reply_list) or "（無）"
+    results = _deliver("ask", targets, _build_ask_message(), fire)
+    logger.info("已向 %d 人發送詢問通知", len(targets))
+    return results
 
-        push_message_to_user(user["user_id"], summary)
-        logger.info("已向 %s 發送統計摘要", user["name"])
+def send_summary_notification_batch(users, fire=None):
+    """同一時段的統計摘要：只產生一次內容，一起送出。回傳 multicast 每批結果。"""
+    try:
+        results = _deliver("summary", users, _build_summary_message(), fire)
+        logger.info("已向 %d 人發送統計摘要", len(users))
+        return results
     except Exception as e:
         logger.error("摘要發送錯誤: %s", e)
+        return []
 
 def reset_replies_with_log():
     """重置回覆狀態（帶日誌）"""
     try:
         reset_replies_db()
-        logger.info("已重置所有人的回覆狀態（reset_replies）")
+        if job_claims.enabled():
+            prune_job_claims()
+        if config.NOTIFY_OUTBOX:
+            prune_outbox()
+        logger.info("已切換到新場次（reset_replies）")
     except Exception as e:
         logger.error("重置回覆狀態時發生錯誤: %s", e)
@@ -0,0 +1,172 @@
+# outbox.py
+"""
+通知 outbox（NOTIFY_OUTBOX=true 時使用）。
+
+排程任務不再直接呼叫 LINE API，只把「每位收件人一則訊息」寫入 outbox 資料表；
+送出端（OutboxDelivery）一次 claim 一批，交給執行緒池平行 push，再記錄結果：
+
+- idempotency_key = 類型 + 觸發時間 + 收件人：多個 worker 重複寫入同一次通知也只有一列
+- X-Line-Retry-Key 由 idempotency_key 導出：送出後當掉、lease 到期由別人重送時，LINE 端也不會重複送達
+- 送出者當掉時 inflight 的列在 OUTBOX_LEASE_SECONDS 後重新被 claim，不會默默漏掉任何人
+- 多群組時每個群組有自己的 outbox 資料表，送出端依序輪流處理（執行緒池共用）
+"""
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from linebot.v3.messaging.exceptions import ApiException
+from linebot.v3.messaging.models import TextMessage, PushMessageRequest
+from config import config
+from database.db import enqueue_outbox, claim_outbox, mark_outbox_sent, mark_outbox_failed
+from line_service import line_client
+from services import job_claims
+from utils import metrics, profiler
+from utils.tenants import current, use, each
+
+logger = logging.getLogger(__name__)
+
+RETRY_BASE_SECONDS = 5
+RETRY_MAX_SECONDS = 300
+
+
+def idempotency_key(kind, user_id, fire):
+    return f"{kind}:{fire:%Y%m%d%H%M}:{user_id}"
+
+
+def retry_key(key):
+    """X-Line-Retry-Key 必須是 UUID：同一個 idempotency_key 永遠得到同一個值"""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"badminton-outbox:{key}"))
+
+
+def build_rows(kind, users, message, fire=None):
+    fire = fire or job_claims.fire_time()
+    return [(idempotency_key(kind, u["user_id"], fire), kind, u["user_id"], message) for u in users]
+
+
+def enqueue(kind, users, message, fire=None):
+    """
+    寫入 outbox 並喚醒本行程的送出端；回傳新增筆數（已存在的略過）。
+    fire：本次觸發的時間點（排程傳入預定時間，同一次觸發在所有 worker 得到相同的 key）
+    """
+    inserted = enqueue_outbox(build_rows(kind, users, message, fire))
+    delivery.wake()
+    return inserted
+
+
+def _is_permanent(exc):
+    """4xx（429 以外）代表請求本身有問題（例如使用者封鎖），重試也不會成功"""
+    status = getattr(exc, "status", None) or 0
+    return isinstance(exc, ApiException) and 400 <= status < 500 and status != 429
+
+
+class OutboxDelivery:
+    def __init__(self, workers=8, batch_size=100, poll_interval=2.0, lease_seconds=120, max_attempts=5):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None or self._stop.is_set():
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="outbox-send")
+            self._thread = threading.Thread(target=self._run, name="outbox-dispatcher", daemon=True)
+            self._thread.start()
+            logger.info("Outbox 送出端已啟動（workers=%d, batch=%d）", self.workers, self.batch_size)
+
+    def wake(self):
+        """有新資料時立即處理，不必等下一次輪詢"""
+        if self._thread is None:
+            self.start()
+        self._wakeup.set()
+
+    def shutdown(self, timeout=10):
+        """停止 claim 新的一批；已 claim 的那一批送完才返回（最多 timeout 秒）"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def _run(self):
+        while not self._stop.is_set():
+            busy = False
+            for _ in each():
+                try:
+                    with profiler.trace("outbox", "deliver"):
+                        claimed = self.deliver_once()
+                except Exception as e:
+                    logger.error("Outbox 送出時發生錯誤: %s", e)
+                    claimed = 0
+                busy = busy or claimed >= self.batch_size
+            if not busy:
+                # 每個群組這一批都沒有滿：暫時沒有工作，等新資料或下一次輪詢
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def deliver_once(self):
+        """claim 目前群組的一批並平行送出；回傳 claim 到的筆數"""
+        token, rows = claim_outbox(job_claims.owner(), self.batch_size, self.lease_seconds)
+        if not rows:
+            return 0
+        tenant = current()
+        results = list(self._executor.map(lambda row: self._send(row, tenant), rows))
+        sent = [row[0] for row, error in zip(rows, results) if error is None]
+        # 只更新仍屬於本次 claim 的列：送得太慢、已被其他 worker 重新 claim 的列交由對方處理
+        mark_outbox_sent(sent, token)
+        for row, error in zip(rows, results):
+            if error is not None:
+                self._record_failure(row, token, error)
+        logger.info("Outbox 已送出 %d / %d 則", len(sent), len(rows))
+        return len(rows)
+
+    @staticmethod
+    def _send(row, tenant):
+        """送出一列（以該群組的 token）；成功回傳 None，失敗回傳例外"""
+        _, key, kind, user_id, message, _ = row
+        try:
+            with use(tenant):
+                line_client.push_message(
+                    PushMessageRequest(to=user_id, messages=[TextMessage(text=message)]),
+                    retry_key=retry_key(key),
+                )
+        except Exception as e:
+            return e
+        metrics.OUTBOX_DELIVERIES.labels(kind, "sent").inc()
+        return None
+
+    def _record_failure(self, row, token, error):
+        outbox_id, key, kind, user_id, _, attempts = row
+        if _is_permanent(error) or attempts >= self.max_attempts:
+            metrics.OUTBOX_DELIVERIES.labels(kind, "failed").inc()
+            logger.error("Outbox 送出失敗，不再重試（%s，第 %d 次）: %s", key, attempts, error)
+            mark_outbox_failed(outbox_id, token, error)
+            return
+        delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * (2 ** (attempts - 1)))
+        metrics.OUTBOX_DELIVERIES.labels(kind, "retry").inc()
+        logger.warning("Outbox 送出失敗，%d 秒後重試（%s，第 %d 次）: %s", delay, key, attempts, error)
+        mark_outbox_failed(outbox_id, token, error, retry_in=delay)
+
+
+# 全域共用實例（第一次 enqueue 或 start_delivery() 時才啟動執行緒）
+delivery = OutboxDelivery(
+    workers=config.OUTBOX_WORKERS,
+    batch_size=config.OUTBOX_CLAIM_BATCH,
+    poll_interval=config.OUTBOX_POLL_INTERVAL,
+    lease_seconds=config.OUTBOX_LEASE_SECONDS,
+    max_attempts=config.OUTBOX_MAX_ATTEMPTS,
+)
+
+
+def start_delivery():
+    """每個 worker 行程各自啟動送出端（preload 時由 post_fork 後的 start_worker_services 呼叫）"""
+    if config.NOTIFY_OUTBOX:
+        delivery.start()
@@ -0,0 +1,94 @@
+# webhook_queue.py
+"""
+Webhook 事件的背景處理佇列。
+
+/callback 驗證簽章、把事件放進有上限的佇列後立即回 200，
+由固定數量的 worker 執行緒依序呼叫 handler 處理（DB、LINE API 都在背景）。
+關閉時會先把佇列中的事件處理完（drain）再結束。
+"""
+import time
+import queue
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class WebhookQueue:
+    def __init__(self, handler, workers=4, maxsize=200):
+        """
+        handler: 處理單一事件的函式 handler(event)
+        workers: 背景執行緒數量
+        maxsize: 佇列上限；滿了之後 submit() 回傳 False，由呼叫端決定如何處理
+        """
+        self.handler = handler
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def start(self):
+        with self._lock:
+            if self._threads or self._closed:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f"webhook-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            logger.info("Webhook 背景佇列已啟動（workers=%d, maxsize=%d）", self.workers, self._queue.maxsize)
+
+    def submit(self, event) -> bool:
+        """放入佇列；佇列已滿或已關閉時回傳 False"""
+        if self._closed:
+            return False
+        if not self._threads:
+            self.start()
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            return False
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def shutdown(self, timeout=10):
+        """停止接收新事件，等待佇列中的事件處理完畢（最多 timeout 秒）"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            threads = list(self._threads)
+
+        pending = self._queue.qsize()
+        if pending:
+            logger.info("等待 %d 個 webhook 事件處理完畢…", pending)
+        # 每個 worker 各收一個停止訊號；停止訊號排在既有事件之後，因此會先 drain
+        deadline = time.monotonic() + timeout
+        for _ in threads:
+            try:
+                # 佇列已滿時等待空位，但不超過 timeout：worker 卡住時也不會讓關閉流程永遠停在這裡
+                self._queue.put(_STOP, timeout=max(0, deadline - time.monotonic()))
+            except queue.Full:
+                logger.warning("佇列已滿，無法在 %s 秒內送出停止訊號", timeout)
+                break
+        for t in threads:
+            t.join(max(0, deadline - time.monotonic()))
+        left = self._queue.qsize()
+        if left:
+            logger.warning("關閉時仍有 %d 個 webhook 事件未處理", left)
+
+    def _run(self):
+        while True:
+            event = self._queue.get()
+            try:
+                if event is _STOP:
+                    return
+                self.handler(event)
+            except Exception as e:
+                logger.error("[Webhook worker error] %s", e)
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,52 @@
+# conftest.py
+"""
+測試環境：config 在 import 時讀取環境變數，因此必須在任何專案模組 import 之前設定。
+資料庫一律使用暫存目錄中的 SQLite 檔案，不連線到任何外部服務。
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_tmp = tempfile.mkdtemp(prefix="badminton-test-")
+os.environ.update({
+    "DB_BACKEND": "sqlite",
+    "SQLITE_PATH": os.path.join(_tmp, "test.db"),
+    "LINE_CHANNEL_SECRET": "test-secret",
+    "LINE_CHANNEL_ACCESS_TOKEN": "test-token",
+    "RUN_SCHEDULER": "false",
+    "PROFILE_DIR": os.path.join(_tmp, "profiles"),
+})
+
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+    """目前群組改用一個全新的 SQLite 檔案"""
+    from database.storage import get_store, set_store
+    from database.sqlite_store import SQLiteStore
+    previous = get_store()
+    store = SQLiteStore(str(tmp_path / "store.db"))
+    store.init_db()
+    set_store(store)
+    yield store
+    set_store(previous)
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """本地 LINE API stub（tools/line_api_stub.py），line_client 改送到它；不重試，方便檢查失敗"""
+    import line_service
+    from config import config
+    from tools import line_api_stub
+    server, state = line_api_stub.serve(port=0)
+    host, port = server.server_address
+    monkeypatch.setattr(config, "LINE_API_HOST", f"http://{host}:{port}")
+    monkeypatch.setattr(line_service.line_client, "_api", None)
+    monkeypatch.setattr(line_service.line_client, "max_retries", 0)
+    yield state
+    server.shutdown()
+    server.server_close()
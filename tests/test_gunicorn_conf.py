@@ -0,0 +1,42 @@
+import importlib.util
+import os
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _load_conf(monkeypatch, **env):
+    for name in ("WEB_CONCURRENCY", "GUNICORN_PRELOAD", "RUN_SCHEDULER", "SCHEDULER_COORDINATION"):
+        monkeypatch.delenv(name, raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    spec = importlib.util.spec_from_file_location("gunicorn_conf", os.path.join(ROOT, "gunicorn.conf.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _server(workers):
+    return SimpleNamespace(cfg=SimpleNamespace(workers=workers))
+
+
+def test_defaults_match_plain_gunicorn(monkeypatch):
+    conf = _load_conf(monkeypatch)
+    assert conf.workers == 1
+    assert conf.preload_app is False
+
+
+def test_refuses_uncoordinated_scheduler_in_several_workers(monkeypatch):
+    conf = _load_conf(monkeypatch, RUN_SCHEDULER="true")
+    conf.on_starting(_server(1))
+    with pytest.raises(SystemExit):
+        conf.on_starting(_server(2))
+
+
+def test_allows_coordinated_scheduler_in_several_workers(monkeypatch):
+    conf = _load_conf(monkeypatch, RUN_SCHEDULER="true", SCHEDULER_COORDINATION="db")
+    conf.on_starting(_server(4))
+    conf = _load_conf(monkeypatch)
+    conf.on_starting(_server(4))
@@ -0,0 +1,110 @@
+import os
+import time
+import multiprocessing
+from datetime import datetime
+
+import pytest
+from apscheduler.triggers.cron import CronTrigger
+
+from config import config
+from services import job_claims
+
+USERS = [f"U{i:02d}" for i in range(10)]
+SHARDS = [USERS[i:i + 2] for i in range(0, len(USERS), 2)]
+
+
+@pytest.fixture
+def coordinated(monkeypatch, sqlite_store):
+    monkeypatch.setattr(config, "SCHEDULER_COORDINATION", "db")
+    monkeypatch.setattr(config, "SCHEDULER_CLAIM_LEASE", 1)
+    monkeypatch.setattr(config, "SCHEDULER_CLAIM_RETRY", 0)
+    monkeypatch.setattr(config, "SCHEDULER_CLAIM_WAIT", 20)
+    return sqlite_store
+
+
+def _worker(log_path, when, crash=False, delay=0.0):
+    def send(shard):
+        if crash:
+            # claim 之後、送出之前當掉
+            os._exit(1)
+        time.sleep(delay)
+        with open(log_path, "a") as f:
+            f.write(f"{os.getpid()} {shard[0]}\n")
+
+    job_claims.run_shards("slot-test", USERS, when, send, shard_size=2, poll=0.1)
+
+
+def _sent(log_path):
+    with open(log_path) as f:
+        return [line.split() for line in f]
+
+
+def _start(target, *args, **kwargs):
+    process = multiprocessing.get_context("fork").Process(target=target, args=args, kwargs=kwargs)
+    process.start()
+    return process
+
+
+def test_two_workers_send_each_shard_once(coordinated, tmp_path):
+    log_path = str(tmp_path / "sent.log")
+    open(log_path, "w").close()
+    when = datetime(2026, 1, 4, 20, 0)
+
+    workers = [_start(_worker, log_path, when, delay=0.05) for _ in range(2)]
+    for worker in workers:
+        worker.join(30)
+        assert worker.exitcode == 0
+
+    sent = _sent(log_path)
+    assert sorted(first for _, first in sent) == [shard[0] for shard in SHARDS]
+    # 一次只 claim 一個分片：兩個 worker 都分到工作
+    assert len({pid for pid, _ in sent}) == 2
+
+
+def test_shard_of_crashed_worker_is_taken_over(coordinated, tmp_path):
+    log_path = str(tmp_path / "sent.log")
+    open(log_path, "w").close()
+    when = datetime(2026, 1, 4, 20, 0)
+
+    crashed = _start(_worker, log_path, when, crash=True)
+    crashed.join(30)
+    assert crashed.exitcode == 1
+
+    survivor = _start(_worker, log_path, when)
+    survivor.join(30)
+    assert survivor.exitcode == 0
+
+    sent = _sent(log_path)
+    assert sorted(first for _, first in sent) == [shard[0] for shard in SHARDS]
+    assert {pid for pid, _ in sent} == {str(survivor.pid)}
+
+
+def test_failed_shard_is_retried(coordinated):
+    when = datetime(2026, 1, 4, 20, 0)
+    attempts = []
+
+    def send(shard):
+        attempts.append(shard[0])
+        if attempts.count(shard[0]) == 1 and shard[0] == "U04":
+            raise RuntimeError("LINE API 暫時無法使用")
+
+    assert job_claims.run_shards("slot-retry", USERS, when, send, shard_size=2, poll=0.05) == len(SHARDS)
+    assert attempts.count("U04") == 2
+    assert sorted(set(attempts)) == [shard[0] for shard in SHARDS]
+
+
+def test_done_fire_is_not_run_again(coordinated):
+    when = datetime(2026, 1, 4, 23, 59)
+    calls = []
+    job_claims.run_once("weekly-reset", when, calls.append, "first")
+    job_claims.run_once("weekly-reset", when, calls.append, "second")
+    assert calls == ["first"]
+
+
+def test_last_fire_time_uses_scheduled_time_across_midnight():
+    trigger = CronTrigger(day_of_week="sun", hour=23, minute=59, timezone=job_claims.tz)
+    # 週日 23:59 的觸發延遲到週一 00:00:30 才執行，仍屬於週日那一次
+    late = job_claims.tz.localize(datetime(2026, 1, 5, 0, 0, 30))
+    assert job_claims.last_fire_time(trigger, late) == datetime(2026, 1, 4, 23, 59)
+    on_time = job_claims.tz.localize(datetime(2026, 1, 4, 23, 59, 2))
+    assert job_claims.last_fire_time(trigger, on_time) == datetime(2026, 1, 4, 23, 59)
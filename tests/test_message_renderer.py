@@ -0,0 +1,35 @@
+from datetime import date
+
+from database.attendance import AttendanceSnapshot
+from services.message_renderer import MessageRenderer
+from utils.tenants import Tenant
+
+
+def test_help_lists_default_keywords():
+    text = MessageRenderer().help_text()
+    assert "要 / Yes：參加活動" in text
+    assert "不要 / No：不參加活動" in text
+    assert "yes" not in text           # 只差大小寫的關鍵字只列一次
+    assert "球場怎麼去" in text
+
+
+def test_help_lists_tenant_keywords():
+    tenant = Tenant("xinyi", {"YES_KEYWORDS": ["+1"], "NOTIFY_KEYWORDS": ["集合"]})
+    text = MessageRenderer(tenant).help_text()
+    assert "- +1：參加活動" in text
+    assert "- 集合：發送提醒通知" in text
+    assert "發出召集令" not in text
+
+
+def test_attendance_header_uses_snapshot_session():
+    # 週六查詢時 get_friday() 已是下週；標題仍應是快照所屬的本場
+    snapshot = AttendanceSnapshot()
+    snapshot.finish_rebuild([("U1", "小明", "要")], date(2026, 1, 9))
+    renderer = MessageRenderer()
+
+    text = renderer.attendance_text(snapshot)
+    assert text.startswith("出席統計（01/09）")
+    assert "- 小明" in text
+
+    snapshot.finish_rebuild([], date(2026, 1, 16))
+    assert renderer.attendance_text(snapshot).startswith("出席統計（01/16）")
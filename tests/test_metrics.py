@@ -0,0 +1,23 @@
+import os
+
+from utils import metrics
+
+
+def test_check_token():
+    assert metrics.check_token("", None)
+    assert metrics.check_token("Bearer s3cret", "s3cret")
+    assert not metrics.check_token("", "s3cret")
+    assert not metrics.check_token("Bearer wrong", "s3cret")
+    assert not metrics.check_token("s3cret", "s3cret")
+
+
+def test_samples_carry_worker_label():
+    counter = metrics.Counter("test_worker_total", "測試", ("kind",))
+    counter.labels("a").inc()
+    histogram = metrics.Histogram("test_worker_seconds", "測試", buckets=(1.0,))
+    histogram.observe(0.5)
+
+    worker = f'worker="{os.getpid()}"'
+    assert counter.collect()[-1] == f'test_worker_total{{kind="a",{worker}}} 1.0'
+    assert f'test_worker_seconds_bucket{{le="1.0",{worker}}} 1' in histogram.collect()
+    assert f"test_worker_seconds_count{{{worker}}} 1" in histogram.collect()
@@ -0,0 +1,29 @@
+import line_service
+from tools import line_api_stub
+
+
+def test_multicast_splits_into_batches_of_500(stub):
+    user_ids = [f"U{i:04d}" for i in range(1201)] + ["U0000"]   # 重複的收件人只送一次
+
+    results = line_service.multicast_message(user_ids, "本週打球嗎？")
+
+    assert [r["recipients"] for r in results] == [500, 500, 201]
+    assert all(r["ok"] for r in results)
+    multicast = stub.snapshot()["endpoints"]["multicast"]
+    assert multicast == {"requests": 3, "recipients": 1201, "failed": 0}
+
+
+def test_multicast_reports_each_batch(stub, monkeypatch):
+    # 第二批失敗（stub 回 500，且不重試），其餘照常送出
+    stub.fail_rate = 0.5
+    draws = iter([0.9, 0.1, 0.9])
+    monkeypatch.setattr(line_api_stub.random, "random", lambda: next(draws))
+
+    results = line_service.multicast_message([f"U{i:04d}" for i in range(1100)], "本週打球嗎？")
+
+    assert [(r["batch"], r["recipients"], r["ok"]) for r in results] == [
+        (0, 500, True), (1, 500, False), (2, 100, True),
+    ]
+    assert results[0]["error"] is None
+    assert "500" in results[1]["error"]
+    assert stub.snapshot()["endpoints"]["multicast"]["failed"] == 1
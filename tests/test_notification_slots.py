@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+import scheduler
+from config import config
+from database import db
+from services import notification_service
+from utils.roster import roster
+
+USERS = [f"U{i}" for i in range(5)]
+
+
+@pytest.fixture
+def slot(sqlite_store, stub, tmp_path, monkeypatch):
+    """5 人都在週二 09:00 收到詢問，其中 U1 已回覆；回傳「已回覆名單」查詢次數"""
+    path = tmp_path / "users_config.json"
+    path.write_text(json.dumps({"users": [
+        {"user_id": uid, "name": uid, "notification_times": [{"day": "tuesday", "hour": 9, "minute": 0}]}
+        for uid in USERS
+    ]}), encoding="utf-8")
+    monkeypatch.setattr(roster.instance(), "path", str(path))
+    monkeypatch.setattr(roster.instance(), "_stat_key", None)
+    db.record_reply("U1", "U1", "要")
+
+    lookups = []
+    lookup = notification_service.get_replied_user_ids
+    monkeypatch.setattr(notification_service, "get_replied_user_ids", lambda ids: lookups.append(ids) or lookup(ids))
+
+    def has_replied(user_id):
+        raise AssertionError("時段任務不應逐人查詢 has_replied")
+    monkeypatch.setattr(notification_service, "has_replied", has_replied)
+
+    scheduler.schedule_from_config()
+    yield lookups
+    scheduler.scheduler.remove_all_jobs()
+
+
+def test_one_job_per_slot(slot):
+    assert [job.id for job in scheduler.scheduler.get_jobs()] == ["slot-tue-0900-ask"]
+
+
+def test_pushes_each_user_after_one_lookup(slot, stub, monkeypatch):
+    monkeypatch.setattr(config, "NOTIFY_MULTICAST", False)
+    scheduler.run_slot("tue", 9, 0, "ask")
+
+    assert len(slot) == 1
+    endpoints = stub.snapshot()["endpoints"]
+    assert endpoints["push"]["requests"] == 4
+    assert "multicast" not in endpoints or endpoints["multicast"]["requests"] == 0
+
+
+def test_multicast_after_one_lookup(slot, stub, monkeypatch):
+    monkeypatch.setattr(config, "NOTIFY_MULTICAST", True)
+    scheduler.run_slot("tue", 9, 0, "ask")
+
+    assert len(slot) == 1
+    endpoints = stub.snapshot()["endpoints"]
+    assert endpoints["multicast"] == {"requests": 1, "recipients": 4, "failed": 0}
+    assert "push" not in endpoints or endpoints["push"]["requests"] == 0
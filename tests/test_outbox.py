@@ -0,0 +1,86 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytest
+
+from database.storage import get_store, set_store, OUTBOX_SENT, OUTBOX_PENDING
+from database.memory_store import MemoryStore
+from database.sqlite_store import SQLiteStore
+from services import outbox
+
+FIRE = datetime(2026, 1, 4, 20, 0)
+USERS = [{"user_id": f"U{i}"} for i in range(3)]
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    previous = get_store()
+    store = MemoryStore() if request.param == "memory" else SQLiteStore(str(tmp_path / "outbox.db"))
+    store.init_db()
+    set_store(store)
+    yield store
+    set_store(previous)
+
+
+def _expire_leases(store):
+    """把 inflight 的列改成很久以前 claim 的（模擬送出者逾時）"""
+    if isinstance(store, MemoryStore):
+        for row in store._outbox.values():
+            row["claimed_at"] = datetime(2000, 1, 1)
+    else:
+        store._write(lambda conn: conn.execute(
+            f"""UPDATE "{store.t.outbox}" SET claimed_at = '2000-01-01 00:00:00'"""
+        ))
+
+
+def _states(store):
+    if isinstance(store, MemoryStore):
+        return [row["state"] for row in store._outbox.values()]
+    return [state for (state,) in store._connection().execute(f'SELECT state FROM "{store.t.outbox}" ORDER BY id')]
+
+
+@pytest.fixture
+def delivery():
+    d = outbox.OutboxDelivery(workers=2, batch_size=10, lease_seconds=60)
+    d._executor = ThreadPoolExecutor(max_workers=2)
+    yield d
+    d._executor.shutdown()
+
+
+def test_reclaimed_rows_are_sent_once(store, stub, delivery):
+    assert store.enqueue_outbox(outbox.build_rows("ask", USERS, "本週打球嗎？", FIRE)) == 3
+
+    # worker A claim 後卡住，租約過期
+    stale_token, stale_rows = store.claim_outbox("worker-a", 10, 60)
+    assert len(stale_rows) == 3
+    _expire_leases(store)
+
+    # worker B 重新 claim 並送出
+    assert delivery.deliver_once() == 3
+    assert _states(store) == [OUTBOX_SENT] * 3
+
+    # worker A 遲來的結果不能改動已被重新 claim 的列（否則會回到 pending 再送一次）
+    store.mark_outbox_failed(stale_rows[0][0], stale_token, "timeout", retry_in=0)
+    store.mark_outbox_sent([row[0] for row in stale_rows[1:]], stale_token)
+    assert _states(store) == [OUTBOX_SENT] * 3
+    assert store.claim_outbox("worker-c", 10, 60)[1] == []
+    assert delivery.deliver_once() == 0
+
+    push = stub.snapshot()
+    assert push["endpoints"]["push"] == {"requests": 3, "recipients": 3, "failed": 0}
+    assert push["duplicate_retry_keys"] == 0
+
+
+def test_failed_send_is_retried_by_owner(store, stub, delivery, monkeypatch):
+    from tools import line_api_stub
+    store.enqueue_outbox(outbox.build_rows("ask", USERS[:1], "本週打球嗎？", FIRE))
+    monkeypatch.setattr(outbox, "RETRY_BASE_SECONDS", 0)
+
+    stub.fail_rate = 1.0
+    monkeypatch.setattr(line_api_stub.random, "random", lambda: 0.0)
+    assert delivery.deliver_once() == 1
+    assert _states(store) == [OUTBOX_PENDING]
+
+    stub.fail_rate = 0.0
+    assert delivery.deliver_once() == 1
+    assert _states(store) == [OUTBOX_SENT]
@@ -0,0 +1,82 @@
+import threading
+
+import pytest
+
+from database.pool import ConnectionPool, PoolTimeout
+
+
+class FakeRaw:
+    def __init__(self, pool_ref, healthy=True):
+        self.pool_ref = pool_ref
+        self.healthy = healthy
+        self.closed = False
+        self.pings = 0
+
+    def ping(self, reconnect=False):
+        self.pings += 1
+        # 健康檢查不可在持有連線池的鎖時進行（ping 逾時會卡住所有執行緒）
+        assert self.pool_ref[0]._cond.acquire(blocking=False)
+        self.pool_ref[0]._cond.release()
+        if not self.healthy:
+            raise OSError("connection reset")
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def _pool(**kwargs):
+    ref = []
+    created = []
+
+    def connect():
+        raw = FakeRaw(ref)
+        created.append(raw)
+        return raw
+
+    pool = ConnectionPool(connect, **kwargs)
+    ref.append(pool)
+    return pool, created
+
+
+def test_ping_runs_outside_the_lock():
+    pool, created = _pool(size=1, ping_after=0)
+    pool.acquire().close()
+    conn = pool.acquire()
+    assert created[0].pings == 1
+    conn.close()
+
+
+def test_broken_idle_connection_is_replaced():
+    pool, created = _pool(size=1, ping_after=0)
+    pool.acquire().close()
+    created[0].healthy = False
+    conn = pool.acquire()
+    assert created[0].closed
+    assert conn._raw is created[1]
+    assert pool.stats()["open"] == 1
+
+
+def test_waits_for_release_and_times_out():
+    pool, _ = _pool(size=1, timeout=0.2)
+    conn = pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+
+    threading.Timer(0.05, conn.close).start()
+    pool.timeout = 2
+    pool.acquire().close()
+
+
+def test_close_all_keeps_borrowed_connections():
+    pool, created = _pool(size=2)
+    borrowed = pool.acquire()
+    pool.acquire().close()
+    pool.close_all()
+    assert pool.stats() == {"size": 2, "open": 1, "idle": 0, "in_use": 1}
+    borrowed.close()
+    # 借出中的連線歸還後照常放回
+    assert pool.stats()["idle"] == 1
+    assert not created[0].closed
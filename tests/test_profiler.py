@@ -0,0 +1,47 @@
+import os
+import asyncio
+
+from config import config
+from utils import profiler
+
+
+def _slow_trace():
+    with profiler.trace("job", "slow"):
+        with profiler.stage("work"):
+            pass
+
+
+def test_profile_dir_keeps_newest_files_across_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "PROFILE_SLOW_MS", 0.0001)
+    monkeypatch.setattr(config, "PROFILE_KEEP", 3)
+    # 之前的行程（其他 PID）留下的明細也算在內
+    for i in range(5):
+        path = tmp_path / f"slow-20250101-000000-{1000 + i}-1.txt"
+        path.write_text("old\n")
+        os.utime(path, (i, i))
+
+    for _ in range(2):
+        _slow_trace()
+
+    files = sorted(os.listdir(tmp_path))
+    assert len(files) == 3
+    assert "slow-20250101-000000-1004-1.txt" in files
+    assert sum(f"-{os.getpid()}-" in f for f in files) == 2
+
+
+def test_no_cprofile_capture_inside_event_loop(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "PROFILE_SLOW_MS", 0.0001)
+    monkeypatch.setattr(profiler, "_capture_enabled", True)
+
+    async def handler():
+        _slow_trace()
+
+    asyncio.run(handler())
+    [coroutine_dump] = os.listdir(tmp_path)
+    assert "cProfile" not in (tmp_path / coroutine_dump).read_text(encoding="utf-8")
+
+    _slow_trace()
+    thread_dump = next(p for p in os.listdir(tmp_path) if p != coroutine_dump)
+    assert "cProfile" in (tmp_path / thread_dump).read_text(encoding="utf-8")
@@ -0,0 +1,32 @@
+from datetime import datetime
+
+import pytest
+
+from database.storage import REPLY_INSERTED, REPLY_UPDATED, REPLY_RENAMED, REPLY_UNCHANGED
+from database.memory_store import MemoryStore
+from database.sqlite_store import SQLiteStore
+from database.mysql_store import reply_outcome
+
+SESSION = datetime(2026, 1, 9)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    store = MemoryStore() if request.param == "memory" else SQLiteStore(str(tmp_path / "replies.db"))
+    store.init_db()
+    return store
+
+
+def test_outcomes(store):
+    assert store.record_reply(SESSION, "U1", "小明", "要") == REPLY_INSERTED
+    assert store.record_reply(SESSION, "U1", "小明", "要") == REPLY_UNCHANGED
+    assert store.record_reply(SESSION, "U1", "阿明", "要") == REPLY_RENAMED
+    assert store.record_reply(SESSION, "U1", "阿明", "不要") == REPLY_UPDATED
+    assert store.record_reply(SESSION, "U1", "小明", "要") == REPLY_UPDATED
+
+
+def test_mysql_reply_outcome():
+    assert reply_outcome(1) == REPLY_INSERTED
+    assert reply_outcome(2, 1) == REPLY_UPDATED
+    assert reply_outcome(0, 1) == REPLY_RENAMED
+    assert reply_outcome(0, 0) == REPLY_UNCHANGED
@@ -0,0 +1,186 @@
+import asyncio
+
+import pymysql
+
+from database import replicas
+from database.replicas import Replica, ReplicaSet, RecentWrites, parse_hosts
+from database.mysql_store import MySQLStore
+from database.async_store import AsyncMySQLStore
+
+
+class FakeCursor:
+    source = "primary"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeConn:
+    def cursor(self):
+        return FakeCursor()
+
+    def close(self):
+        pass
+
+
+class DownPool:
+    def acquire(self):
+        raise pymysql.err.OperationalError(2003, "Can't connect to MySQL server")
+
+
+def test_parse_hosts():
+    parsed = parse_hosts("r1, r2:3307,,", default_port=3306)
+    assert [(r.host, r.port) for r in parsed] == [("r1", 3306), ("r2", 3307)]
+    assert parse_hosts("") == []
+
+
+def test_replica_set_round_robin_skips_down_replicas(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(replicas.time, "monotonic", lambda: now[0])
+    r1, r2 = Replica("r1", 3306), Replica("r2", 3306)
+    rs = ReplicaSet([r1, r2], retry_seconds=30)
+
+    assert [rs.pick() for _ in range(4)] == [r1, r2, r1, r2]
+
+    rs.mark_down(r1, "timeout")
+    assert [rs.pick() for _ in range(3)] == [r2, r2, r2]
+
+    rs.mark_down(r2, "timeout")
+    assert rs.pick() is None
+
+    # 暫停期滿後恢復輪詢
+    now[0] += 30
+    assert {rs.pick(), rs.pick()} == {r1, r2}
+
+
+def test_empty_replica_set_is_falsy():
+    assert not ReplicaSet([])
+
+
+def test_read_falls_back_to_primary_when_replica_is_down(monkeypatch):
+    store = MySQLStore()
+    replica = Replica("replica-1", 3306)
+    store.replicas = ReplicaSet([replica], retry_seconds=30)
+    monkeypatch.setattr(store, "_replica_pool", lambda r: DownPool())
+    monkeypatch.setattr(store, "connection", lambda: FakeConn())
+
+    assert store._read(lambda c: c.source) == "primary"
+    assert not replica.healthy()
+    # 暫停期間不再嘗試該 replica
+    assert store.replicas.pick() is None
+
+
+class FakeAsyncCursor:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, query, args):
+        return 1
+
+    async def fetchall(self):
+        return (("U1",),)
+
+
+class FakeAsyncConn:
+    def __init__(self):
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeAsyncCursor()
+
+    async def rollback(self):
+        self.rollbacks += 1
+
+
+class FakeAsyncPool:
+    def __init__(self):
+        self.conn = FakeAsyncConn()
+
+    def acquire(self):
+        pool = self
+
+        class Acquire:
+            async def __aenter__(self):
+                return pool.conn
+
+            async def __aexit__(self, *exc):
+                return False
+        return Acquire()
+
+
+def _async_store(replica_list):
+    store = AsyncMySQLStore(MySQLStore())
+    store.replicas = ReplicaSet(replica_list, retry_seconds=30)
+    return store
+
+
+def test_async_replica_read_ends_transaction(monkeypatch):
+    replica = Replica("replica-1", 3306)
+    store = _async_store([replica])
+    pool = FakeAsyncPool()
+
+    async def replica_pool(r):
+        return pool
+    monkeypatch.setattr(store, "_replica_pool", replica_pool)
+
+    assert asyncio.run(store._read("SELECT 1", ())) == (("U1",),)
+    # autocommit=False：沒有結束交易的連線會在歸還時被 aiomysql 關閉
+    assert pool.conn.rollbacks == 1
+
+
+def test_async_read_falls_back_to_primary(monkeypatch):
+    replica = Replica("replica-1", 3306)
+    store = _async_store([replica])
+    primary = FakeAsyncPool()
+
+    async def replica_pool(r):
+        raise pymysql.err.OperationalError(2003, "Can't connect to MySQL server")
+
+    async def get_pool():
+        return primary
+    monkeypatch.setattr(store, "_replica_pool", replica_pool)
+    monkeypatch.setattr(store, "get_pool", get_pool)
+
+    assert asyncio.run(store._read("SELECT 1", ())) == (("U1",),)
+    assert not replica.healthy()
+    assert primary.conn.rollbacks == 1
+
+
+def test_recent_writes_overlay_rows():
+    recent = RecentWrites(window=60)
+    rows = [("U1", "Amy", ""), ("U2", "Ben", "1")]
+
+    recent.note("2026-01-04", "U1", "Amy", "2")        # replica 尚未看到的更新
+    recent.note("2026-01-04", "U3", "Cat", "1")        # replica 尚未看到的新成員
+    recent.note("2026-01-04", "U2", None, "0")         # update_reply 沒有名字：沿用 replica 的名字
+    recent.note("2026-01-04", "U4", None, "1")         # 沒有名字可用：略過
+    recent.note("2026-01-11", "U1", "Amy", "3")        # 其他場次不影響
+
+    merged = sorted(recent.overlay_rows("2026-01-04", rows))
+    assert merged == [("U1", "Amy", "2"), ("U2", "Ben", "0"), ("U3", "Cat", "1")]
+
+
+def test_recent_writes_keep_previous_name():
+    recent = RecentWrites(window=60)
+    recent.note("2026-01-04", "U1", "Amy", "1")
+    recent.note("2026-01-04", "U1", None, "2")
+    assert recent.get("2026-01-04", "U1") == ("Amy", "2")
+
+
+def test_recent_writes_expire_after_window(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(replicas.time, "monotonic", lambda: now[0])
+    recent = RecentWrites(window=5)
+    rows = [("U1", "Amy", "")]
+    recent.note("2026-01-04", "U1", "Amy", "2")
+    assert recent.overlay_rows("2026-01-04", rows) == [("U1", "Amy", "2")]
+
+    now[0] += 5
+    assert recent.get("2026-01-04", "U1") is None
+    assert recent.overlay_rows("2026-01-04", rows) == rows
@@ -0,0 +1,103 @@
+import os
+import glob
+import time
+import multiprocessing
+from datetime import date
+
+import pytest
+
+from database.reply_buffer import ReplyBuffer
+
+SESSION = date(2026, 1, 4)
+
+
+def _segments(journal):
+    return glob.glob(f"{journal}.*.*")
+
+
+def _fork(target, *args):
+    process = multiprocessing.get_context("fork").Process(target=target, args=args)
+    process.start()
+    process.join(30)
+    return process
+
+
+def test_failed_flush_keeps_replies_and_retries(tmp_path):
+    journal = str(tmp_path / "journal.log")
+    written = []
+    fail = [True]
+
+    def writer(rows):
+        if fail[0]:
+            raise ConnectionError("MySQL server has gone away")
+        written.extend(rows)
+
+    buffer = ReplyBuffer(writer, journal, flush_interval=60, flush_batch=1000)
+    buffer.submit(SESSION, "U1", "Amy", "要")
+    buffer.submit(SESSION, "U2", "Ben", "不要")
+
+    with pytest.raises(ConnectionError):
+        buffer.flush()
+    # 寫入失敗：回覆仍讀得到，journal 分段保留
+    assert buffer.get(SESSION, "U1") == ("Amy", "要")
+    assert len(_segments(journal)) == 1
+
+    # 失敗期間的新回覆較新，重試時優先保留
+    buffer.submit(SESSION, "U1", "Amy", "不要")
+    fail[0] = False
+    assert buffer.flush() == 2
+    assert sorted(written) == [(SESSION, "U1", "Amy", "不要"), (SESSION, "U2", "Ben", "不要")]
+    assert buffer.get(SESSION, "U1") is None
+    assert _segments(journal) == []
+    buffer.close()
+
+
+def _crash_after_submit(journal):
+    buffer = ReplyBuffer(lambda rows: None, journal, flush_interval=60, flush_batch=1000)
+    buffer.submit(SESSION, "U1", "Amy", "要")
+    buffer.submit(SESSION, "U2", "Ben", "要")
+    buffer.submit(SESSION, "U1", "Amy", "不要")
+    os._exit(1)   # 沒有 flush 就當掉
+
+
+def test_replay_after_crash(tmp_path):
+    journal = str(tmp_path / "journal.log")
+    crashed = _fork(_crash_after_submit, journal)
+    assert crashed.exitcode == 1
+    assert len(_segments(journal)) == 1
+
+    written = []
+    assert ReplyBuffer(written.extend, journal).replay() == 2
+    # 同一人只補寫最後一筆
+    assert sorted(written) == [(SESSION, "U1", "Amy", "不要"), (SESSION, "U2", "Ben", "要")]
+    assert _segments(journal) == []
+
+
+def _replay_into(journal, log_path):
+    def writer(rows):
+        time.sleep(0.2)   # 拉長補寫時間，讓兩個 worker 確實重疊
+        with open(log_path, "a") as f:
+            for _, uid, _, text in rows:
+                f.write(f"{uid} {text}\n")
+
+    ReplyBuffer(writer, journal).replay()
+
+
+def test_concurrent_replay_writes_each_segment_once(tmp_path):
+    journal = str(tmp_path / "journal.log")
+    log_path = str(tmp_path / "written.log")
+    for _ in range(3):
+        assert _fork(_crash_after_submit, journal).exitcode == 1
+    assert len(_segments(journal)) == 3
+
+    ctx = multiprocessing.get_context("fork")
+    workers = [ctx.Process(target=_replay_into, args=(journal, log_path)) for _ in range(2)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join(30)
+        assert w.exitcode == 0
+
+    with open(log_path) as f:
+        assert sorted(f.read().split("\n")[:-1]) == ["U1 不要", "U2 要"]
+    assert _segments(journal) == []
@@ -0,0 +1,26 @@
+import json
+
+from utils import roster as roster_module
+from utils.roster import Roster
+
+
+def test_malformed_file_is_parsed_once(tmp_path, monkeypatch):
+    path = tmp_path / "users_config.json"
+    path.write_text(json.dumps({"users": [{"user_id": "U1", "name": "小明"}]}), encoding="utf-8")
+    roster = Roster(str(path))
+    assert roster.get_name("U1") == "小明"
+
+    parses = []
+    loads = roster_module.json.loads
+    monkeypatch.setattr(roster_module.json, "loads", lambda s: parses.append(s) or loads(s))
+
+    path.write_text('{"users": [', encoding="utf-8")
+    for _ in range(5):
+        assert roster.refresh() is False
+    assert len(parses) == 1
+    assert roster.get_name("U1") == "小明"      # 保留舊名單
+
+    path.write_text(json.dumps({"users": [{"user_id": "U1", "name": "阿明"}]}), encoding="utf-8")
+    assert roster.refresh() is True
+    assert len(parses) == 2
+    assert roster.get_name("U1") == "阿明"
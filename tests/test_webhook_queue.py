@@ -0,0 +1,28 @@
+import time
+import threading
+
+from services.webhook_queue import WebhookQueue
+
+
+def test_shutdown_drains_pending_events():
+    handled = []
+    q = WebhookQueue(handled.append, workers=2, maxsize=10)
+    for i in range(5):
+        assert q.submit(i)
+    q.shutdown(timeout=5)
+    assert sorted(handled) == [0, 1, 2, 3, 4]
+    assert not q.submit(5)
+
+
+def test_shutdown_returns_when_queue_stays_full():
+    release = threading.Event()
+    q = WebhookQueue(lambda event: release.wait(5), workers=1, maxsize=1)
+    assert q.submit("busy")       # worker 卡在這個事件
+    time.sleep(0.05)
+    assert q.submit("queued")     # 佇列已滿
+    assert not q.submit("dropped")
+
+    start = time.monotonic()
+    q.shutdown(timeout=0.2)
+    assert time.monotonic() - start < 1
+    release.set()
@@ -0,0 +1,155 @@
+# line_api_stub.py
+"""
+本地 LINE Messaging API stub，用來測試推播 / multicast 而不打到正式 API。
+
+    python tools/line_api_stub.py --port 8089 [--fail-rate 0.1] [--latency-ms 20]
+    LINE_API_HOST=http://127.0.0.1:8089 python app.py
+
+支援：
+- POST /v2/bot/message/push、/v2/bot/message/multicast、/v2/bot/message/reply
+- GET  /stats  回傳各端點的請求數、收件人數與失敗數（JSON）
+- POST /reset  清空統計
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENDPOINTS = {
+    "/v2/bot/message/push": "push",
+    "/v2/bot/message/multicast": "multicast",
+    "/v2/bot/message/reply": "reply",
+}
+
+
+class StubState:
+    def __init__(self, fail_rate=0.0, latency_ms=0):
+        self.fail_rate = fail_rate
+        self.latency_ms = latency_ms
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stats = {
+                name: {"requests": 0, "recipients": 0, "failed": 0}
+                for name in ENDPOINTS.values()
+            }
+            self.retry_keys = set()
+            self.duplicate_retry_keys = 0
+
+    def record(self, name, recipients, failed, retry_key=None):
+        with self.lock:
+            s = self.stats[name]
+            s["requests"] += 1
+            s["recipients"] += recipients
+            s["failed"] += int(failed)
+            if retry_key and not failed:
+                if retry_key in self.retry_keys:
+                    self.duplicate_retry_keys += 1
+                self.retry_keys.add(retry_key)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "endpoints": {k: dict(v) for k, v in self.stats.items()},
+                "duplicate_retry_keys": self.duplicate_retry_keys,
+            }
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *args):
+            pass
+
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._send(200, state.snapshot())
+            else:
+                self._send(404, {"message": "Not found"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b"{}"
+
+            if self.path == "/reset":
+                state.reset()
+                self._send(200, {})
+                return
+
+            name = ENDPOINTS.get(self.path)
+            if name is None:
+                self._send(404, {"message": "Not found"})
+                return
+
+            try:
+                payload = json.loads(raw or b"{}")
+            except ValueError:
+                self._send(400, {"message": "The request body has 1 error(s)"})
+                return
+
+            if state.latency_ms:
+                time.sleep(state.latency_ms / 1000)
+
+            if name == "multicast":
+                to = payload.get("to") or []
+                if len(to) > 500:
+                    state.record(name, len(to), True)
+                    self._send(400, {"message": "Size must be between 1 and 500"})
+                    return
+                recipients = len(to)
+            else:
+                recipients = 1
+
+            failed = state.fail_rate and random.random() < state.fail_rate
+            state.record(name, recipients, failed, self.headers.get("X-Line-Retry-Key"))
+            if failed:
+                self._send(500, {"message": "Internal server error (stub)"})
+                return
+
+            messages = payload.get("messages") or []
+            if name == "multicast":
+                self._send(200, {})
+            else:
+                self._send(200, {"sentMessages": [{"id": str(i), "quoteToken": "stub"} for i, _ in enumerate(messages)]})
+
+    return Handler
+
+
+def serve(host="127.0.0.1", port=8089, fail_rate=0.0, latency_ms=0):
+    """啟動 stub（背景執行緒），回傳 (server, state)；測試程式可直接呼叫"""
+    state = StubState(fail_rate=fail_rate, latency_ms=latency_ms)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local LINE Messaging API stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="隨機回 500 的比例（0~1）")
+    parser.add_argument("--latency-ms", type=int, default=0, help="每個請求的模擬延遲")
+    args = parser.parse_args()
+
+    server, _ = serve(args.host, args.port, args.fail_rate, args.latency_ms)
+    print(f"✅ LINE API stub listening on http://{args.host}:{args.port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
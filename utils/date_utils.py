@@ -1,15 +1,50 @@
 from datetime import datetime, timedelta
 import pytz
 from config import config
+from utils.tenants import current
 
 # 設定台灣時區
 tz = pytz.timezone(config.TIMEZONE)
 
+_WEEKDAYS = {
+    "mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6,
+}
+_WEEKDAY_NAMES = "一二三四五六日"
+
+def _weekday(name):
+    return _WEEKDAYS[(name or "").strip().lower()[:3]]
+
 def get_friday():
-    """取得下一個週五的日期"""
+    """取得下一個活動日（目前群組的 BADMINTON_DAY，預設週五）的日期"""
     today = datetime.now(tz)
-    days_ahead = (4 - today.weekday() + 7) % 7  # 4 = Friday
+    days_ahead = (_weekday(current().BADMINTON_DAY) - today.weekday() + 7) % 7
     if days_ahead == 0:
-        days_ahead = 7  # 今天就是週五的話，下一個週五是 7 天後
+        days_ahead = 7  # 今天就是活動日的話，下一次是 7 天後
     next_friday = today + timedelta(days=days_ahead)
     return next_friday.strftime("%m/%d")  # e.g. 06/28
+
+def play_day_name():
+    """活動日的中文名稱，例如「五」（用於「禮拜五」）"""
+    return _WEEKDAY_NAMES[_weekday(current().BADMINTON_DAY)]
+
+def get_session_date(now=None):
+    """
+    取得目前回覆所屬的場次（活動當天的 date）。
+
+    每週在目前群組的 RESET_REPLIES_DAY RESET_REPLIES_TIME（預設週日 21:00）切換到下一場：
+    場次 = 上一次切換時間點之後的第一個 BADMINTON_DAY。
+    例如週日 21:00 之後到下週日 21:00 之前，都屬於中間那個週五。
+    """
+    now = now or datetime.now(tz)
+    tenant = current()
+    reset_wd = _weekday(tenant.RESET_REPLIES_DAY)
+    reset_h, reset_m = (int(x) for x in tenant.RESET_REPLIES_TIME.split(":"))
+    play_wd = _weekday(tenant.BADMINTON_DAY)
+
+    last_reset = now.replace(hour=reset_h, minute=reset_m, second=0, microsecond=0)
+    last_reset -= timedelta(days=(now.weekday() - reset_wd) % 7)
+    if last_reset > now:
+        last_reset -= timedelta(days=7)
+
+    days_ahead = (play_wd - last_reset.weekday()) % 7 or 7
+    return (last_reset + timedelta(days=days_ahead)).date()
@@ -0,0 +1,172 @@
+# log.py
+"""
+集中式 logging 設定（取代各模組各自掛 StreamHandler 的寫法）。
+
+    from utils.log import get_logger, log_context, sampler
+    logger = get_logger(__name__)
+
+- root 只掛一個 QueueHandler：請求執行緒只把 record 放進佇列，寫 stderr 由 QueueListener 的背景執行緒處理
+- 一律用 %-style（logger.info("... %s", x)）：等級沒開時不會格式化
+- log_context(event_id=..., user_id=...) 以 contextvars 把欄位附加到期間內的每一行
+  （各執行緒 / asyncio task 互不影響）；單行也可用 extra={"latency_ms": ...}
+- 多群組時每一行自動帶上目前的群組（tenant）
+- sampler.allow(key)：同一個 key 每秒最多 LOG_SAMPLE_PER_SEC 行，用於每則訊息都會經過的 debug log
+
+LOG_FORMAT=json 時每行輸出一個 JSON 物件。
+"""
+import os
+import sys
+import copy
+import json
+import time
+import queue
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from config import config
+from utils import metrics
+from utils.tenants import tenants, current
+
+# 結構化欄位（依此順序輸出）
+FIELDS = ("tenant", "event_id", "user_id", "latency_ms")
+
+_context = contextvars.ContextVar("log_context", default={})
+
+_setup_lock = threading.Lock()
+_handler = None
+
+
+@contextmanager
+def log_context(**fields):
+    """期間內（同一執行緒 / task）的每一行 log 都帶上這些欄位"""
+    token = _context.set({**_context.get(), **{k: v for k, v in fields.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class _ContextQueueHandler(QueueHandler):
+    """
+    在呼叫端執行緒只做：附加 context 欄位、組出訊息字串、放進佇列（滿了就丟棄並計數）。
+    fork 後（PID 不同）listener 執行緒不存在，換一個新的佇列與 listener。
+    """
+
+    def __init__(self, target, maxsize):
+        self.target = target
+        self.maxsize = maxsize
+        super().__init__(queue.Queue(maxsize))
+        self._start_listener()
+
+    def _start_listener(self):
+        self._pid = os.getpid()
+        self.queue = queue.Queue(self.maxsize)
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+        self.listener.start()
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        for key, value in _context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        if tenants.multi and not hasattr(record, "tenant"):
+            record.tenant = current().id
+        # 參數在這裡就轉成字串：之後呼叫端改動物件也不影響內容
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOG_DROPPED.inc()
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            with _setup_lock:
+                if self._pid != os.getpid():
+                    self._start_listener()
+        super().emit(record)
+
+    def close(self):
+        # logging.shutdown()（結束時自動呼叫）會走到這裡：把佇列中剩下的 log 寫完
+        listener, self.listener = self.listener, None
+        if listener is not None and self._pid == os.getpid():
+            listener.stop()
+        super().close()
+
+
+class _TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = super().format(record)
+        extra = " ".join(f"{k}={getattr(record, k)}" for k in FIELDS if getattr(record, k, None) is not None)
+        return f"{line} {extra}" if extra else line
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for k in FIELDS:
+            value = getattr(record, k, None)
+            if value is not None:
+                data[k] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+def setup_logging():
+    """設定 root logger（重複呼叫不會重複掛 handler）"""
+    global _handler
+    with _setup_lock:
+        if _handler is not None:
+            return
+        target = logging.StreamHandler(sys.stderr)
+        if config.LOG_FORMAT == "json":
+            target.setFormatter(_JsonFormatter())
+        else:
+            target.setFormatter(_TextFormatter('[%(asctime)s] [%(levelname)s] %(message)s', '%Y-%m-%d %H:%M:%S'))
+        _handler = _ContextQueueHandler(target, config.LOG_QUEUE_SIZE)
+        root = logging.getLogger()
+        root.addHandler(_handler)
+        root.setLevel(config.LOG_LEVEL)
+
+
+def get_logger(name):
+    setup_logging()
+    return logging.getLogger(name)
+
+
+class LogSampler:
+    """每個 key 每秒最多放行 per_second 次；被略過的次數記在 dropped"""
+
+    def __init__(self, per_second):
+        self.per_second = per_second
+        self._lock = threading.Lock()
+        self._windows = {}   # key -> [window_start, count]
+        self.dropped = {}
+
+    def allow(self, key) -> bool:
+        if self.per_second <= 0:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= 1.0:
+                window = self._windows[key] = [now, 0]
+            if window[1] >= self.per_second:
+                self.dropped[key] = self.dropped.get(key, 0) + 1
+                return False
+            window[1] += 1
+            return True
+
+
+sampler = LogSampler(config.LOG_SAMPLE_PER_SEC)
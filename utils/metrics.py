@@ -0,0 +1,295 @@
+# metrics.py
+"""
+輕量的 Prometheus 指標（純標準函式庫，不另外安裝 prometheus_client）。
+
+    from utils import metrics
+    metrics.DB_SECONDS.labels("record_reply").observe(0.012)
+    metrics.render()  # -> text/plain; version=0.0.4
+
+每次記錄只做一次 dict 查找 + 一把鎖內的加法，正式環境可常開。
+
+指標存在各行程的記憶體中：每筆輸出都帶 worker="<pid>" 標籤，
+多個 Gunicorn worker 時各 worker 的序列不會混在一起（合計以 sum without (worker) 計算）。
+"""
+import os
+import hmac
+import time
+import inspect
+import threading
+import functools
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_str(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    # 輸出時才取 PID：preload 後 fork 出的 worker 各自不同
+    pairs.append(f'worker="{os.getpid()}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, doc, labelnames=()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+
+class _Value:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def collect(self):
+        lines = self._header()
+        for key, child in list(self._children.items()):
+            lines.append(f"{self.name}{_label_str(self.labelnames, key)} {child.value}")
+        return lines
+
+
+class Gauge(_Metric):
+    """可直接 set，或以 set_function 在輸出時才取值（例如佇列長度、連線池狀態）"""
+    kind = "gauge"
+
+    def __init__(self, name, doc, labelnames=()):
+        super().__init__(name, doc, labelnames)
+        self._functions = {}
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, func, *label_values):
+        self._functions[tuple(str(v) for v in label_values)] = func
+
+    def collect(self):
+        lines = self._header()
+        for key, child in list(self._children.items()):
+            lines.append(f"{self.name}{_label_str(self.labelnames, key)} {child.value}")
+        for key, func in list(self._functions.items()):
+            try:
+                value = float(func())
+            except Exception:
+                continue
+            lines.append(f"{self.name}{_label_str(self.labelnames, key)} {value}")
+        return lines
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("child", "start")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.child.observe(time.perf_counter() - self.start)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def collect(self):
+        lines = self._header()
+        for key, child in list(self._children.items()):
+            with child._lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = _label_str(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            inf = _label_str(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf} {count}")
+            lines.append(f"{self.name}_sum{_label_str(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_label_str(self.labelnames, key)} {count}")
+        return lines
+
+
+_registry = []
+
+
+def _register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def check_token(authorization, token) -> bool:
+    """/metrics 的存取檢查：token（METRICS_TOKEN）未設定時不檢查，否則 Authorization 須為「Bearer <token>」"""
+    if not token:
+        return True
+    return hmac.compare_digest(authorization or "", f"Bearer {token}")
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+# 每次計時的額外通知（utils/profiler.py 用來累計單一請求 / 任務內各階段的耗時）
+_timing_listeners = []
+
+
+def add_timing_listener(listener):
+    """listener(stage, seconds)：timed() 與 record_timing() 每次計時後呼叫"""
+    _timing_listeners.append(listener)
+
+
+def record_timing(stage, seconds):
+    for listener in _timing_listeners:
+        listener(stage, seconds)
+
+
+def timed(histogram, *label_values):
+    """裝飾器：記錄函式執行時間（也可用在 async def，量的是 await 完成的時間）"""
+    def decorator(func):
+        child = histogram.labels(*label_values)
+        stage = label_values[-1] if label_values else func.__name__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    elapsed = time.perf_counter() - start
+                    child.observe(elapsed)
+                    record_timing(stage, elapsed)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                child.observe(elapsed)
+                record_timing(stage, elapsed)
+        return wrapper
+    return decorator
+
+
+# ---------- 本專案的指標 ----------
+
+WEBHOOK_SECONDS = _register(Histogram(
+    "badminton_webhook_request_seconds", "Latency of /callback requests", ["status"]))
+WEBHOOK_EVENTS = _register(Counter(
+    "badminton_webhook_events_total", "Webhook events by outcome", ["outcome"]))
+DB_SECONDS = _register(Histogram(
+    "badminton_db_call_seconds", "Latency of database/db.py calls", ["func"]))
+LINE_API_SECONDS = _register(Histogram(
+    "badminton_line_api_seconds", "Latency of outbound LINE API calls", ["endpoint"]))
+LINE_API_REQUESTS = _register(Counter(
+    "badminton_line_api_requests_total", "Outbound LINE API calls by endpoint and status", ["endpoint", "status"]))
+JOB_SECONDS = _register(Histogram(
+    "badminton_scheduler_job_seconds", "Scheduler job run time", ["job"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)))
+JOB_LAG_SECONDS = _register(Histogram(
+    "badminton_scheduler_job_lag_seconds", "Delay between scheduled and actual job start", ["job"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)))
+JOB_RUNS = _register(Counter(
+    "badminton_scheduler_job_runs_total", "Scheduler job runs by outcome", ["job", "outcome"]))
+QUEUE_DEPTH = _register(Gauge(
+    "badminton_webhook_queue_depth", "Events waiting in the webhook queue"))
+OUTBOX_DELIVERIES = _register(Counter(
+    "badminton_outbox_deliveries_total", "Outbox delivery attempts by outcome", ["kind", "outcome"]))
+REPLY_BUFFER_PENDING = _register(Gauge(
+    "badminton_reply_buffer_pending", "Replies accepted but not yet written to the database"))
+DB_POOL = _register(Gauge(
+    "badminton_db_pool_connections", "Database pool connections by state", ["state"]))
+DB_READS = _register(Counter(
+    "badminton_db_reads_total", "Read queries by target (replica / primary / fallback to primary)", ["target"]))
+DB_REPLICA_UP = _register(Gauge(
+    "badminton_db_replica_up", "Whether a read replica is currently in use (0 = paused after errors)", ["replica"]))
+STAGE_SECONDS = _register(Histogram(
+    "badminton_stage_seconds", "Time spent in each profiled stage of webhook handling and jobs", ["trace", "stage"]))
+SLOW_TRACES = _register(Counter(
+    "badminton_slow_traces_total", "Webhook events / jobs slower than PROFILE_SLOW_MS", ["trace"]))
+LOG_DROPPED = _register(Counter(
+    "badminton_log_records_dropped_total", "Log records dropped because the log queue was full"))
+STARTUP_SECONDS = _register(Gauge(
+    "badminton_startup_seconds", "Time spent in each startup phase of this process", ["phase"]))
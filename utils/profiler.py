@@ -0,0 +1,193 @@
+# profiler.py
+"""
+慢請求 / 慢任務的分析。
+
+    with profiler.trace("webhook", event_id):       # 一個 webhook 事件或排程任務
+        with profiler.stage("get_name_from_config"):
+            ...
+
+- metrics.timed() 包起來的 DB 函式與 LINE API 呼叫會自動記成 stage，不必逐一標記
+- 每個 stage 的耗時寫入 badminton_stage_seconds{trace,stage}
+- 總耗時超過 PROFILE_SLOW_MS 時，log 一行各階段耗時，並在 PROFILE_DIR 寫一份明細
+- 開啟 capture（PROFILE_CPROFILE=true，或執行中以 /admin/profile 切換）時，
+  每個 trace 以 cProfile 執行，慢的那些在明細附上 cumulative 排序的 pstats
+- PROFILE_DIR 只保留最新的 PROFILE_KEEP 份明細（所有行程、歷次啟動合計），不會塞滿磁碟
+
+trace 存在 contextvars 中：各執行緒、asyncio task 互不影響。
+cProfile 則是整個執行緒共用：在事件迴圈中（ASGI 的 coroutine）開啟會一併記錄同一迴圈上
+所有其他 task，因此只在執行緒中的 trace capture；coroutine 中的 trace 只記各階段耗時。
+"""
+import io
+import hmac
+import os
+import glob
+import time
+import asyncio
+import pstats
+import logging
+import cProfile
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+from config import config
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar("profile_trace", default=None)
+
+# cProfile 同一時間只能有一個在執行（Python 3.12 起是整個行程共用）；拿不到就略過這次 capture
+_capture_lock = threading.Lock()
+_capture_enabled = config.PROFILE_CPROFILE
+_dump_lock = threading.Lock()
+_dump_seq = 0
+
+
+class Trace:
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+        self.started = time.perf_counter()
+        self.stages = {}   # stage -> [calls, seconds]（依第一次出現順序）
+
+    def add(self, stage, seconds):
+        entry = self.stages.get(stage)
+        if entry is None:
+            self.stages[stage] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+    def breakdown(self):
+        return ", ".join(f"{stage} {seconds * 1000:.0f} ms" + (f" ×{calls}" if calls > 1 else "")
+                         for stage, (calls, seconds) in self.stages.items())
+
+
+def _on_timing(stage, seconds):
+    t = _current.get()
+    if t is not None:
+        t.add(stage, seconds)
+        metrics.STAGE_SECONDS.labels(t.kind, stage).observe(seconds)
+
+
+metrics.add_timing_listener(_on_timing)
+
+
+def capture_enabled() -> bool:
+    return _capture_enabled
+
+
+def check_admin_token(token) -> bool:
+    return bool(config.PROFILE_ADMIN_TOKEN) and hmac.compare_digest(token, config.PROFILE_ADMIN_TOKEN)
+
+
+def set_capture(enabled):
+    """執行中切換 cProfile capture（只影響本行程）"""
+    global _capture_enabled
+    _capture_enabled = bool(enabled)
+    logger.info("cProfile capture 已%s", "開啟" if _capture_enabled else "關閉")
+
+
+@contextmanager
+def stage(name):
+    """標記一段程式為 stage（不在 trace 內時只有一次 contextvar 讀取）"""
+    if _current.get() is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _on_timing(name, time.perf_counter() - start)
+
+
+@contextmanager
+def trace(kind, name=None):
+    """一個 webhook 事件或排程任務；巢狀呼叫時沿用外層的 trace"""
+    if config.PROFILE_SLOW_MS <= 0 or _current.get() is not None:
+        yield
+        return
+    t = Trace(kind, name)
+    token = _current.set(t)
+    profile = None
+    if _capture_enabled and not _in_event_loop() and _capture_lock.acquire(blocking=False):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # 其他分析工具（例如 debugger）正在使用
+            _capture_lock.release()
+            profile = None
+    try:
+        yield t
+    finally:
+        if profile is not None:
+            profile.disable()
+            _capture_lock.release()
+        _current.reset(token)
+        elapsed = time.perf_counter() - t.started
+        if elapsed * 1000 >= config.PROFILE_SLOW_MS:
+            _report(t, elapsed, profile)
+
+
+def _in_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _report(t, elapsed, profile):
+    metrics.SLOW_TRACES.labels(t.kind).inc()
+    logger.warning("慢%s %s：%.0f ms（%s）", t.kind, t.name or "", elapsed * 1000, t.breakdown() or "無已記錄的階段")
+    try:
+        _dump(t, elapsed, profile)
+    except OSError as e:
+        logger.error("寫入 profile 明細失敗: %s", e)
+
+
+def _dump(t, elapsed, profile):
+    global _dump_seq
+    lines = [
+        f"{t.kind} {t.name or ''}  {elapsed * 1000:.1f} ms  (threshold {config.PROFILE_SLOW_MS} ms)",
+        f"at {datetime.now():%Y-%m-%d %H:%M:%S}  pid {os.getpid()}",
+        "",
+        f"{'stage':<32}{'calls':>7}{'total ms':>12}",
+    ]
+    accounted = 0.0
+    for name, (calls, seconds) in t.stages.items():
+        lines.append(f"{name:<32}{calls:>7}{seconds * 1000:>12.1f}")
+        accounted += seconds
+    # stage 可能巢狀（例如 get_attendance 內含 load_attendance），合計僅供參考
+    lines.append(f"{'(other)':<32}{'':>7}{max(0.0, elapsed - accounted) * 1000:>12.1f}")
+    if profile is not None:
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).sort_stats("cumulative").print_stats(40)
+        lines += ["", "--- cProfile (cumulative, top 40) ---", out.getvalue()]
+
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+    with _dump_lock:
+        _dump_seq += 1
+        seq = _dump_seq
+    path = os.path.join(config.PROFILE_DIR, f"slow-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}-{seq}.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    _prune()
+
+
+def _prune():
+    """整個目錄只留最新的 PROFILE_KEEP 份（各 worker、歷次啟動的明細一起算）"""
+    paths = []
+    for path in glob.glob(os.path.join(glob.escape(config.PROFILE_DIR), "slow-*.txt")):
+        try:
+            paths.append((os.path.getmtime(path), path))
+        except FileNotFoundError:
+            pass   # 其他 worker 剛刪掉
+    paths.sort(reverse=True)
+    for _, path in paths[max(1, config.PROFILE_KEEP):]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
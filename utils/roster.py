@@ -0,0 +1,110 @@
+# roster.py
+"""
+users_config.json 的共用記憶體快取。
+
+檔案只在 mtime/大小變動、且內容 hash 不同時才重新解析；
+查名字是 dict O(1) 查找，不再每則訊息都開檔、掃描整份名單。
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+from utils.tenants import TenantLocal
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_USER_NAME = "未知使用者"
+
+
+class Roster:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stat_key = None      # (mtime_ns, size)；None 代表尚未載入
+        self._digest = None
+        self._data = {"users": []}
+        self._by_id = {}
+        self.version = 0           # 內容真的改變時遞增
+
+    def refresh(self) -> bool:
+        """檢查檔案是否變動，必要時重新載入。回傳內容是否有改變。"""
+        try:
+            st = os.stat(self.path)
+            stat_key = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            stat_key = ()
+
+        if stat_key == self._stat_key:
+            return False
+
+        with self._lock:
+            if stat_key == self._stat_key:
+                return False
+            return self._load(stat_key)
+
+    def _load(self, stat_key) -> bool:
+        if not stat_key:
+            logger.warning("找不到 %s，請建立此檔案", self.path)
+            self._stat_key = stat_key
+            return self._swap(None, {"users": []})
+
+        try:
+            with open(self.path, "rb") as f:
+                raw = f.read()
+        except OSError as e:
+            logger.error("配置載入錯誤: %s", e)
+            return False
+
+        digest = hashlib.sha1(raw).hexdigest()
+        if digest == self._digest:
+            # 只有 mtime 變了（例如 touch 或重新部署），內容相同就不重建
+            self._stat_key = stat_key
+            return False
+
+        try:
+            data = json.loads(raw.decode("utf-8"))
+        except Exception as e:
+            # 解析失敗（例如編輯到一半）時保留舊名單；記住這個檔案狀態，下次檔案變動再試
+            logger.error("配置載入錯誤: %s", e)
+            self._stat_key = stat_key
+            return False
+
+        self._stat_key = stat_key
+        return self._swap(digest, data)
+
+    def _swap(self, digest, data) -> bool:
+        by_id = {}
+        for user in data.get("users", []):
+            uid = user.get("user_id")
+            if uid and uid not in by_id:
+                by_id[uid] = user
+        # 整份替換，讀取端不需要加鎖
+        self._data, self._by_id, self._digest = data, by_id, digest
+        self.version += 1
+        logger.info("已載入使用者名單：%d 人（version %d）", len(by_id), self.version)
+        return True
+
+    # ---------- 查詢 ----------
+
+    def get_config(self) -> dict:
+        """回傳完整設定內容（與 users_config.json 相同結構）"""
+        self.refresh()
+        return self._data
+
+    def get_users(self) -> list:
+        return self.get_config().get("users", [])
+
+    def get_user(self, user_id):
+        self.refresh()
+        return self._by_id.get(user_id)
+
+    def get_name(self, user_id, default=UNKNOWN_USER_NAME) -> str:
+        user = self.get_user(user_id)
+        if user is None:
+            return default
+        return user.get("name", default)
+
+
+# 全域共用實例（每個群組各自的名單檔）
+roster = TenantLocal(lambda tenant: Roster(tenant.USERS_CONFIG_PATH))
@@ -0,0 +1,46 @@
+# startup.py
+"""
+啟動耗時量測。
+
+    from utils import startup      # 越早匯入越好：從這裡開始計時
+    ...
+    startup.mark("import")         # 記錄距離上一個 mark 的耗時
+    startup.done("app")            # 印出各階段與總耗時
+
+各階段寫入 badminton_startup_seconds{phase}，可在 /metrics 看到每次部署的啟動時間。
+"""
+import time
+import logging
+from utils import metrics
+
+# 不在這裡設定 handler（保持輕量）：由 utils/log.py 的 root handler 輸出
+logger = logging.getLogger(__name__)
+
+_started = time.perf_counter()
+_last = _started
+phases = {}
+
+
+def mark(phase):
+    """記錄上一個 mark（或開始計時）到現在的耗時"""
+    global _last
+    now = time.perf_counter()
+    elapsed = now - _last
+    _last = now
+    phases[phase] = elapsed
+    metrics.STARTUP_SECONDS.labels(phase).set(elapsed)
+    return elapsed
+
+
+def done(label="app"):
+    total = time.perf_counter() - _started
+    metrics.STARTUP_SECONDS.labels("total").set(total)
+    detail = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in phases.items())
+    logger.info("%s 啟動完成：%.0f ms（%s）", label, total * 1000, detail)
+    return total
+
+
+def worker_ready(seconds):
+    """Gunicorn worker 從 fork 到可接受請求的時間（gunicorn.conf.py 呼叫）"""
+    metrics.STARTUP_SECONDS.labels("worker_boot").set(seconds)
+    logger.info("worker 啟動完成：%.0f ms", seconds * 1000)
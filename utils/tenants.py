@@ -0,0 +1,213 @@
+# tenants.py
+"""
+多群組（multi-tenant）：同一個行程服務多個 LINE channel / 球隊。
+
+TENANTS_CONFIG_PATH 未設定時只有一個群組（default），設定完全沿用 Config，
+資料表、journal、排程任務 ID 與單一群組時相同。設定後依檔案載入各群組：
+
+    {"tenants": [
+      {"id": "xinyi",
+       "destination": "U0123...",                       # webhook 的 destination（bot 的 user ID）
+       "channel_secret": "${XINYI_CHANNEL_SECRET}",      # 可用 ${ENV} 引用環境變數
+       "channel_access_token": "${XINYI_CHANNEL_ACCESS_TOKEN}",
+       "users_config": "users_xinyi.json",
+       "location": "臺北市信義區信義國民小學", "time": "18:00-20:00", "day": "friday",
+       "reset_day": "sun", "reset_time": "21:00",
+       "keywords": {"yes": ["要"], "no": ["不要"]},
+       "db_table": "badminton_reply_xinyi"}            # 預設 <DB_TABLE>_<id>
+    ]}
+
+目前的群組存在 contextvars 中（with use(tenant)）：webhook 依 destination、排程依任務所屬群組設定，
+之後 DB、名單、訊息內容、LINE API token 都依目前群組取用；排程器、DB 連線池與 HTTP 連線池全部群組共用。
+"""
+import os
+import json
+import threading
+import contextvars
+from contextlib import contextmanager
+from config import config
+
+# 檔案欄位 -> Config 屬性名稱（Tenant 以同樣的名稱提供，CommandRouter 等可直接把 Tenant 當 cfg 使用）
+FIELDS = {
+    "channel_secret": "LINE_CHANNEL_SECRET",
+    "channel_access_token": "LINE_CHANNEL_ACCESS_TOKEN",
+    "users_config": "USERS_CONFIG_PATH",
+    "location": "BADMINTON_LOCATION",
+    "time": "BADMINTON_TIME",
+    "day": "BADMINTON_DAY",
+    "reset_day": "RESET_REPLIES_DAY",
+    "reset_time": "RESET_REPLIES_TIME",
+    "db_table": "DB_TABLE",
+}
+KEYWORD_FIELDS = {
+    "yes": "YES_KEYWORDS",
+    "no": "NO_KEYWORDS",
+    "stat": "STAT_KEYWORDS",
+    "notify": "NOTIFY_KEYWORDS",
+    "help": "HELP_KEYWORDS",
+    "map": "MAP_KEYWORDS",
+}
+# 可寫成 ${ENV} 的欄位（憑證不必放進設定檔）
+_EXPAND = ("channel_secret", "channel_access_token", "destination")
+
+DEFAULT_TENANT_ID = "default"
+
+
+class Tenant:
+    """一個群組的設定；沒有覆寫的屬性沿用 Config"""
+
+    def __init__(self, tenant_id, settings=None, destination=None, legacy=False):
+        self.id = tenant_id
+        self.destination = destination
+        # 單一群組（沒有設定檔）時不加前綴，排程任務 ID 與先前相同
+        self.key_prefix = "" if legacy else f"{tenant_id}:"
+        self.legacy = legacy
+        for name, value in (settings or {}).items():
+            setattr(self, name, value)
+        self._locals = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # 只有實例上沒有的屬性才會走到這裡
+        if name.isupper():
+            return getattr(config, name)
+        raise AttributeError(name)
+
+    def __repr__(self):
+        return f"<Tenant {self.id}>"
+
+    def local(self, key, factory):
+        """本群組專屬的物件（第一次使用時由 factory(tenant) 建立）"""
+        value = self._locals.get(key)
+        if value is None:
+            with self._lock:
+                value = self._locals.get(key)
+                if value is None:
+                    value = self._locals[key] = factory(self)
+        return value
+
+
+def _parse(entry):
+    tenant_id = str(entry["id"])
+    entry = {k: os.path.expandvars(v) if k in _EXPAND and isinstance(v, str) else v for k, v in entry.items()}
+    settings = {attr: entry[key] for key, attr in FIELDS.items() if key in entry}
+    settings.setdefault("DB_TABLE", f"{config.DB_TABLE}_{tenant_id}")
+    for key, attr in KEYWORD_FIELDS.items():
+        if key in entry.get("keywords", {}):
+            settings[attr] = list(entry["keywords"][key])
+    return Tenant(tenant_id, settings, destination=entry.get("destination"))
+
+
+class TenantRegistry:
+    def __init__(self, path=None):
+        self.path = path
+        if not path:
+            self._tenants = [Tenant(DEFAULT_TENANT_ID, legacy=True)]
+        else:
+            with open(path, encoding="utf-8") as f:
+                self._tenants = [_parse(entry) for entry in json.load(f).get("tenants", [])]
+            if not self._tenants:
+                raise ValueError(f"{path} 沒有任何群組")
+        self._by_id = {t.id: t for t in self._tenants}
+        self._by_destination = {t.destination: t for t in self._tenants if t.destination}
+        # 沒有指定群組時（啟動、工具程式）使用第一個
+        self.default = self._tenants[0]
+
+    @property
+    def multi(self) -> bool:
+        return not self.default.legacy
+
+    def all(self) -> list:
+        return list(self._tenants)
+
+    def get(self, tenant_id):
+        return self._by_id.get(tenant_id)
+
+    def for_destination(self, destination):
+        """webhook 依 destination 找群組；單一群組時一律是 default"""
+        if not self.multi:
+            return self.default
+        return self._by_destination.get(destination)
+
+    def for_webhook(self, body):
+        """依 webhook body 的 destination（收到訊息的 bot）找群組；單一群組時不解析 body"""
+        if not self.multi:
+            return self.default
+        try:
+            destination = json.loads(body).get("destination")
+        except (ValueError, AttributeError):
+            return None
+        return self.for_destination(destination)
+
+    def missing_settings(self) -> list:
+        """多群組時各群組缺少的必要設定，例如 ["xinyi.destination"]"""
+        if not self.multi:
+            return []
+        missing = []
+        for t in self._tenants:
+            for name, value in (("destination", t.destination),
+                                ("channel_secret", t.LINE_CHANNEL_SECRET),
+                                ("channel_access_token", t.LINE_CHANNEL_ACCESS_TOKEN)):
+                if not value:
+                    missing.append(f"{t.id}.{name}")
+        return missing
+
+
+tenants = TenantRegistry(config.TENANTS_CONFIG_PATH)
+
+_current = contextvars.ContextVar("tenant", default=None)
+
+
+def current() -> Tenant:
+    return _current.get() or tenants.default
+
+
+@contextmanager
+def use(tenant):
+    """期間內（同一執行緒 / task）的 DB、名單、LINE API 都屬於這個群組"""
+    token = _current.set(tenant)
+    try:
+        yield tenant
+    finally:
+        _current.reset(token)
+
+
+def each():
+    """依序在每個群組中執行：for tenant in each(): ..."""
+    for tenant in tenants.all():
+        with use(tenant):
+            yield tenant
+
+
+class TenantLocal:
+    """
+    每個群組各一份的物件，屬性存取轉給目前群組的那一份：
+
+        roster = TenantLocal(lambda t: Roster(t.USERS_CONFIG_PATH))
+        roster.get_name(user_id)   # 目前群組的名單
+
+    with、len() 等特殊方法不會轉發，需要物件本身時用 instance()。
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+
+    def instance(self, tenant=None):
+        return (tenant or current()).local(self, self._factory)
+
+    def set(self, value, tenant=None):
+        tenant = tenant or current()
+        with tenant._lock:
+            tenant._locals[self] = value
+
+    def clear(self):
+        for t in tenants.all():
+            with t._lock:
+                t._locals.pop(self, None)
+
+    def created(self) -> list:
+        """已建立的各群組物件（不會為尚未使用的群組建立）"""
+        return [t._locals[self] for t in tenants.all() if self in t._locals]
+
+    def __getattr__(self, name):
+        return getattr(self.instance(), name)